@@ -0,0 +1,323 @@
+import json
+import mmap
+import os
+import re
+import threading
+import unicodedata
+import zlib
+from difflib import SequenceMatcher
+
+import numpy as np
+
+import constants
+from locks import file_lock
+
+CYRILLIC_TO_LATIN = str.maketrans({
+    "а": "a", "б": "b", "в": "v", "г": "g", "д": "d", "е": "e", "ё": "e", "ж": "zh", "з": "z", "и": "i", "й": "i",
+    "к": "k", "л": "l", "м": "m", "н": "n", "о": "o", "п": "p", "р": "r", "с": "s", "т": "t", "у": "u", "ф": "f",
+    "х": "kh", "ц": "ts", "ч": "ch", "ш": "sh", "щ": "shch", "ъ": "", "ы": "y", "ь": "", "э": "e", "ю": "yu",
+    "я": "ya"
+})
+NON_WORD_RE = re.compile(r"[\W_]+")
+SIMPLE_SEARCH_PARAMS = {"q", "format"}
+MAGIC = 0x5849414E  # "NAIX"
+VERSION = 3
+HEADER = np.dtype([
+    ("magic", "<u8"), ("version", "<u8"), ("documents", "<u8"), ("trigrams", "<u8"), ("postings", "<u8"),
+    ("responses", "<u8"), ("blob_bytes", "<u8"), ("text_bytes", "<u8")
+])
+
+
+def normalize_address(text):
+    """
+    Адрес в сравнимый вид: NFKC, casefold, кириллица транслитерируется в латиницу, диакритика убирается,
+    знаки препинания становятся пробелами. "Saint-Petersburg, Загребский бульвар 9" -> "saint petersburg zagrebskii
+    bulvar 9"
+    """
+    text = unicodedata.normalize("NFKC", text).casefold().translate(CYRILLIC_TO_LATIN)
+    text = "".join(char for char in unicodedata.normalize("NFKD", text) if not unicodedata.combining(char))
+    return NON_WORD_RE.sub(" ", text).strip()
+
+
+def trigrams(text):
+    """
+    Множество хэшей триграмм слов нормализованного адреса. Триграммы берутся по каждому слову с пробелами по краям,
+    так что порядок слов на сходство не влияет
+    """
+    hashes = set()
+    for token in normalize_address(text).split():
+        padded = f" {token} "
+        for start in range(len(padded) - 2):
+            hashes.add(zlib.crc32(padded[start:start + 3].encode("utf-8")))
+    return hashes
+
+
+def match_key(text, response_format=""):
+    """
+    Хэш номеров (слов с цифрами - номер дома, корпус, индекс) адреса и формата ответа. "Amanda Way 5" и "Amanda Way 7"
+    похожи по триграммам почти полностью, а ответы в json и jsonv2 различаются полями, поэтому ответ из индекса
+    отдаётся, только если совпадают и номера, и формат
+    """
+    numbers = sorted(token for token in normalize_address(text).split() if any(char.isdigit() for char in token))
+    return zlib.crc32(f"{' '.join(numbers)}\0{response_format}".encode("utf-8"))
+
+
+def tokens_covered(tokens, other_tokens, similarity=constants.ADDRESS_INDEX_TOKEN_SIMILARITY):
+    """
+    У каждого слова из tokens есть похожее (то же или с опечаткой, по difflib) слово в other_tokens
+    """
+    return all(
+        token in other_tokens
+        or any(SequenceMatcher(None, token, other).ratio() >= similarity for other in other_tokens)
+        for token in tokens
+    )
+
+
+def simple_query(params):
+    """
+    Пара (строка q, format) из params простого поиска или None, если в запросе есть что-то кроме q и format
+    (limit, countrycodes, структурированный адрес) - такие ответы из индекса не отдаются. Без format - пустая строка
+    """
+    params = params if isinstance(params, dict) else dict(params or ())
+    if not params.get("q") or not set(params) <= SIMPLE_SEARCH_PARAMS:
+        return None
+    return str(params["q"]), str(params.get("format") or "")
+
+
+def _aligned(offset):
+    return (offset + 7) // 8 * 8
+
+
+def build_index(entries, path):
+    """
+    Запись индекса в бинарный файл. entries - тройки (строка запроса, format запроса, ответ api). Документы
+    индекса - нормализованные строки запросов и display_name первого места из ответа, каждый указывает на свой
+    ответ. Формат: заголовок, отсортированные хэши триграмм со смещениями в массив документов (инвертированный
+    индекс), число триграмм, match_key и номер ответа каждого документа, ответы в json и тексты документов (для
+    проверки по словам). Всё выровнено по 8 байт, чтобы массивы читались из mmap без копирования
+    """
+    documents = {}
+    responses = []
+    for query, response_format, response in entries:
+        response_id = len(responses)
+        responses.append(json.dumps(response, ensure_ascii=False).encode("utf-8"))
+        for text in (query, response[0].get("display_name", "")):
+            normalized = normalize_address(text)
+            if normalized:
+                documents[normalized, response_format] = response_id
+
+    postings_by_trigram = {}
+    document_sizes = np.zeros(len(documents), dtype="<u4")
+    document_numbers = np.zeros(len(documents), dtype="<u4")
+    document_responses = np.zeros(len(documents), dtype="<u4")
+    for document_id, ((text, response_format), response_id) in enumerate(documents.items()):
+        document_trigrams = trigrams(text)
+        document_sizes[document_id] = len(document_trigrams)
+        document_numbers[document_id] = match_key(text, response_format)
+        document_responses[document_id] = response_id
+        for trigram in document_trigrams:
+            postings_by_trigram.setdefault(trigram, []).append(document_id)
+
+    keys = np.array(sorted(postings_by_trigram), dtype="<u4")
+    key_offsets = np.zeros(len(keys) + 1, dtype="<u8")
+    key_offsets[1:] = np.cumsum([len(postings_by_trigram[int(key)]) for key in keys])
+    postings = np.array(
+        [document_id for key in keys for document_id in postings_by_trigram[int(key)]], dtype="<u4"
+    )
+    response_offsets = np.zeros(len(responses) + 1, dtype="<u8")
+    response_offsets[1:] = np.cumsum([len(response) for response in responses])
+    blob = np.frombuffer(b"".join(responses), dtype=np.uint8)
+    texts = [text.encode("utf-8") for text, _ in documents]
+    text_offsets = np.zeros(len(texts) + 1, dtype="<u8")
+    text_offsets[1:] = np.cumsum([len(text) for text in texts])
+    text_blob = np.frombuffer(b"".join(texts), dtype=np.uint8)
+    header = np.array(
+        [(MAGIC, VERSION, len(documents), len(keys), len(postings), len(responses), len(blob), len(text_blob))],
+        dtype=HEADER
+    )
+
+    temporary_path = f"{path}.{os.getpid()}.tmp"
+    with open(temporary_path, "wb") as index_file:
+        arrays = (
+            header, keys, key_offsets, postings, document_sizes, document_numbers, document_responses,
+            response_offsets, blob, text_offsets, text_blob
+        )
+        for array in arrays:
+            index_file.write(array.tobytes())
+            index_file.write(b"\0" * (_aligned(index_file.tell()) - index_file.tell()))
+    os.replace(temporary_path, path)
+    return len(documents)
+
+
+def read_log(log_path):
+    """
+    Записи журнала пополнения индекса; при повторе одного запроса в том же формате берётся последний ответ
+    """
+    entries = {}
+    if not os.path.exists(log_path):
+        return entries
+    with open(log_path, encoding="utf-8") as log_file:
+        for line in log_file:
+            if line.strip():
+                entry = json.loads(line)
+                response_format = entry.get("format", "")
+                key = (normalize_address(entry["q"]), response_format)
+                entries[key] = (entry["q"], response_format, entry["response"])
+    return entries
+
+
+def rebuild(path):
+    """
+    Пересборка индекса из журнала пополнения (на мастере xdist в конце прогона). Журнал заодно сжимается:
+    в нём остаётся по одной записи на запрос
+    """
+    log_path = f"{path}.log"
+    with file_lock(f"{path}.lock"):
+        entries = read_log(log_path)
+        if not entries:
+            return 0
+        temporary_path = f"{log_path}.{os.getpid()}.tmp"
+        with open(temporary_path, "w", encoding="utf-8") as log_file:
+            for query, response_format, response in entries.values():
+                entry = {"q": query, "format": response_format, "response": response}
+                log_file.write(json.dumps(entry, ensure_ascii=False) + "\n")
+        os.replace(temporary_path, log_path)
+        return build_index(entries.values(), path)
+
+
+class AddressIndex:
+    def __init__(self, path, similarity=constants.ADDRESS_INDEX_SIMILARITY):
+        """
+        Локальный индекс прямого геокодинга по уже разрешённым адресам. Файл индекса отображается в память (mmap)
+        только для чтения, поэтому загружается мгновенно, а воркеры xdist делят одни и те же страницы без копирования.
+        Запрос простого поиска ищется по триграммам: ответ берётся из индекса, если он получен в том же format,
+        сходство (коэффициент Жаккара по множествам триграмм) с запросом или display_name известного места
+        не меньше similarity, а слова запроса и известного адреса покрывают друг друга (tokens_covered) - так
+        "Tower London" не получает ответ на "Tower Bridge, London", хотя по триграммам они похожи.
+        Новые ответы api не меняют файл, а дописываются в журнал path.log; индекс пересобирается из него
+        в конце прогона (rebuild)
+        """
+        self.path = path
+        self.similarity = similarity
+        self.log_path = f"{path}.log"
+        self.hits = 0
+        self.misses = 0
+        self.ingested = 0
+        self._lock = threading.Lock()
+        self._map = None
+        self._file_id = None
+        self.documents = 0
+        self.refresh()
+
+    def __len__(self):
+        return self.documents
+
+    def refresh(self):
+        """
+        Переоткрывает файл индекса, если он сменился с прошлого открытия (rebuild заменяет файл целиком).
+        Клиент под runner_daemon живёт дольше прогона и без этого не видел бы ответы, добавленные прошлыми прогонами
+        """
+        try:
+            stat = os.stat(self.path)
+            file_id = (stat.st_ino, stat.st_mtime_ns, stat.st_size)
+        except FileNotFoundError:
+            file_id = None
+        if file_id == self._file_id:
+            return False
+        if file_id is None or not file_id[2]:
+            self._map = None
+            self.documents = 0
+        else:
+            self._open()
+        self._file_id = file_id
+        return True
+
+    def _open(self):
+        # старое отображение не закрывается явно: на него могут ссылаться массивы из идущего поиска
+        with open(self.path, "rb") as index_file:
+            self._map = mmap.mmap(index_file.fileno(), 0, access=mmap.ACCESS_READ)
+        header = np.frombuffer(self._map, dtype=HEADER, count=1)[0]
+        if header["magic"] != MAGIC or header["version"] != VERSION:
+            raise ValueError(f"{self.path} is not an address index of version {VERSION}")
+        offset = HEADER.itemsize
+        arrays = []
+        for dtype, count in (
+            ("<u4", header["trigrams"]), ("<u8", header["trigrams"] + 1), ("<u4", header["postings"]),
+            ("<u4", header["documents"]), ("<u4", header["documents"]), ("<u4", header["documents"]),
+            ("<u8", header["responses"] + 1), (np.uint8, header["blob_bytes"]), ("<u8", header["documents"] + 1),
+            (np.uint8, header["text_bytes"])
+        ):
+            offset = _aligned(offset)
+            array = np.frombuffer(self._map, dtype=dtype, count=int(count), offset=offset)
+            arrays.append(array)
+            offset += array.nbytes
+        (self.keys, self.key_offsets, self.postings, self.document_sizes, self.document_numbers,
+         self.document_responses, self.response_offsets, self.blob, self.text_offsets, self.text_blob) = arrays
+        self.documents = int(header["documents"])
+
+    def _text(self, document_id):
+        start, end = int(self.text_offsets[document_id]), int(self.text_offsets[document_id + 1])
+        return self.text_blob[start:end].tobytes().decode("utf-8")
+
+    def search(self, query, response_format=""):
+        """
+        Ответ самого похожего известного адреса с теми же номерами, форматом ответа и словами (с точностью
+        до опечаток) и его сходство с query, или (None, 0.0), если такого нет. По словам проверяются
+        constants.ADDRESS_INDEX_CANDIDATES самых похожих по триграммам кандидатов
+        """
+        if not self.documents:
+            return None, 0.0
+        query_trigrams = np.fromiter(trigrams(query), dtype="<u4")
+        positions = np.minimum(np.searchsorted(self.keys, query_trigrams), len(self.keys) - 1)
+        positions = positions[self.keys[positions] == query_trigrams]
+        if not len(positions):
+            return None, 0.0
+        postings = np.concatenate([
+            self.postings[self.key_offsets[position]:self.key_offsets[position + 1]] for position in positions
+        ])
+        document_ids, shared = np.unique(postings, return_counts=True)
+        similarities = shared / (len(query_trigrams) + self.document_sizes[document_ids] - shared)
+        similarities[self.document_numbers[document_ids] != match_key(query, response_format)] = 0.0
+        query_tokens = normalize_address(query).split()
+        for best in np.argsort(-similarities, kind="stable")[:constants.ADDRESS_INDEX_CANDIDATES]:
+            if similarities[best] == 0.0:
+                break
+            document_tokens = self._text(int(document_ids[best])).split()
+            if not (tokens_covered(query_tokens, document_tokens) and tokens_covered(document_tokens, query_tokens)):
+                continue
+            response_id = int(self.document_responses[document_ids[best]])
+            start, end = int(self.response_offsets[response_id]), int(self.response_offsets[response_id + 1])
+            return json.loads(self.blob[start:end].tobytes()), float(similarities[best])
+        return None, 0.0
+
+    def lookup(self, query, response_format=""):
+        """
+        Ответ из индекса, если похожий адрес уже разрешался в том же формате, иначе None
+        """
+        response, similarity = self.search(query, response_format)
+        with self._lock:
+            if response is None or similarity < self.similarity:
+                self.misses += 1
+                return None
+            self.hits += 1
+            return response
+
+    def ingest(self, query, response, response_format=""):
+        """
+        Дописывает ответ api на запрос в формате response_format в журнал пополнения. Пустые ответы не запоминаются
+        """
+        if not response:
+            return
+        line = json.dumps({"q": query, "format": response_format, "response": response}, ensure_ascii=False) + "\n"
+        with file_lock(f"{self.path}.lock"):
+            with open(self.log_path, "a", encoding="utf-8") as log_file:
+                log_file.write(line)
+        with self._lock:
+            self.ingested += 1
+
+    def stats(self):
+        """
+        Счётчики этого клиента. Размер индекса сюда не входит: при сложении по воркерам xdist он бы умножался
+        на их число, поэтому в отчёт его один раз добавляет мастер после rebuild
+        """
+        return {"hits": self.hits, "misses": self.misses, "ingested": self.ingested}
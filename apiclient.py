@@ -1,15 +1,222 @@
+import asyncio
+import functools
+import json
+import random
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed, wait
 from urllib.parse import urljoin
 
 import requests
+from requests.adapters import HTTPAdapter
+from urllib3.connection import HTTPConnection, HTTPSConnection
+from urllib3.connectionpool import HTTPConnectionPool, HTTPSConnectionPool
+from urllib3.poolmanager import PoolManager
+
+import apis
+import constants
+import timing
+from address_index import simple_query
+from builder import LookupQuery, normalize_osm_id, osm_id_of
+from cache import cache_key
+from ratelimit import parse_retry_after
+from results import json_loads, to_places
+from router import DeadlineExceeded, Router
 
 
 class JSONErrorException(Exception):
     pass
 
 
+_NOT_JSON = object()
+
+
+class InstrumentedHTTPConnection(HTTPConnection):
+    on_connect = None
+
+    def connect(self):
+        started = time.perf_counter()
+        super().connect()
+        if self.on_connect is not None:
+            self.on_connect(time.perf_counter() - started, 0.0)
+
+
+class InstrumentedHTTPSConnection(HTTPSConnection):
+    """
+    HTTPS соединение, которое отдельно замеряет установку TCP соединения и TLS рукопожатие
+    """
+
+    on_connect = None
+    _tcp_time = 0.0
+
+    def _new_conn(self):
+        started = time.perf_counter()
+        conn = super()._new_conn()
+        self._tcp_time = time.perf_counter() - started
+        return conn
+
+    def connect(self):
+        started = time.perf_counter()
+        super().connect()
+        if self.on_connect is not None:
+            self.on_connect(self._tcp_time, time.perf_counter() - started - self._tcp_time)
+
+
+class InstrumentedHTTPConnectionPool(HTTPConnectionPool):
+    ConnectionCls = InstrumentedHTTPConnection
+    on_connect = None
+
+    def _new_conn(self):
+        conn = super()._new_conn()
+        conn.on_connect = self.on_connect
+        return conn
+
+
+class InstrumentedHTTPSConnectionPool(HTTPSConnectionPool):
+    ConnectionCls = InstrumentedHTTPSConnection
+    on_connect = None
+
+    def _new_conn(self):
+        conn = super()._new_conn()
+        conn.on_connect = self.on_connect
+        return conn
+
+
+class InstrumentedPoolManager(PoolManager):
+    """
+    PoolManager, который считает реальные установки соединений (TCP + TLS рукопожатия) и передаёт их время
+    в замер текущего запроса. Объект соединения urllib3 может переподключаться сам, поэтому считаются вызовы connect,
+    а не созданные объекты
+    """
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.pool_classes_by_scheme = {
+            "http": InstrumentedHTTPConnectionPool,
+            "https": InstrumentedHTTPSConnectionPool
+        }
+        self.connects = 0
+        self._connects_lock = threading.Lock()
+
+    def _count_connect(self, tcp_seconds, tls_seconds):
+        with self._connects_lock:
+            self.connects += 1
+        timing.record_connect(tcp_seconds, tls_seconds)
+
+    def _new_pool(self, scheme, host, port, request_context=None):
+        pool = super()._new_pool(scheme, host, port, request_context=request_context)
+        pool.on_connect = self._count_connect
+        return pool
+
+
+class PooledHTTPAdapter(HTTPAdapter):
+    """
+    Адаптер requests с пулом соединений, считающим и замеряющим установленные соединения
+    """
+
+    def init_poolmanager(self, connections, maxsize, block=False, **pool_kwargs):
+        self._pool_connections = connections
+        self._pool_maxsize = maxsize
+        self._pool_block = block
+        self.poolmanager = InstrumentedPoolManager(
+            num_pools=connections, maxsize=maxsize, block=block, strict=True, **pool_kwargs
+        )
+
+
 class ApiClient:
-    def __init__(self, base_url: str):
-        self.base_url = base_url
+    def __init__(
+        self,
+        base_url,
+        pool_connections=constants.DEFAULT_POOL_CONNECTIONS,
+        pool_maxsize=constants.DEFAULT_POOL_MAXSIZE,
+        pool_block=False,
+        keep_alive=True,
+        cache=None,
+        reverse_index=None,
+        rate_limiter=None,
+        max_retries=constants.DEFAULT_MAX_RETRIES,
+        single_flight=None,
+        timeout=None,
+        deadline=None,
+        hedge=False,
+        address_index=None
+    ):
+        """
+        Клиент держит одну долгоживущую requests.Session на процесс (то есть на воркер xdist), поэтому TCP/TLS
+        соединения с сервером переиспользуются между запросами, а не открываются заново на каждый тест.
+        pool_connections - сколько хостов держать в пуле, pool_maxsize - сколько соединений держать на один хост,
+        pool_block - ждать ли освободившегося соединения вместо открытия лишнего сверх pool_maxsize.
+        cache - необязательный cache.ResponseCache, через который пропускаются GET-запросы с jsonify.
+        reverse_index - необязательный spatial_index.ReverseIndex: успешные ответы обратного геокодинга запоминаются
+        в нём, а запросы рядом с уже разрешёнными точками обслуживаются из него без обращения к api.
+        rate_limiter - необязательный ratelimit.SharedTokenBucket, общий для всех воркеров xdist на машине: каждый
+        запрос в сеть ждёт свой токен. Ответы 429/503 повторяются до max_retries раз с экспоненциальной паузой
+        со случайным разбросом (или паузой из Retry-After), и только после этого код ответа проверяется.
+        single_flight - необязательный singleflight.SingleFlight: одинаковые GET-запросы с jsonify, отправленные
+        одновременно, ждут один запрос к api и получают его разобранный ответ.
+        base_url может быть списком адресов: тогда каждый запрос уходит на лучший сейчас сервер (router.Router
+        по скользящим задержке и доле ошибок), при ошибке соединения повторяется на следующем, а с hedge=True,
+        если ответа нет дольше p95 задержки сервера, дублируется на второй сервер - берётся ответ, пришедший первым.
+        address_index - необязательный address_index.AddressIndex: простой поиск (только q) по адресу, похожему
+        на уже разрешённый, обслуживается из него, а успешные ответы api дописываются в его журнал.
+        timeout - таймаут одной попытки в секундах, deadline - бюджет на весь запрос со всеми повторами,
+        после которого бросается router.DeadlineExceeded.
+        cassette - кассета cassette.Cassette текущего теста, её на время теста выставляет фикстура из conftest.
+        После каждого запроса все функции из timing_hooks получают его замер timing.RequestTiming, помеченный
+        тегами из timing_tags (например, node id теста).
+        profiler - profiling.Profiler при --profile/--profile-mem, каждый запрос выполняется внутри его profiling()
+        """
+        base_urls = [base_url] if isinstance(base_url, str) else list(base_url)
+        self.base_url = base_urls[0]
+        self.router = Router(base_urls) if len(base_urls) > 1 else None
+        self.timeout = timeout
+        self.deadline = deadline
+        self.hedge = hedge
+        self._hedge_executor = None
+        if hedge and self.router is not None:
+            self._hedge_executor = ThreadPoolExecutor(max_workers=2 * pool_maxsize)
+        self.adapter = PooledHTTPAdapter(
+            pool_connections=pool_connections,
+            pool_maxsize=pool_maxsize,
+            pool_block=pool_block
+        )
+        self.session = requests.Session()
+        self.session.mount("http://", self.adapter)
+        self.session.mount("https://", self.adapter)
+        if not keep_alive:
+            self.session.headers["Connection"] = "close"
+        self.cache = cache
+        self.reverse_index = reverse_index
+        self.address_index = address_index
+        self.rate_limiter = rate_limiter
+        self.max_retries = max_retries
+        self.retries = 0
+        self.single_flight = single_flight
+        self.cassette = None
+        self.timing_tags = {}
+        self.timing_hooks = []
+        self.profiler = None
+        self.requests_sent = 0
+        self._stats_lock = threading.Lock()
+
+    def close(self):
+        if self._hedge_executor is not None:
+            self._hedge_executor.shutdown(wait=True)
+        self.session.close()
+        if self.cache is not None:
+            self.cache.close()
+
+    def connection_stats(self):
+        """
+        Сколько запросов ушло в сеть, сколько соединений для этого пришлось открыть и сколько раз
+        соединение было переиспользовано (reused = requests - connections)
+        """
+        connections = self.adapter.poolmanager.connects
+        return {
+            "requests": self.requests_sent,
+            "connections": connections,
+            "reused": max(self.requests_sent - connections, 0)
+        }
 
     def request_custom(
         self,
@@ -19,7 +226,8 @@ class ApiClient:
         params=None,
         expected_status=200,
         jsonify=True,
-        base_url_join=True
+        base_url_join=True,
+        places=False
     ):
         """
         Кастомный метод запроса, позволяет сразу же проверить код ответа и выполнить jsonify для тела ответа,
@@ -27,7 +235,12 @@ class ApiClient:
         юрла можно отключить через параметр base_url_join, тем самым получив возможность самостоятельно прописать
         всю ручку для запроса.
         Для проверки запросов на прямой/обратный геокодинг не нужны никакие хедеры/куки, поэтому их мы не задаем.
-        При необходимости, метод легко можно будет дополнить хедерами/куками, либо же изменить запрос на сессионный.
+        Запрос идёт через сессию клиента, так что соединения берутся из пула и переиспользуются.
+        Если у клиента есть кэш, GET-запросы с jsonify сначала ищутся в нём, а успешные ответы в него сохраняются
+        (кроме 429 и 5xx - они не говорят ничего о самом запросе).
+        Время каждой фазы запроса замеряется и передаётся в timing_hooks.
+        json разбирается через orjson, если он установлен. С places=True места из ответа возвращаются компактными
+        записями results.Place вместо словарей.
         """
 
         if base_url_join is True:
@@ -35,17 +248,440 @@ class ApiClient:
         else:
             url = location
 
-        response = requests.request(method=method, url=url, data=data, params=params)
-        assert (
-            response.status_code == expected_status
-        ), f"Expected {expected_status} status code, but got {response.status_code}"
+        record = timing.RequestTiming(method=method.upper(), endpoint=location, url=url, tags=dict(self.timing_tags))
+        previous_record = timing.activate(record)
+        started = time.perf_counter()
+        try:
+            if self.profiler is not None:
+                with self.profiler.profiling():
+                    return self._request(method, location, url, data, params, expected_status, jsonify, places, record)
+            return self._request(method, location, url, data, params, expected_status, jsonify, places, record)
+        finally:
+            record.total = time.perf_counter() - started
+            timing.deactivate(previous_record)
+            for hook in self.timing_hooks:
+                hook(record)
+
+    def lookup(self, osm_ids, expected_status=200, places=False):
+        """
+        Детали мест по списку OSM id через lookup. id раскладываются по запросам до constants.LOOKUP_MAX_IDS штук,
+        а места из ответов возвращаются списком в порядке osm_ids. Для id, которых в ответе нет (удалённое место,
+        частичный ответ), на его позиции None
+        """
+        responses = [
+            self.request_custom(
+                method="GET",
+                location=apis.LOOKUP_API_LOCATION,
+                params=query,
+                expected_status=expected_status,
+                places=places
+            )
+            for _, query in LookupQuery.batches(osm_ids)
+        ]
+        return demultiplex_lookup(osm_ids, responses)
+
+    def _request(self, method, location, url, data, params, expected_status, jsonify, places, record):
+        point = None
+        if self.reverse_index is not None and location == apis.REVERSE_API_LOCATION and jsonify:
+            point = self._reverse_point(params)
+            if point is not None and expected_status == 200:
+                indexed = self.reverse_index.lookup(*point)
+                if indexed is not None:
+                    record.source = "reverse_index"
+                    record.status = 200
+                    return to_places(indexed) if places else indexed
+
+        address = None
+        if self.address_index is not None and location == apis.SEARCH_API_LOCATION and jsonify:
+            address = simple_query(params)
+            if address is not None and expected_status == 200:
+                indexed = self.address_index.lookup(*address)
+                if indexed is not None:
+                    record.source = "address_index"
+                    record.status = 200
+                    return to_places(indexed) if places else indexed
+
+        key = None
+        if jsonify and method.upper() == "GET" and (self.cache is not None or self.single_flight is not None):
+            key = cache_key(method, url, params)
+        if self.cache is not None and key is not None:
+            cached = self.cache.get(key)
+            if cached is not None:
+                status_code, json_response = cached
+                record.source = "cache"
+                record.status = status_code
+                self._assert_status(status_code, expected_status)
+                return to_places(json_response) if places else json_response
+
+        if not jsonify:
+            response = self._send(method=method, url=url, data=data, params=params)
+            record.status = response.status_code
+            self._assert_status(response.status_code, expected_status)
+            return response
+
+        fetch = functools.partial(self._fetch_json, method, url, data, params, key, point, address, record)
+        if self.single_flight is not None and key is not None:
+            status_code, json_response = self.single_flight.do(key, fetch, shared=self._shared_response(key))
+            if record.status is None:
+                record.source = "coalesced"
+        else:
+            status_code, json_response = fetch()
+        record.status = status_code
+        self._assert_status(status_code, expected_status)
+        if json_response is _NOT_JSON:
+            raise JSONErrorException(
+                f"Expected json response from api request {url}"
+            )
+        return to_places(json_response) if places else json_response
+
+    def _fetch_json(self, method, url, data, params, key, point, address, record):
+        """
+        Запрос с разбором json-ответа. Возвращает (status_code, json_response), а если тело не json - (status_code,
+        _NOT_JSON): код ответа проверяется раньше, чем ошибка разбора, как и без склейки запросов.
+        Успешные ответы сохраняются в кэш, индекс обратного геокодинга и журнал индекса адресов
+        """
+        response = self._send(method=method, url=url, data=data, params=params)
+        record.status = response.status_code
+        decode_started = time.perf_counter()
+        try:
+            json_response: dict = json_loads(response.content)
+        except ValueError:
+            return response.status_code, _NOT_JSON
+        finally:
+            record.json_decode = time.perf_counter() - decode_started
+        if key is not None and self.cache is not None and response.status_code < 500 and response.status_code != 429:
+            self.cache.set(key, response.status_code, json_response)
+        if point is not None and response.status_code == 200 and "error" not in json_response:
+            lat, lon, variant = point
+            self.reverse_index.add(lat, lon, json_response, variant)
+        if address is not None and response.status_code == 200 and isinstance(json_response, list):
+            query, response_format = address
+            self.address_index.ingest(query, json_response, response_format)
+        return response.status_code, json_response
+
+    def _shared_response(self, key):
+        """
+        Поиск готового ответа в общем кэше на диске - так склейка запросов находит ответ, полученный другим воркером
+        """
+        if self.cache is None or self.cache.disk is None:
+            return None
+
+        def lookup():
+            stored = self.cache.disk.get(key)
+            return stored[:2] if stored is not None else None
+
+        return lookup
+
+    @staticmethod
+    def _reverse_point(params):
+        """
+        Координаты из params запроса обратного геокодинга и остальные параметры (format, zoom, accept-language и т.д.)
+        одной строкой - ответ из индекса годится только для запроса с теми же параметрами. None, если координаты
+        не числа
+        """
+        params = params if isinstance(params, dict) else dict(params or ())
+        try:
+            lat, lon = float(params["lat"]), float(params["lon"])
+        except (KeyError, TypeError, ValueError):
+            return None
+        variant = json.dumps(
+            sorted((str(name), str(value)) for name, value in params.items() if name not in ("lat", "lon"))
+        )
+        return lat, lon, variant
 
-        if jsonify:
+    def _send(self, method, url, data, params):
+        """
+        Отправка запроса: либо через кассету (запись/воспроизведение), либо сразу в сеть
+        """
+        if self.cassette is not None:
+            return self.cassette.play(method, url, data, params, send=self._send_network)
+        return self._send_network(method=method, url=url, data=data, params=params)
+
+    def retry_stats(self):
+        stats = {"retries": self.retries}
+        if self.rate_limiter is not None:
+            stats.update(self.rate_limiter.stats())
+        return stats
+
+    def _send_network(self, method, url, data, params):
+        """
+        Запрос в сеть через ограничитель скорости. На 429/503 ограничитель замедляется для всех воркеров,
+        а запрос повторяется после паузы: Retry-After, если сервер его прислал, иначе экспоненциальная пауза
+        со случайным разбросом, чтобы воркеры не повторяли запросы одновременно. Retry-After больше
+        constants.RETRY_BACKOFF_MAX не ждётся: запрос сразу возвращает этот ответ, а остальные воркеры
+        приостанавливаются не дольше RETRY_BACKOFF_MAX. Если серверов несколько,
+        ошибка соединения или таймаут тоже повторяются - уже на другом сервере
+        """
+        record = timing.current()
+        deadline = time.perf_counter() + self.deadline if self.deadline else None
+        attempt = 0
+        while True:
+            if self.rate_limiter is not None:
+                waited = self.rate_limiter.acquire()
+                if record is not None:
+                    record.throttle_wait += waited
             try:
-                json_response: dict = response.json()
-            except JSONErrorException:
-                raise JSONErrorException(
-                    f"Expected json response from api request {url}"
+                response = self._send_routed(method, url, data, params, deadline)
+            except requests.RequestException:
+                if self.router is None or attempt >= self.max_retries:
+                    raise
+                attempt = self._count_retry(record, attempt)
+                continue
+            if response.status_code not in constants.RETRY_STATUSES:
+                if self.rate_limiter is not None:
+                    self.rate_limiter.on_success()
+                return response
+
+            retry_after = parse_retry_after(response.headers.get("Retry-After"))
+            if self.rate_limiter is not None:
+                self.rate_limiter.on_throttled(
+                    min(retry_after, constants.RETRY_BACKOFF_MAX) if retry_after is not None else None
                 )
-            return json_response
+            if attempt >= self.max_retries or (retry_after or 0.0) > constants.RETRY_BACKOFF_MAX:
+                return response
+            attempt = self._count_retry(record, attempt)
+            backoff = min(constants.RETRY_BACKOFF_BASE * 2 ** (attempt - 1), constants.RETRY_BACKOFF_MAX)
+            pause = min(max(retry_after or 0.0, backoff * random.uniform(0.5, 1.5)), constants.RETRY_BACKOFF_MAX)
+            if deadline is not None and time.perf_counter() + pause >= deadline:
+                return response
+            time.sleep(pause)
+
+    def _count_retry(self, record, attempt):
+        with self._stats_lock:
+            self.retries += 1
+        if record is not None:
+            record.retries = attempt + 1
+        return attempt + 1
+
+    def _attempt_timeout(self, deadline):
+        """
+        Таймаут очередной попытки: timeout клиента, но не дольше, чем осталось до deadline
+        """
+        if deadline is None:
+            return self.timeout
+        remaining = deadline - time.perf_counter()
+        if remaining <= 0:
+            raise DeadlineExceeded(f"Request deadline of {self.deadline}s exceeded")
+        return min(self.timeout, remaining) if self.timeout else remaining
+
+    def _send_routed(self, method, url, data, params, deadline):
+        """
+        Выбор сервера для попытки. Запросы не на серверы из списка (base_url_join=False) уходят как есть
+        """
+        endpoint = self.router.endpoint_for(url) if self.router is not None else None
+        if endpoint is None:
+            return self._send_once(method, url, data, params, timeout=self._attempt_timeout(deadline))
+        primary = self.router.choose()
+        hedge_delay = self.router.hedge_delay(primary) if self._hedge_executor is not None else None
+        if hedge_delay is None:
+            return self._send_to(primary, method, url, data, params, deadline)
+        return self._send_hedged(primary, hedge_delay, method, url, data, params, deadline)
+
+    def _send_to(self, endpoint, method, url, data, params, deadline):
+        timeout = self._attempt_timeout(deadline)
+        started = time.perf_counter()
+        try:
+            response = self._send_once(method, endpoint.url_for(url), data, params, timeout=timeout)
+        except requests.RequestException:
+            self.router.record(endpoint, time.perf_counter() - started, error=True)
+            raise
+        error = response.status_code >= 500 or response.status_code == 429
+        self.router.record(endpoint, time.perf_counter() - started, error=error)
+        return response
+
+    def _send_hedged(self, primary, hedge_delay, method, url, data, params, deadline):
+        """
+        Попытка с подстраховкой: если основной сервер не ответил за hedge_delay, тот же запрос уходит на второй сервер,
+        и берётся первый пришедший ответ. Проигравший запрос дочитывается в фоне и возвращает соединение в пул
+        """
+        record = timing.current()
+        attempt_args = (method, url, data, params, deadline)
+        futures = {self._hedge_executor.submit(self._send_attempt, record, primary, *attempt_args): primary}
+        done, _ = wait(futures, timeout=hedge_delay)
+        if not done:
+            secondary = self.router.choose(exclude=(primary,))
+            self.router.count_hedge()
+            if record is not None:
+                record.hedged = True
+            futures[self._hedge_executor.submit(self._send_attempt, record, secondary, *attempt_args)] = secondary
+        error = None
+        for future in as_completed(futures):
+            try:
+                response, attempt_record = future.result()
+            except requests.RequestException as attempt_error:
+                error = attempt_error
+                continue
+            if futures[future] is not primary:
+                self.router.count_hedge(won=True)
+            if record is not None:
+                for phase in ("url", "connect", "tls", "ttfb", "download", "request_bytes", "response_bytes"):
+                    setattr(record, phase, getattr(attempt_record, phase))
+            return response
+        raise error
+
+    def _send_attempt(self, record, endpoint, method, url, data, params, deadline):
+        """
+        Одна попытка в потоке пула подстраховки со своим замером, чтобы параллельные попытки не писали в один
+        """
+        attempt_record = None
+        if record is not None:
+            attempt_record = timing.RequestTiming(method=record.method, endpoint=record.endpoint, url=url)
+        previous_record = timing.activate(attempt_record)
+        try:
+            return self._send_to(endpoint, method, url, data, params, deadline), attempt_record
+        finally:
+            timing.deactivate(previous_record)
+
+    def _send_once(self, method, url, data, params, timeout=None):
+        """
+        Запрос в сеть. Тело читается отдельно от заголовков, чтобы разделить в замере время до первого байта
+        и время скачивания ответа
+        """
+        record = timing.current()
+        connect_before = record.connect + record.tls if record is not None else 0.0
+        started = time.perf_counter()
+        response = self.session.request(
+            method=method, url=url, data=data, params=params, stream=True, timeout=timeout
+        )
+        headers_received = time.perf_counter()
+        content = response.content
+        finished = time.perf_counter()
+        with self._stats_lock:
+            self.requests_sent += 1
+
+        if record is not None:
+            connect = record.connect + record.tls - connect_before
+            record.url = url
+            record.ttfb = max(headers_received - started - connect, 0.0)
+            record.download = finished - headers_received
+            record.request_bytes = timing.request_size(response.request)
+            record.response_bytes = len(content)
         return response
+
+    @staticmethod
+    def _assert_status(status_code, expected_status):
+        assert (
+            status_code == expected_status
+        ), f"Expected {expected_status} status code, but got {status_code}"
+
+
+def demultiplex_lookup(osm_ids, responses):
+    """
+    Раскладка мест из ответов lookup обратно по запрошенным id: список в порядке osm_ids, None для отсутствующих
+    """
+    found = {}
+    for response in responses:
+        for place in response if isinstance(response, list) else ():
+            found[osm_id_of(place)] = place
+    return [found.get(normalize_osm_id(osm_id)) for osm_id in osm_ids]
+
+
+class AsyncApiClient:
+    def __init__(
+        self,
+        base_url: str = None,
+        concurrency=constants.DEFAULT_ASYNC_CONCURRENCY,
+        client=None,
+        **client_kwargs
+    ):
+        """
+        Асинхронный брат ApiClient для пакетного геокодинга. Сами запросы выполняет обычный ApiClient.request_custom
+        (со всеми его проверками кода ответа и json) в пуле потоков, а asyncio ограничивает количество одновременных
+        запросов семафором на concurrency штук. Пул соединений клиента расширяется до concurrency, чтобы каждому
+        запросу в полёте хватило своего keep-alive соединения.
+        Можно передать готовый client - тогда закрывать его будет тот, кто его создал
+        """
+        self.concurrency = concurrency
+        self._owns_client = client is None
+        if client is None:
+            client_kwargs.setdefault("pool_maxsize", max(concurrency, constants.DEFAULT_POOL_MAXSIZE))
+            client = ApiClient(base_url=base_url, **client_kwargs)
+        self.client = client
+        self.executor = ThreadPoolExecutor(max_workers=concurrency)
+        self.semaphore = asyncio.Semaphore(concurrency)
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc_info):
+        self.close()
+
+    def close(self):
+        self.executor.shutdown(wait=True)
+        if self._owns_client:
+            self.client.close()
+
+    async def request_custom(self, method, location, **kwargs):
+        """
+        Асинхронный вариант ApiClient.request_custom, параметры те же
+        """
+        async with self.semaphore:
+            loop = asyncio.get_running_loop()
+            return await loop.run_in_executor(
+                self.executor,
+                lambda: self.client.request_custom(method=method, location=location, **kwargs)
+            )
+
+    async def search_many(self, iterable_of_params, expected_status=200, return_exceptions=False):
+        """
+        Пакетный прямой геокодинг. Отдаёт пары (индекс params во входной последовательности, ответ) по мере готовности.
+        Входная последовательность читается лениво, в полёте одновременно не больше concurrency запросов.
+        При return_exceptions=True упавший запрос отдаётся парой (индекс, исключение), иначе исключение пробрасывается
+        """
+        async for item in self._request_many(
+            apis.SEARCH_API_LOCATION, iterable_of_params, expected_status, return_exceptions
+        ):
+            yield item
+
+    async def reverse_many(self, iterable_of_params, expected_status=200, return_exceptions=False):
+        """
+        Пакетный обратный геокодинг, работает так же, как search_many
+        """
+        async for item in self._request_many(
+            apis.REVERSE_API_LOCATION, iterable_of_params, expected_status, return_exceptions
+        ):
+            yield item
+
+    async def lookup(self, osm_ids, expected_status=200, places=False):
+        """
+        Асинхронный вариант ApiClient.lookup: запросы по constants.LOOKUP_MAX_IDS id идут параллельно,
+        не больше concurrency одновременно
+        """
+        batches = LookupQuery.batches(osm_ids)
+        responses = [None] * len(batches)
+        async for index, response in self._request_many(
+            apis.LOOKUP_API_LOCATION, (query for _, query in batches), expected_status, False, places=places
+        ):
+            responses[index] = response
+        return demultiplex_lookup(osm_ids, responses)
+
+    async def _request_one(self, index, location, params, expected_status, return_exceptions, **kwargs):
+        try:
+            result = await self.request_custom(
+                method="GET", location=location, params=params, expected_status=expected_status, **kwargs
+            )
+        except Exception as error:
+            if not return_exceptions:
+                raise
+            result = error
+        return index, result
+
+    async def _request_many(self, location, iterable_of_params, expected_status, return_exceptions, **kwargs):
+        params_iter = enumerate(iterable_of_params)
+        pending = set()
+        try:
+            while True:
+                for index, params in params_iter:
+                    pending.add(asyncio.ensure_future(
+                        self._request_one(index, location, params, expected_status, return_exceptions, **kwargs)
+                    ))
+                    if len(pending) >= self.concurrency:
+                        break
+                if not pending:
+                    return
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    yield task.result()
+        finally:
+            for task in pending:
+                task.cancel()
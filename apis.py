@@ -1,2 +1,3 @@
 SEARCH_API_LOCATION = "/search.php"
 REVERSE_API_LOCATION = "/reverse.php"
+LOOKUP_API_LOCATION = "/lookup.php"
@@ -1,7 +1,11 @@
+import asyncio
+
 import pytest
 
 import apis
 import constants
+import validation
+from apiclient import AsyncApiClient
 from builder import Builder
 
 
@@ -14,18 +18,42 @@ class ApiBase:
         self.api_client = api_client
         self.builder = Builder()
 
-    def search_address_or_name(self, params):
+    def search_address_or_name(self, params, places=False):
         lat_lon = self.api_client.request_custom(
-            method="GET", location=apis.SEARCH_API_LOCATION, params=params
+            method="GET", location=apis.SEARCH_API_LOCATION, params=params, places=places
         )
         return lat_lon
 
-    def reverse_lat_and_lon(self, params):
+    def reverse_lat_and_lon(self, params, places=False):
         address = self.api_client.request_custom(
-            method="GET", location=apis.REVERSE_API_LOCATION, params=params
+            method="GET", location=apis.REVERSE_API_LOCATION, params=params, places=places
         )
         return address
 
+    def lookup_osm_ids(self, osm_ids, places=False):
+        return self.api_client.lookup(osm_ids, places=places)
+
+    def search_many(self, params_list):
+        """
+        Пакетный прямой геокодинг через api_client по constants.GOLDEN_CONCURRENCY запросов одновременно.
+        Ответы возвращаются в порядке params_list, вместо упавшего запроса (неожиданный код ответа, не json) - его
+        исключение, чтобы причина попала в отчёт проверки (validation.with_request_errors)
+        """
+        return asyncio.run(self._collect_many("search_many", params_list))
+
+    def reverse_many(self, params_list):
+        """
+        Пакетный обратный геокодинг, работает так же, как search_many
+        """
+        return asyncio.run(self._collect_many("reverse_many", params_list))
+
+    async def _collect_many(self, method_name, params_list):
+        responses = [None] * len(params_list)
+        async with AsyncApiClient(client=self.api_client, concurrency=constants.GOLDEN_CONCURRENCY) as client:
+            async for index, response in getattr(client, method_name)(params_list, return_exceptions=True):
+                responses[index] = response
+        return responses
+
     def assert_display_name_from_response(self, response, expected_words):
         display_name = response["display_name"]
         expected_words_in_display_name = True
@@ -42,6 +70,20 @@ class ApiBase:
             valid_lat in lat and valid_lon in lon
         ), f"Wrong latitude/longitude, expected in {valid_lat, valid_lon}, got {lat, lon}"
 
+    def assert_lat_and_lon_batch(self, valid_lats, valid_lons, lats, lons, tolerance_km):
+        """
+        Пакетная проверка координат по расстоянию (haversine) с допуском tolerance_km - одним числом или на каждую
+        строку. В отличие от assert_lat_and_lon не останавливается на первой ошибке, а сообщает обо всех с индексами
+        """
+        validation.validate_coordinates(valid_lats, valid_lons, lats, lons, tolerance_km).assert_ok()
+
+    def assert_display_names_batch(self, responses, expected_words):
+        """
+        Пакетный вариант assert_display_name_from_response: expected_words - список ожидаемых слов на каждый ответ
+        """
+        display_names = [response["display_name"] for response in responses]
+        validation.validate_display_names(display_names, expected_words).assert_ok()
+
     def assert_response_is_empty_list(self, response):
         assert response == [], f"Wrong response, expected empty list, got {response}"
 
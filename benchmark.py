@@ -0,0 +1,276 @@
+"""
+Бенчмарк задержки и пропускной способности api. Прогоняет по --url наборы данных из тестов
+(parametrize_addresses, parametrize_names, parametrize_reverse_data) или запросы из файла и печатает JSON с
+перцентилями задержки, пропускной способностью, долей ошибок и процессорным временем клиента на запрос.
+
+Примеры:
+    python benchmark.py --url local --concurrency 8 --duration 10 --output bench.json
+    python benchmark.py --url http://127.0.0.1:8080 --rate 200 --requests 5000 --baseline bench.json
+"""
+import argparse
+import itertools
+import json
+import queue
+import subprocess
+import sys
+import threading
+import time
+from urllib.parse import urlsplit
+
+import apis
+import constants
+from apiclient import ApiClient
+from builder import Builder
+from histogram import LatencyHistogram
+
+
+def default_queries():
+    """
+    Запросы из параметризованных наборов данных тестов - пары (location, params)
+    """
+    from tests_api.test_reverse import TestReverse
+    from tests_api.test_search import TestSimpleSearch
+
+    builder = Builder()
+    queries = [
+        (apis.SEARCH_API_LOCATION, builder.search(address=data["name"]).params_for_api)
+        for data in TestSimpleSearch.parametrize_addresses + TestSimpleSearch.parametrize_names
+    ]
+    queries += [
+        (apis.REVERSE_API_LOCATION, builder.reverse(lat=data["lat"], lon=data["lon"]).params_for_api)
+        for data in TestReverse.parametrize_reverse_data
+    ]
+    return queries
+
+
+def load_queries(path):
+    """
+    Запросы из JSONL-файла. Каждая строка - либо {"location": "/search.php", "params": {...}},
+    либо просто params: с lat/lon это обратный геокодинг, иначе прямой
+    """
+    builder = Builder()
+    queries = []
+    with open(path, encoding="utf-8") as queries_file:
+        for line in queries_file:
+            if not line.strip():
+                continue
+            row = json.loads(line)
+            if "params" in row:
+                queries.append((row.get("location", apis.SEARCH_API_LOCATION), row["params"]))
+            elif "lat" in row and "lon" in row:
+                params = builder.reverse(lat=row["lat"], lon=row["lon"]).params_for_api
+                queries.append((apis.REVERSE_API_LOCATION, params))
+            else:
+                queries.append((apis.SEARCH_API_LOCATION, {"format": "jsonv2", **row}))
+    return queries
+
+
+class Benchmark:
+    def __init__(self, client, queries, concurrency, rate=None, duration=None, total_requests=None):
+        """
+        Без rate - замкнутый цикл: concurrency потоков шлют запросы друг за другом.
+        С rate - открытый цикл: запросы планируются с частотой rate в секунду, и задержка считается от
+        запланированного момента отправки, а не от фактического, чтобы отставание клиента не пряталось
+        (coordinated omission)
+        """
+        self.client = client
+        self.queries = itertools.cycle(queries)
+        self.concurrency = concurrency
+        self.rate = rate
+        self.duration = duration
+        self.total_requests = total_requests
+        self.histogram = LatencyHistogram()
+        self.errors = 0
+        self.sent = 0
+        self._lock = threading.Lock()
+
+    def _next_query(self):
+        with self._lock:
+            if self.total_requests is not None and self.sent >= self.total_requests:
+                return None
+            self.sent += 1
+            return next(self.queries)
+
+    def _execute(self, query, started):
+        location, params = query
+        try:
+            self.client.request_custom(method="GET", location=location, params=params)
+            failed = False
+        except Exception:
+            failed = True
+        elapsed = time.perf_counter() - started
+        with self._lock:
+            self.histogram.record(elapsed)
+            self.errors += failed
+
+    def _closed_loop_worker(self, deadline):
+        while deadline is None or time.perf_counter() < deadline:
+            query = self._next_query()
+            if query is None:
+                return
+            self._execute(query, time.perf_counter())
+
+    def _open_loop_worker(self, jobs):
+        while True:
+            job = jobs.get()
+            if job is None:
+                return
+            planned_at, query = job
+            delay = planned_at - time.perf_counter()
+            if delay > 0:
+                time.sleep(delay)
+            self._execute(query, planned_at)
+
+    def run(self):
+        started = time.perf_counter()
+        cpu_started = time.process_time()
+        deadline = started + self.duration if self.duration else None
+        if self.rate:
+            jobs = queue.Queue(maxsize=self.concurrency * 4)
+            workers = [
+                threading.Thread(target=self._open_loop_worker, args=(jobs,)) for _ in range(self.concurrency)
+            ]
+            for worker in workers:
+                worker.start()
+            for number in itertools.count():
+                planned_at = started + number / self.rate
+                if deadline is not None and planned_at >= deadline:
+                    break
+                query = self._next_query()
+                if query is None:
+                    break
+                jobs.put((planned_at, query))
+            for _ in workers:
+                jobs.put(None)
+        else:
+            workers = [
+                threading.Thread(target=self._closed_loop_worker, args=(deadline,)) for _ in range(self.concurrency)
+            ]
+            for worker in workers:
+                worker.start()
+        for worker in workers:
+            worker.join()
+        elapsed = time.perf_counter() - started
+        cpu = time.process_time() - cpu_started
+
+        count = self.histogram.count
+        return {
+            "mode": "open" if self.rate else "closed",
+            "concurrency": self.concurrency,
+            "target_rate": self.rate,
+            "requests": count,
+            "errors": self.errors,
+            "error_rate": self.errors / count if count else 0,
+            "duration_s": elapsed,
+            "throughput_rps": count / elapsed if elapsed else 0,
+            "cpu_ms_per_request": cpu / count * 1000 if count else 0,
+            "latency_ms": self.histogram.summary_ms()
+        }
+
+
+def compare_with_baseline(result, baseline, max_p99_regression, max_throughput_regression):
+    """
+    Список регрессий относительно прошлого прогона: рост p99 и падение пропускной способности больше порогов
+    (пороги - доли, 0.2 = 20%)
+    """
+    regressions = []
+    baseline_p99 = baseline["latency_ms"]["p99"]
+    p99 = result["latency_ms"]["p99"]
+    if baseline_p99 and p99 > baseline_p99 * (1 + max_p99_regression):
+        regressions.append(f"p99 {p99:.3f} ms is worse than baseline {baseline_p99:.3f} ms")
+    baseline_throughput = baseline["throughput_rps"]
+    throughput = result["throughput_rps"]
+    if throughput < baseline_throughput * (1 - max_throughput_regression):
+        regressions.append(f"throughput {throughput:.1f} rps is worse than baseline {baseline_throughput:.1f} rps")
+    return regressions
+
+
+def is_public_url(url):
+    """
+    Указывает ли url на публичный сервер Nominatim (constants.DEFAULT_URL) - с его правилами использования
+    нагрузка и массовый геокодинг несовместимы
+    """
+    return urlsplit(url).hostname == urlsplit(constants.DEFAULT_URL).hostname
+
+
+def start_local_server():
+    """
+    Локальная заглушка в отдельном процессе, чтобы она не делила GIL с клиентом бенчмарка
+    """
+    process = subprocess.Popen(
+        [sys.executable, "stub_server.py", "--port", "0"],
+        stdout=subprocess.PIPE,
+        text=True,
+        cwd=sys.path[0] or None
+    )
+    url = process.stdout.readline().split()[-1]
+    return process, url
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Бенчмарк задержки и пропускной способности api")
+    parser.add_argument(
+        "--url", default=constants.LOCAL_SERVER_URL,
+        help="адрес api, по умолчанию - локальная заглушка; публичный nominatim.openstreetmap.org нагружать нельзя"
+    )
+    parser.add_argument("--queries", help="JSONL-файл с запросами, по умолчанию - наборы данных из тестов")
+    parser.add_argument("--concurrency", type=int, default=1)
+    parser.add_argument("--rate", type=float, help="целевая частота запросов в секунду (открытый цикл)")
+    parser.add_argument("--duration", type=float, help="длительность прогона в секундах")
+    parser.add_argument("--requests", type=int, help="количество запросов")
+    parser.add_argument("--output", help="куда записать результат в JSON")
+    parser.add_argument("--baseline", help="JSON прошлого прогона для сравнения")
+    parser.add_argument("--max-p99-regression", type=float, default=0.2)
+    parser.add_argument("--max-throughput-regression", type=float, default=0.1)
+    args = parser.parse_args()
+    if is_public_url(args.url):
+        parser.error(f"load tests must not run against public {constants.DEFAULT_URL}, use local or your own server")
+    if args.duration is None and args.requests is None:
+        args.requests = 1000
+
+    queries = load_queries(args.queries) if args.queries else default_queries()
+    if not queries:
+        parser.error("no queries to run")
+
+    server_process = None
+    url = args.url
+    if url == constants.LOCAL_SERVER_URL:
+        server_process, url = start_local_server()
+    client = ApiClient(base_url=url, pool_maxsize=max(args.concurrency, constants.DEFAULT_POOL_MAXSIZE))
+    try:
+        result = Benchmark(
+            client,
+            queries,
+            concurrency=args.concurrency,
+            rate=args.rate,
+            duration=args.duration,
+            total_requests=args.requests
+        ).run()
+    finally:
+        client.close()
+        if server_process is not None:
+            server_process.terminate()
+            server_process.wait()
+    result["url"] = args.url
+    result["connections"] = client.connection_stats()
+
+    output = json.dumps(result, indent=2)
+    print(output)
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as output_file:
+            output_file.write(output)
+
+    if args.baseline:
+        with open(args.baseline, encoding="utf-8") as baseline_file:
+            baseline = json.load(baseline_file)
+        regressions = compare_with_baseline(
+            result, baseline, args.max_p99_regression, args.max_throughput_regression
+        )
+        for regression in regressions:
+            print(f"REGRESSION: {regression}", file=sys.stderr)
+        if regressions:
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,9 +1,210 @@
-from dataclasses import dataclass
+import itertools
+import re
+import weakref
+
+import constants
+
+API_FORMAT = "jsonv2"
+OSM_ID_RE = re.compile(r"[NWR][0-9]+")
+
+
+def _is_column(value):
+    return hasattr(value, "__len__") and not isinstance(value, (str, bytes))
+
+
+class Query:
+    """
+    Неизменяемый запрос к api. Параметры хранятся одним компактным кортежем пар (имя, значение), отсортированным
+    по имени и без параметров со значением None. Одинаковые запросы интернируются - это один и тот же объект,
+    поэтому запросы дёшево хешируются, сравниваются и годятся как ключи кэша или для дедупликации.
+    Запрос можно передавать прямо в params у requests/ApiClient.request_custom - он итерируется парами параметров
+    """
+
+    __slots__ = ("params", "_hash", "__weakref__")
+    FIELDS = {}
+
+    def __init_subclass__(cls, **kwargs):
+        super().__init_subclass__(**kwargs)
+        cls._interned = weakref.WeakValueDictionary()
+        cls._sorted_fields = sorted(cls.FIELDS.items(), key=lambda item: item[1])
+
+    def __new__(cls, *args, **kwargs):
+        values = dict(zip(cls.FIELDS, args))
+        values.update(kwargs)
+        unknown = set(values) - set(cls.FIELDS)
+        if unknown:
+            raise TypeError(f"{cls.__name__} got unexpected fields {sorted(unknown)}")
+        return cls._intern(tuple(
+            (param, str(values[name])) for name, param in cls._sorted_fields if values.get(name) is not None
+        ))
+
+    @classmethod
+    def from_params(cls, params_for_api):
+        """
+        Запрос из готового словаря params (без добавления format)
+        """
+        return cls._intern(tuple(sorted(
+            (param, str(value)) for param, value in params_for_api.items() if value is not None
+        )))
+
+    @classmethod
+    def many(cls, **columns):
+        """
+        Векторное создание запросов: каждое поле - либо колонка значений (список, кортеж, массив), либо одно значение
+        на все запросы. Все колонки должны быть одной длины
+        """
+        unknown = set(columns) - set(cls.FIELDS)
+        if unknown:
+            raise TypeError(f"{cls.__name__} got unexpected fields {sorted(unknown)}")
+        lengths = {len(value) for value in columns.values() if _is_column(value)}
+        if len(lengths) > 1:
+            raise ValueError(f"Columns for {cls.__name__} have different lengths {sorted(lengths)}")
+        count = lengths.pop() if lengths else 1
+
+        if "format" in cls.FIELDS:
+            columns.setdefault("format", API_FORMAT)
+        fields = [(name, param) for name, param in cls._sorted_fields if name in columns]
+        value_columns = [
+            columns[name] if _is_column(columns[name]) else itertools.repeat(columns[name], count)
+            for name, param in fields
+        ]
+        param_names = [param for name, param in fields]
+        return [
+            cls._intern(tuple((param, str(value)) for param, value in zip(param_names, row) if value is not None))
+            for row in zip(*value_columns)
+        ]
+
+    @classmethod
+    def _intern(cls, params):
+        query = cls._interned.get(params)
+        if query is None:
+            query = object.__new__(cls)
+            object.__setattr__(query, "params", params)
+            object.__setattr__(query, "_hash", hash((cls.__name__, params)))
+            query = cls._interned.setdefault(params, query)
+        return query
+
+    @property
+    def params_for_api(self):
+        return dict(self.params)
+
+    def __iter__(self):
+        return iter(self.params)
+
+    def __setattr__(self, name, value):
+        raise AttributeError(f"{type(self).__name__} is immutable")
+
+    def __delattr__(self, name):
+        raise AttributeError(f"{type(self).__name__} is immutable")
+
+    def __hash__(self):
+        return self._hash
+
+    def __eq__(self, other):
+        if self is other:
+            return True
+        if type(other) is not type(self):
+            return NotImplemented
+        return self.params == other.params
+
+    def __reduce__(self):
+        return type(self).from_params, (dict(self.params),)
+
+    def __repr__(self):
+        return f"{type(self).__name__}({dict(self.params)!r})"
+
+
+class SearchQuery(Query):
+    """
+    Простой поиск по адресу/названию одной строкой
+    """
+
+    __slots__ = ()
+    FIELDS = {"address": "q", "limit": "limit", "countrycodes": "countrycodes", "format": "format"}
+
+    def __new__(cls, address=None, limit=None, countrycodes=None, format=API_FORMAT):
+        return super().__new__(cls, address=address, limit=limit, countrycodes=countrycodes, format=format)
+
+
+class StructuredSearchQuery(Query):
+    """
+    Структурированный поиск, где город, страна, улица и индекс находятся в отдельных полях
+    """
+
+    __slots__ = ()
+    FIELDS = {
+        "street": "street",
+        "city": "city",
+        "country": "country",
+        "postalcode": "postalcode",
+        "format": "format"
+    }
+
+    def __new__(cls, street=None, city=None, country=None, postalcode=None, format=API_FORMAT):
+        return super().__new__(
+            cls, street=street, city=city, country=country, postalcode=postalcode, format=format
+        )
+
+
+class ReverseQuery(Query):
+    """
+    Обратный геокодинг - получение адреса по точке на карте
+    """
+
+    __slots__ = ()
+    FIELDS = {"lat": "lat", "lon": "lon", "format": "format"}
+
+    def __new__(cls, lat=None, lon=None, format=API_FORMAT):
+        return super().__new__(cls, lat=lat, lon=lon, format=format)
+
+
+def normalize_osm_id(osm_id):
+    """
+    OSM id в виде, который ждёт lookup: буква типа (N - node, W - way, R - relation) и номер, например W5013364
+    """
+    normalized = str(osm_id).strip().upper()
+    if not OSM_ID_RE.fullmatch(normalized):
+        raise ValueError(f"Wrong OSM id {osm_id!r}, expected something like N123, W123 or R123")
+    return normalized
+
+
+def osm_id_of(place):
+    """
+    OSM id места из ответа api (словаря или results.Place) в том же виде, что и normalize_osm_id
+    """
+    return f"{place['osm_type'][0].upper()}{place['osm_id']}"
+
+
+class LookupQuery(Query):
+    """
+    Детали мест по списку OSM id (lookup), не больше constants.LOOKUP_MAX_IDS id в одном запросе
+    """
+
+    __slots__ = ()
+    FIELDS = {"osm_ids": "osm_ids", "format": "format"}
+
+    def __new__(cls, osm_ids=None, format=API_FORMAT):
+        if osm_ids is not None and not isinstance(osm_ids, str):
+            osm_ids = ",".join(normalize_osm_id(osm_id) for osm_id in osm_ids)
+        return super().__new__(cls, osm_ids=osm_ids, format=format)
+
+    @classmethod
+    def batches(cls, osm_ids, batch_size=constants.LOOKUP_MAX_IDS):
+        """
+        Раскладка id по запросам максимального размера. Повторяющиеся id отправляются один раз.
+        Возвращает пары (id в запросе, запрос)
+        """
+        unique = list(dict.fromkeys(normalize_osm_id(osm_id) for osm_id in osm_ids))
+        return [
+            (unique[start:start + batch_size], cls(osm_ids=unique[start:start + batch_size]))
+            for start in range(0, len(unique), batch_size)
+        ]
 
 
 class Builder:
     """
-    Датаклассы для составления params/data к запросам
+    Билдер params/data к запросам. Возвращает неизменяемые запросы SearchQuery/StructuredSearchQuery/ReverseQuery/
+    LookupQuery, словарь параметров у них по-прежнему доступен через params_for_api
     """
 
     @staticmethod
@@ -19,48 +220,33 @@ class Builder:
         postalcode=None
     ):
         """
-        Датакласс для создания params к api на точки на карте по адресу (search)
+        Создание params к api на точки на карте по адресу (search)
         По умолчанию билдит параметры для запросов с 'simple' адресом - адресом в видео одной обычной строки
         Но при использовании параметра structured=True билдит параметры уже для запросов со структурированным адресом -
         где город, страна, улица и т.д. находятся в отдельных полях
+        Параметры со значением None в запрос не попадают (requests их и так не отправлял)
         """
-
-        @dataclass
-        class Search:
-            """
-            Датакласс для сегментов
-            """
-
-            params_for_api: dict
-
-        if params_for_api is None and not structured:
-            params_for_api = {
-                "q": address,
-                "format": "jsonv2",
-                "limit": limit,
-                "countrycodes": countrycodes
-            }
-
-        if params_for_api is None and structured:
-            params_for_api = {
-                "street": street,
-                "city": city,
-                "country": country,
-                "postalcode": postalcode,
-                "format": "jsonv2"
-            }
-        return Search(params_for_api=params_for_api)
+        query_type = StructuredSearchQuery if structured else SearchQuery
+        if params_for_api is not None:
+            return query_type.from_params(params_for_api)
+        if structured:
+            return StructuredSearchQuery(street=street, city=city, country=country, postalcode=postalcode)
+        return SearchQuery(address=address, limit=limit, countrycodes=countrycodes)
 
     @staticmethod
     def reverse(lat=None, lon=None, params_for_api=None):
-        @dataclass
-        class Reverse:
-            """
-            Датакласс для создания params к api на получение адреса по точке на карте (reverse)
-            """
-
-            params_for_api: dict
+        """
+        Создание params к api на получение адреса по точке на карте (reverse)
+        """
+        if params_for_api is not None:
+            return ReverseQuery.from_params(params_for_api)
+        return ReverseQuery(lat=lat, lon=lon)
 
-        if params_for_api is None:
-            params_for_api = {"lat": lat, "lon": lon, "format": "jsonv2"}
-        return Reverse(params_for_api=params_for_api)
+    @staticmethod
+    def lookup(osm_ids=None, params_for_api=None):
+        """
+        Создание params к api на детали мест по OSM id (lookup). osm_ids - список id или строка через запятую
+        """
+        if params_for_api is not None:
+            return LookupQuery.from_params(params_for_api)
+        return LookupQuery(osm_ids=osm_ids)
@@ -0,0 +1,193 @@
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+
+
+def canonical_params(params):
+    """
+    Приведение params к каноническому виду: ключи сортируются, параметры со значением None выкидываются
+    (requests их всё равно не отправляет), а пробелы в строковых значениях схлопываются и обрезаются по краям.
+    Так одинаковые по смыслу запросы дают один и тот же ключ кэша
+    """
+    if not params:
+        return ()
+    if isinstance(params, dict):
+        params = params.items()
+    canonical = []
+    for key, value in params:
+        if value is None:
+            continue
+        if isinstance(value, str):
+            value = " ".join(value.split())
+        else:
+            value = str(value)
+        canonical.append((key, value))
+    return tuple(sorted(canonical))
+
+
+def cache_key(method, url, params):
+    """
+    Ключ кэша для запроса - sha256 от метода, полного url и канонических params
+    """
+    raw = json.dumps([method.upper(), url, canonical_params(params)], ensure_ascii=False)
+    return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+
+class LRUCache:
+    def __init__(self, maxsize, ttl):
+        """
+        Ограниченный по размеру кэш в памяти с вытеснением давно не использованных записей и временем жизни ttl секунд
+        """
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+        self.evictions = 0
+        self.expired = 0
+
+    def get(self, key):
+        with self._lock:
+            item = self._data.get(key)
+            if item is None:
+                return None
+            expires_at, value = item
+            if expires_at < time.time():
+                del self._data[key]
+                self.expired += 1
+                return None
+            self._data.move_to_end(key)
+            return value
+
+    def set(self, key, value, expires_at=None):
+        if expires_at is None:
+            expires_at = time.time() + self.ttl
+        with self._lock:
+            self._data[key] = (expires_at, value)
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+                self.evictions += 1
+
+    def __len__(self):
+        with self._lock:
+            return len(self._data)
+
+
+class DiskCache:
+    def __init__(self, cache_dir, ttl):
+        """
+        Постоянный кэш ответов на диске в sqlite. Файл один на все воркеры xdist: sqlite сам разруливает
+        конкурентную запись между процессами (режим WAL + ожидание блокировки), а соединение своё у каждого потока
+        """
+        os.makedirs(cache_dir, exist_ok=True)
+        self.path = os.path.join(cache_dir, "responses.sqlite")
+        self.ttl = ttl
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self.expired = 0
+        connection = self._connection()
+        connection.execute("PRAGMA journal_mode=WAL")
+        connection.execute(
+            "CREATE TABLE IF NOT EXISTS responses "
+            "(key TEXT PRIMARY KEY, status INTEGER, body TEXT, created REAL)"
+        )
+        connection.commit()
+
+    def _connection(self):
+        connection = getattr(self._local, "connection", None)
+        if connection is None:
+            connection = sqlite3.connect(self.path, timeout=30)
+            self._local.connection = connection
+        return connection
+
+    def get(self, key):
+        """
+        Возвращает (status_code, json_body, created) или None, если записи нет или она устарела
+        """
+        row = self._connection().execute(
+            "SELECT status, body, created FROM responses WHERE key = ?", (key,)
+        ).fetchone()
+        if row is None:
+            return None
+        status_code, body, created = row
+        if created + self.ttl < time.time():
+            with self._lock:
+                self.expired += 1
+            return None
+        return status_code, json.loads(body), created
+
+    def set(self, key, status_code, json_body):
+        connection = self._connection()
+        connection.execute(
+            "INSERT OR REPLACE INTO responses (key, status, body, created) VALUES (?, ?, ?, ?)",
+            (key, status_code, json.dumps(json_body, ensure_ascii=False), time.time())
+        )
+        connection.commit()
+
+    def close(self):
+        connection = getattr(self._local, "connection", None)
+        if connection is not None:
+            connection.close()
+            self._local.connection = None
+
+
+class ResponseCache:
+    def __init__(self, cache_dir=None, ttl=86400, maxsize=1024):
+        """
+        Двухуровневый кэш ответов api: LRU в памяти процесса перед общим для всех воркеров кэшем на диске.
+        Без cache_dir работает только кэш в памяти.
+        Хранятся уже разобранные json-ответы, поэтому менять полученный из кэша ответ нельзя.
+        Кэш общий для потоков AsyncApiClient, поэтому счётчики меняются под блокировкой
+        """
+        self.memory = LRUCache(maxsize=maxsize, ttl=ttl)
+        self.disk = DiskCache(cache_dir, ttl) if cache_dir else None
+        self.memory_hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        """
+        Возвращает (status_code, json_body) или None
+        """
+        value = self.memory.get(key)
+        if value is not None:
+            self._count("memory_hits")
+            return value
+        if self.disk is not None:
+            stored = self.disk.get(key)
+            if stored is not None:
+                status_code, json_body, created = stored
+                value = (status_code, json_body)
+                self.memory.set(key, value, expires_at=created + self.memory.ttl)
+                self._count("disk_hits")
+                return value
+        self._count("misses")
+        return None
+
+    def _count(self, counter):
+        with self._lock:
+            setattr(self, counter, getattr(self, counter) + 1)
+
+    def set(self, key, status_code, json_body):
+        self.memory.set(key, (status_code, json_body))
+        if self.disk is not None:
+            self.disk.set(key, status_code, json_body)
+
+    def stats(self):
+        with self._lock:
+            return {
+                "memory_hits": self.memory_hits,
+                "disk_hits": self.disk_hits,
+                "misses": self.misses,
+                "evictions": self.memory.evictions,
+                "expired": self.memory.expired + (self.disk.expired if self.disk is not None else 0)
+            }
+
+    def close(self):
+        if self.disk is not None:
+            self.disk.close()
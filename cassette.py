@@ -0,0 +1,133 @@
+import json
+import os
+import re
+from urllib.parse import urlsplit
+
+import requests
+from requests.structures import CaseInsensitiveDict
+
+import timing
+from cache import canonical_params
+
+RECORD = "record"
+RECORD_NEW = "record_new"
+REPLAY = "replay"
+REPLAY_STRICT = "replay_strict"
+
+
+class CassetteMissError(Exception):
+    pass
+
+
+def cassette_path(cassette_dir, nodeid):
+    """
+    Путь к файлу кассеты теста: tests_api/test_search.py::TestSimpleSearch::test_x[0] ->
+    <cassette_dir>/tests_api/test_search/TestSimpleSearch.test_x[0].json
+    """
+    module, _, name = nodeid.partition("::")
+    module_dir = os.path.splitext(module)[0]
+    file_name = re.sub(r"[^\w.\[\]-]", "_", name.replace("::", "."))
+    return os.path.join(cassette_dir, module_dir, f"{file_name}.json")
+
+
+class Cassette:
+    def __init__(self, path, mode):
+        """
+        Кассета с записанными обменами с api одного теста. Запросы сопоставляются по методу, пути, каноническим params
+        и data, без хоста - так кассеты, записанные на одном сервере, воспроизводятся при любом --url.
+        mode:
+            RECORD - все запросы идут в сеть, кассета перезаписывается целиком;
+            RECORD_NEW - записанные запросы отдаются из кассеты, в сеть идут и дописываются только новые;
+            REPLAY - ответы отдаются только из кассеты, порядок запросов не важен, один обмен можно отдать много раз;
+            REPLAY_STRICT - запросы должны идти ровно в записанном порядке, и все записанные обмены должны быть
+            использованы.
+        """
+        self.path = path
+        self.mode = mode
+        self.interactions = []
+        self.position = 0
+        self.changed = False
+        if mode != RECORD and os.path.exists(path):
+            with open(path, encoding="utf-8") as cassette_file:
+                self.interactions = json.load(cassette_file)
+
+    @staticmethod
+    def _request_fingerprint(method, url, data, params):
+        if data is not None and not isinstance(data, str):
+            data = [list(pair) for pair in canonical_params(data)]
+        return {
+            "method": method.upper(),
+            "path": urlsplit(url).path,
+            "params": [list(pair) for pair in canonical_params(params)],
+            "data": data
+        }
+
+    def _find(self, fingerprint):
+        if self.mode == REPLAY_STRICT:
+            if self.position >= len(self.interactions):
+                raise CassetteMissError(
+                    f"Unexpected request {fingerprint}, all interactions of {self.path} are already used"
+                )
+            interaction = self.interactions[self.position]
+            if interaction["request"] != fingerprint:
+                raise CassetteMissError(
+                    f"Request {fingerprint} does not match recorded {interaction['request']} "
+                    f"at position {self.position} of {self.path}"
+                )
+            self.position += 1
+            return interaction
+        for interaction in self.interactions:
+            if interaction["request"] == fingerprint:
+                return interaction
+        return None
+
+    def play(self, method, url, data, params, send):
+        """
+        Отдаёт ответ на запрос из кассеты, а в режимах записи - выполняет запрос через send и записывает обмен
+        """
+        fingerprint = self._request_fingerprint(method, url, data, params)
+        if self.mode != RECORD:
+            interaction = self._find(fingerprint)
+            if interaction is not None:
+                record = timing.current()
+                if record is not None:
+                    record.source = "cassette"
+                return self._build_response(interaction["response"], url)
+            if self.mode == REPLAY:
+                raise CassetteMissError(f"No recorded interaction for {fingerprint} in {self.path}")
+
+        response = send(method=method, url=url, data=data, params=params)
+        self.interactions.append({
+            "request": fingerprint,
+            "response": {
+                "status": response.status_code,
+                "headers": {"Content-Type": response.headers.get("Content-Type", "")},
+                "body": response.text
+            }
+        })
+        self.changed = True
+        return response
+
+    @staticmethod
+    def _build_response(recorded, url):
+        response = requests.Response()
+        response.status_code = recorded["status"]
+        response.headers = CaseInsensitiveDict(recorded["headers"])
+        response._content = recorded["body"].encode("utf-8")
+        response.encoding = "utf-8"
+        response.url = url
+        return response
+
+    def eject(self):
+        """
+        Завершение работы с кассетой: в режимах записи она сохраняется на диск,
+        в строгом воспроизведении проверяется, что все записанные обмены были использованы
+        """
+        if self.mode == REPLAY_STRICT and self.position != len(self.interactions):
+            raise CassetteMissError(
+                f"Only {self.position} of {len(self.interactions)} recorded interactions of {self.path} were used"
+            )
+        if self.changed:
+            os.makedirs(os.path.dirname(self.path), exist_ok=True)
+            with open(self.path, "w", encoding="utf-8") as cassette_file:
+                json.dump(self.interactions, cassette_file, ensure_ascii=False, indent=2)
@@ -1,32 +1,517 @@
+import functools
+import json
+import os
+
 import pytest
 
+import address_index
+import cassette
 import constants
+import golden
+import stub_server
+import timing
 from apiclient import ApiClient
+from cache import ResponseCache
+from ratelimit import SharedTokenBucket, default_state_path
+from singleflight import SingleFlight
+from spatial_index import ReverseIndex
+
+pytest_plugins = ["duration_scheduler", "profiling"]
+
+SESSION_STATS_KEY = pytest.StashKey[dict]()
+CASSETTE_MODE_KEY = pytest.StashKey[str]()
+TIMING_REPORT_KEY = pytest.StashKey[timing.TimingReport]()
 
 
 def pytest_addoption(parser):
     """Чтение из консоли параметра --url, в случае, если параметр не
-    указан - задает его как constants.DEFAULT_URL"""
-    parser.addoption("--url", default=constants.DEFAULT_URL)
+    указан - задает его как constants.DEFAULT_URL. При --url local тесты идут в локальную заглушку Nominatim,
+    которую настраивают параметры --stub-*.
+    Параметры --pool-* настраивают пул соединений ApiClient (отдельный на каждый воркер xdist),
+    --cache-* - кэш ответов api, --reverse-* - индекс обратного геокодинга, --record*/--replay* - запись и воспроизведение обменов с api из кассет,
+    --timings* - замеры времени запросов, --rate-limit* и --max-retries - общий для воркеров лимит скорости и повторы
+    запросов на 429/503, --single-flight* - склейка одинаковых одновременных запросов,
+    --golden-*, --sample* и --shard-* - проверка по эталонным файлам, --address-* - локальный индекс прямого
+    геокодинга"""
+    parser.addoption(
+        "--url", default=constants.DEFAULT_URL,
+        help="адрес api или несколько адресов через запятую (каждый local - своя локальная заглушка)"
+    )
+    parser.addoption(
+        "--stub-data", default=stub_server.DEFAULT_DATA_PATH,
+        help=f"файл с местами для локальной заглушки Nominatim (--url {constants.LOCAL_SERVER_URL})"
+    )
+    parser.addoption(
+        "--stub-latency-ms", default="0",
+        help="искусственная задержка ответов локальной заглушки, в миллисекундах; для нескольких заглушек можно "
+        "задать свою каждой через запятую"
+    )
+    parser.addoption(
+        "--stub-latency-jitter-ms", type=float, default=0.0,
+        help="средняя случайная добавка к задержке ответов заглушки (экспоненциальный хвост), в миллисекундах"
+    )
+    parser.addoption(
+        "--stub-error-rate", type=float, default=0.0,
+        help="доля запросов, на которые локальная заглушка отвечает 503"
+    )
+    parser.addoption(
+        "--request-timeout", type=float, default=None,
+        help="таймаут одной попытки запроса к api, в секундах"
+    )
+    parser.addoption(
+        "--deadline", type=float, default=None,
+        help="бюджет времени на весь запрос к api вместе с повторами, в секундах"
+    )
+    parser.addoption(
+        "--hedge", action="store_true", default=False,
+        help="при нескольких --url дублировать запрос на второй сервер, если ответа нет дольше p95 задержки"
+    )
+    parser.addoption(
+        "--pool-connections", type=int, default=constants.DEFAULT_POOL_CONNECTIONS,
+        help="количество хостов, для которых держится пул соединений"
+    )
+    parser.addoption(
+        "--pool-maxsize", type=int, default=constants.DEFAULT_POOL_MAXSIZE,
+        help="максимальное количество соединений в пуле на один хост"
+    )
+    parser.addoption(
+        "--pool-block", action="store_true", default=False,
+        help="ждать свободного соединения вместо открытия нового сверх --pool-maxsize"
+    )
+    parser.addoption(
+        "--no-keep-alive", action="store_true", default=False,
+        help="закрывать соединение после каждого запроса (Connection: close)"
+    )
+    parser.addoption(
+        "--cache", action="store_true", default=False,
+        help="кэшировать ответы api в памяти воркера (с --cache-dir кэш включается автоматически)"
+    )
+    parser.addoption(
+        "--cache-dir", default=None,
+        help="директория общего для всех воркеров кэша ответов api на диске"
+    )
+    parser.addoption(
+        "--cache-ttl", type=float, default=constants.DEFAULT_CACHE_TTL,
+        help="время жизни записи в кэше ответов, в секундах"
+    )
+    parser.addoption(
+        "--cache-size", type=int, default=constants.DEFAULT_CACHE_SIZE,
+        help="максимальное количество ответов в кэше в памяти"
+    )
+    parser.addoption(
+        "--single-flight", action="store_true", default=False,
+        help="одинаковые одновременные запросы внутри воркера ждут один запрос к api и делят его ответ"
+    )
+    parser.addoption(
+        "--single-flight-shared", action="store_true", default=False,
+        help="склеивать одинаковые запросы и между воркерами xdist через кэш на диске (нужен --cache-dir)"
+    )
+    parser.addoption(
+        "--reverse-radius-m", type=float, default=0.0,
+        help="отвечать на обратный геокодинг из индекса уже разрешённых точек в этом радиусе (0 - выключено)"
+    )
+    parser.addoption(
+        "--reverse-index", default=None,
+        help="файл, из которого индекс обратного геокодинга загружается и в который сохраняется после прогона"
+    )
+    parser.addoption(
+        "--address-index", default=None,
+        help="файл локального индекса прямого геокодинга: похожие на уже разрешённые адреса ищутся в нём, "
+        "а новые ответы api пополняют его в конце прогона"
+    )
+    parser.addoption(
+        "--address-similarity", type=float, default=constants.ADDRESS_INDEX_SIMILARITY,
+        help="минимальное сходство запроса с известным адресом (от 0 до 1), чтобы ответить из --address-index"
+    )
+    parser.addoption(
+        "--rate-limit", type=float, default=0.0,
+        help="максимум запросов в секунду к api на всю машину, общий для всех воркеров xdist (0 - без ограничения)"
+    )
+    parser.addoption(
+        "--rate-limit-burst", type=int, default=1,
+        help="сколько запросов можно отправить пачкой сверх --rate-limit после простоя"
+    )
+    parser.addoption(
+        "--rate-limit-file", default=None,
+        help="файл состояния общего лимита скорости (по умолчанию - во временной директории, свой на каждый хост)"
+    )
+    parser.addoption(
+        "--max-retries", type=int, default=constants.DEFAULT_MAX_RETRIES,
+        help="сколько раз повторять запрос, получивший 429 или 503, прежде чем проверять код ответа"
+    )
+    parser.addoption(
+        "--record", action="store_true", default=False,
+        help="записывать все обмены с api в кассеты тестов (кассеты перезаписываются)"
+    )
+    parser.addoption(
+        "--record-new", action="store_true", default=False,
+        help="отдавать записанные обмены из кассет, а в сеть ходить и дописывать в кассеты только новые"
+    )
+    parser.addoption(
+        "--replay", action="store_true", default=False,
+        help="отдавать ответы api только из кассет, без сети"
+    )
+    parser.addoption(
+        "--replay-strict", action="store_true", default=False,
+        help="как --replay, но запросы должны совпадать с кассетой по порядку и количеству"
+    )
+    parser.addoption(
+        "--timings", action="store_true", default=False,
+        help="замерять фазы каждого запроса к api и выводить сводку в отчёт"
+    )
+    parser.addoption(
+        "--timings-json", default=None,
+        help="записать замеры всех запросов и перцентили по эндпоинтам в JSON (включает --timings)"
+    )
+    parser.addoption(
+        "--timings-slowest", type=int, default=constants.DEFAULT_TIMINGS_SLOWEST,
+        help="сколько самых медленных запросов показать в отчёте"
+    )
+    parser.addoption(
+        "--golden-search", default=None,
+        help="эталонный CSV/JSONL файл для прямого геокодинга: name, lat, lon и необязательный tolerance_km"
+    )
+    parser.addoption(
+        "--golden-reverse", default=None,
+        help="эталонный CSV/JSONL файл для обратного геокодинга: lat, lon и name (ожидается в display_name)"
+    )
+    parser.addoption(
+        "--golden-chunk-size", type=int, default=constants.GOLDEN_CHUNK_SIZE,
+        help="сколько строк эталонного файла проверяет один тест"
+    )
+    parser.addoption(
+        "--sample", type=int, default=None,
+        help="проверять случайную выборку из N строк эталонного файла вместо всего файла"
+    )
+    parser.addoption(
+        "--sample-seed", type=int, default=0,
+        help="seed случайной выборки --sample"
+    )
+    parser.addoption(
+        "--shard-index", type=int, default=0,
+        help="номер шарда эталонных тестов (от 0), запускаются только его куски"
+    )
+    parser.addoption(
+        "--shard-count", type=int, default=1,
+        help="на сколько шардов делятся куски эталонных файлов"
+    )
+    parser.addoption(
+        "--cassette-dir", default=constants.DEFAULT_CASSETTE_DIR,
+        help="директория с кассетами для --record/--replay"
+    )
+
+
+def pytest_configure(config):
+    modes = [
+        mode for option, mode in (
+            ("--record", cassette.RECORD),
+            ("--record-new", cassette.RECORD_NEW),
+            ("--replay", cassette.REPLAY),
+            ("--replay-strict", cassette.REPLAY_STRICT)
+        )
+        if config.getoption(option)
+    ]
+    if len(modes) > 1:
+        raise pytest.UsageError("Options --record, --record-new, --replay and --replay-strict are mutually exclusive")
+    config.stash[CASSETTE_MODE_KEY] = modes[0] if modes else None
+    if not 0 <= config.getoption("--shard-index") < config.getoption("--shard-count"):
+        raise pytest.UsageError("Option --shard-index must be in range [0, --shard-count)")
+    if config.getoption("--single-flight-shared") and not config.getoption("--cache-dir"):
+        raise pytest.UsageError("Option --single-flight-shared requires --cache-dir")
+    if config.getoption("--timings") or config.getoption("--timings-json"):
+        config.stash[TIMING_REPORT_KEY] = timing.TimingReport()
+
+
+def pytest_generate_tests(metafunc):
+    """
+    Тесты с фикстурами golden_search_chunk/golden_reverse_chunk параметризуются кусками эталонных файлов
+    из --golden-search/--golden-reverse
+    """
+    golden.parametrize_golden(metafunc)
+
+
+def add_session_stats(config, section, stats):
+    """
+    Накопление числовой статистики сессии по разделам (пул соединений, кэш и т.д.).
+    На воркерах xdist она потом уходит в workeroutput, на мастере - суммируется и выводится в отчёт
+    """
+    all_stats = config.stash.setdefault(SESSION_STATS_KEY, {})
+    section_stats = all_stats.setdefault(section, {})
+    for name, value in stats.items():
+        section_stats[name] = section_stats.get(name, 0) + value
+
+
+@pytest.fixture(scope="session")
+def local_servers(pytestconfig):
+    """
+    Локальные заглушки Nominatim на свободных портах, по одной на каждый local в --url, свои на каждый воркер xdist.
+    Задержки из --stub-latency-ms раздаются заглушкам по порядку. Под runner_daemon заглушки живут между прогонами
+    """
+    warm_session = pytestconfig.pluginmanager.get_plugin("warm_session")
+    if warm_session is not None:
+        key = ("local_servers",) + tuple(
+            pytestconfig.getoption(option) for option in (
+                "--url", "--stub-data", "--stub-latency-ms", "--stub-latency-jitter-ms", "--stub-error-rate"
+            )
+        )
+        yield warm_session.get(key, functools.partial(start_local_servers, pytestconfig), close=stop_local_servers)
+        return
+    servers = start_local_servers(pytestconfig)
+    yield servers
+    stop_local_servers(servers)
+
+
+def start_local_servers(pytestconfig):
+    urls = pytestconfig.getoption("--url").split(",")
+    latencies = [float(latency) / 1000 for latency in pytestconfig.getoption("--stub-latency-ms").split(",")]
+    return [
+        stub_server.StubNominatimServer(
+            data_path=pytestconfig.getoption("--stub-data"),
+            latency=latencies[number % len(latencies)],
+            latency_jitter=pytestconfig.getoption("--stub-latency-jitter-ms") / 1000,
+            error_rate=pytestconfig.getoption("--stub-error-rate")
+        ).start()
+        for number in range(sum(url.strip() == constants.LOCAL_SERVER_URL for url in urls))
+    ]
+
+
+def stop_local_servers(servers):
+    for server in servers:
+        server.stop()
 
 
 @pytest.fixture(scope="session")
 def config(request):
     """
-    Сессионное задание параметров конфига (в данный момент это только config['url']
+    Сессионное задание параметров конфига: url, настройки пула соединений и кэша ответов.
+    При --url local вместо url подставляется адрес поднятой локальной заглушки. urls - все адреса из --url,
+    url - первый из них
     """
-    url = request.config.getoption("--url")
+    urls = [url.strip() for url in request.config.getoption("--url").split(",") if url.strip()]
+    if constants.LOCAL_SERVER_URL in urls:
+        local_urls = iter(server.url for server in request.getfixturevalue("local_servers"))
+        urls = [next(local_urls) if url == constants.LOCAL_SERVER_URL else url for url in urls]
+    url = urls[0]
+    cache_dir = request.config.getoption("--cache-dir")
+    single_flight_shared = request.config.getoption("--single-flight-shared")
 
     return {
-        "url": url
+        "url": url,
+        "urls": urls,
+        "request_timeout": request.config.getoption("--request-timeout"),
+        "deadline": request.config.getoption("--deadline"),
+        "hedge": request.config.getoption("--hedge"),
+        "pool_connections": request.config.getoption("--pool-connections"),
+        "pool_maxsize": request.config.getoption("--pool-maxsize"),
+        "pool_block": request.config.getoption("--pool-block"),
+        "keep_alive": not request.config.getoption("--no-keep-alive"),
+        "cache": request.config.getoption("--cache") or cache_dir is not None,
+        "cache_dir": cache_dir,
+        "cache_ttl": request.config.getoption("--cache-ttl"),
+        "cache_size": request.config.getoption("--cache-size"),
+        "reverse_radius_km": request.config.getoption("--reverse-radius-m") / 1000,
+        "reverse_index_path": request.config.getoption("--reverse-index"),
+        "address_index_path": request.config.getoption("--address-index"),
+        "address_similarity": request.config.getoption("--address-similarity"),
+        "rate_limit": request.config.getoption("--rate-limit"),
+        "rate_limit_burst": request.config.getoption("--rate-limit-burst"),
+        "rate_limit_file": request.config.getoption("--rate-limit-file") or default_state_path(url),
+        "max_retries": request.config.getoption("--max-retries"),
+        "single_flight": single_flight_shared or request.config.getoption("--single-flight"),
+        "single_flight_shared": single_flight_shared
     }
 
 
 @pytest.fixture(scope="session")
-def api_client(config):
+def api_client(config, pytestconfig):
     """
-    Возврат класса ApiClient
+    Возврат класса ApiClient. Клиент живёт всю сессию воркера, по её окончании соединения закрываются,
+    а статистика переиспользования соединений, кэша и индекса обратного геокодинга попадает в отчёт.
+    Под runner_daemon клиент с тёплым пулом соединений и кэшами живёт между прогонами (индекс адресов
+    переоткрывается, если прошлый прогон его пересобрал), а в отчёт попадает только статистика этого прогона
     """
+    warm_session = pytestconfig.pluginmanager.get_plugin("warm_session")
+    if warm_session is None:
+        client = make_api_client(config)
+    else:
+        key = ("api_client", json.dumps(config, sort_keys=True))
+        client = warm_session.get(key, functools.partial(make_api_client, config), close=ApiClient.close)
+    if warm_session is not None and client.address_index is not None:
+        client.address_index.refresh()
+    stats_before = client_stats(client) if warm_session is not None else {}
+    client.timing_hooks = []
+    timing_report = pytestconfig.stash.get(TIMING_REPORT_KEY, None)
+    if timing_report is not None:
+        client.timing_hooks.append(timing_report.add)
+    client.profiler = pytestconfig.pluginmanager.get_plugin("profiler")
+    yield client
+    for section, stats in client_stats(client).items():
+        before = stats_before.get(section, {})
+        add_session_stats(pytestconfig, section, {name: value - before.get(name, 0) for name, value in stats.items()})
+    if client.reverse_index is not None and config["reverse_index_path"]:
+        client.reverse_index.save(config["reverse_index_path"])
+    if warm_session is None:
+        client.close()
+
+
+def make_api_client(config):
+    """
+    ApiClient с пулом соединений, кэшем, индексами обратного и прямого геокодинга, лимитом скорости и склейкой
+    запросов по config
+    """
+    cache = None
+    if config["cache"]:
+        cache = ResponseCache(
+            cache_dir=config["cache_dir"], ttl=config["cache_ttl"], maxsize=config["cache_size"]
+        )
+    reverse_index = None
+    if config["reverse_radius_km"] > 0:
+        reverse_index = ReverseIndex(radius_km=config["reverse_radius_km"])
+        if config["reverse_index_path"]:
+            reverse_index.load(config["reverse_index_path"])
+    addresses = None
+    if config["address_index_path"]:
+        addresses = address_index.AddressIndex(config["address_index_path"], similarity=config["address_similarity"])
+    rate_limiter = None
+    if config["rate_limit"] > 0:
+        rate_limiter = SharedTokenBucket(
+            state_path=config["rate_limit_file"], rate=config["rate_limit"], burst=config["rate_limit_burst"]
+        )
+    single_flight = None
+    if config["single_flight"]:
+        lock_dir = os.path.join(config["cache_dir"], "singleflight") if config["single_flight_shared"] else None
+        single_flight = SingleFlight(lock_dir=lock_dir)
     return ApiClient(
-        base_url=config["url"]
+        base_url=config["urls"],
+        pool_connections=config["pool_connections"],
+        pool_maxsize=config["pool_maxsize"],
+        pool_block=config["pool_block"],
+        keep_alive=config["keep_alive"],
+        cache=cache,
+        reverse_index=reverse_index,
+        address_index=addresses,
+        rate_limiter=rate_limiter,
+        max_retries=config["max_retries"],
+        single_flight=single_flight,
+        timeout=config["request_timeout"],
+        deadline=config["deadline"],
+        hedge=config["hedge"]
+    )
+
+
+def client_stats(client):
+    """
+    Статистика клиента по разделам отчёта: пул соединений, повторы, маршрутизация, кэш, склейка запросов и индекс
+    обратного геокодинга
+    """
+    stats = {"connection pool": client.connection_stats(), "rate limit": client.retry_stats()}
+    if client.router is not None:
+        stats["routing"] = client.router.stats()
+    if client.cache is not None:
+        stats["response cache"] = client.cache.stats()
+    if client.single_flight is not None:
+        stats["single flight"] = client.single_flight.stats()
+    if client.reverse_index is not None:
+        stats["reverse index"] = client.reverse_index.stats()
+    if client.address_index is not None:
+        stats["address index"] = client.address_index.stats()
+    return stats
+
+
+@pytest.fixture(scope="function", autouse=True)
+def api_cassette(request):
+    """
+    В режимах --record*/--replay* на время теста подключает к api_client кассету этого теста
+    """
+    mode = request.config.stash[CASSETTE_MODE_KEY]
+    if mode is None:
+        yield None
+        return
+    client = request.getfixturevalue("api_client")
+    client.cassette = cassette.Cassette(
+        path=cassette.cassette_path(request.config.getoption("--cassette-dir"), request.node.nodeid),
+        mode=mode
+    )
+    yield client.cassette
+    used_cassette, client.cassette = client.cassette, None
+    used_cassette.eject()
+
+
+@pytest.fixture(scope="function", autouse=True)
+def request_timing_tags(request):
+    """
+    При включённых замерах помечает запросы теста его node id
+    """
+    if TIMING_REPORT_KEY not in request.config.stash:
+        yield
+        return
+    client = request.getfixturevalue("api_client")
+    client.timing_tags = {"nodeid": request.node.nodeid}
+    yield
+    client.timing_tags = {}
+
+
+def pytest_sessionfinish(session):
+    config = session.config
+    timing_report = config.stash.get(TIMING_REPORT_KEY, None)
+    workeroutput = getattr(config, "workeroutput", None)
+    if workeroutput is not None:
+        workeroutput["session_stats"] = config.stash.get(SESSION_STATS_KEY, {})
+        if timing_report is not None:
+            workeroutput["request_timings"] = timing_report.records
+        return
+    if timing_report is not None and config.getoption("--timings-json"):
+        with open(config.getoption("--timings-json"), "w", encoding="utf-8") as timings_file:
+            json.dump(timing_report.to_dict(), timings_file, ensure_ascii=False, indent=2)
+    if config.getoption("--address-index"):
+        documents = address_index.rebuild(config.getoption("--address-index"))
+        add_session_stats(config, "address index", {"documents": documents})
+
+
+@pytest.hookimpl(optionalhook=True)
+def pytest_testnodedown(node):
+    """Сбор статистики с завершившегося воркера xdist"""
+    workeroutput = getattr(node, "workeroutput", {})
+    for section, stats in workeroutput.get("session_stats", {}).items():
+        add_session_stats(node.config, section, stats)
+    timing_report = node.config.stash.get(TIMING_REPORT_KEY, None)
+    if timing_report is not None:
+        timing_report.extend(workeroutput.get("request_timings", []))
+
+
+def pytest_terminal_summary(terminalreporter, config):
+    all_stats = config.stash.get(SESSION_STATS_KEY, {})
+    for section, stats in all_stats.items():
+        terminalreporter.write_sep("-", section)
+        terminalreporter.write_line(
+            ", ".join(f"{name}: {value}" for name, value in stats.items())
+        )
+    timing_report = config.stash.get(TIMING_REPORT_KEY, None)
+    if timing_report is not None and timing_report.records:
+        write_timing_summary(terminalreporter, timing_report, config.getoption("--timings-slowest"))
+
+
+def write_timing_summary(terminalreporter, timing_report, slowest_count):
+    terminalreporter.write_sep("-", f"slowest {slowest_count} api requests (ms)")
+    terminalreporter.write_line(
+        f"{'total':>9} {'connect':>8} {'tls':>8} {'ttfb':>8} {'download':>8} {'decode':>8} {'source':>8}  request"
+    )
+    for record in timing_report.slowest(slowest_count):
+        phases = (record[phase] * 1000 for phase in ("total", "connect", "tls", "ttfb", "download", "json_decode"))
+        terminalreporter.write_line(
+            "{:9.2f} {:8.2f} {:8.2f} {:8.2f} {:8.2f} {:8.2f}".format(*phases)
+            + f" {record['source']:>8}  {record['tags'].get('nodeid', '')} {record['endpoint']}"
+        )
+    terminalreporter.write_sep("-", "api request percentiles by endpoint (ms)")
+    terminalreporter.write_line(
+        f"{'endpoint':<16} {'count':>6} {'p50':>8} {'p90':>8} {'p99':>8} {'ttfb p50':>9} {'ttfb p99':>9}"
     )
+    counts = {}
+    for record in timing_report.records:
+        counts[record["endpoint"]] = counts.get(record["endpoint"], 0) + 1
+    for endpoint, phases in timing_report.endpoint_summary().items():
+        total, ttfb = phases["total"], phases["ttfb"]
+        terminalreporter.write_line(
+            f"{endpoint:<16} {counts[endpoint]:>6} {total['p50']:>8.2f} {total['p90']:>8.2f} {total['p99']:>8.2f}"
+            f" {ttfb['p50']:>9.2f} {ttfb['p99']:>9.2f}"
+        )
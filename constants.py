@@ -10,3 +10,54 @@ NO_ADDRESS_LAT = "35.87935"
 NO_ADDRESS_LON = "16.67900"
 FAR_POINT_LAT = "9.1098"
 FAR_POINT_LON = "73.059"
+DEFAULT_POOL_CONNECTIONS = 10
+DEFAULT_POOL_MAXSIZE = 10
+DEFAULT_ASYNC_CONCURRENCY = 32
+DEFAULT_CACHE_TTL = 86400
+DEFAULT_CACHE_SIZE = 1024
+DEFAULT_CASSETTE_DIR = "cassettes"
+LOCAL_SERVER_URL = "local"
+STUB_DATA_PATH = "data/stub_places.json"
+STUB_MAX_URI_LENGTH = 8192
+STUB_DEFAULT_RADIUS_KM = 1.0
+STUB_POLL_INTERVAL = 0.05
+HISTOGRAM_SIGNIFICANT_BITS = 11
+DEFAULT_TIMINGS_SLOWEST = 10
+REVERSE_INDEX_MIN_CELL_DEG = 0.0001
+REVERSE_INDEX_DUPLICATE_FRACTION = 0.01
+REVERSE_INDEX_CHUNK_SIZE = 4096
+VALIDATION_REPORT_LIMIT = 20
+DEFAULT_MAX_RETRIES = 3
+RETRY_STATUSES = (429, 503)
+RETRY_BACKOFF_BASE = 0.5
+RETRY_BACKOFF_MAX = 30.0
+RATE_LIMIT_DECREASE_FACTOR = 0.5
+RATE_LIMIT_INCREASE_FRACTION = 0.05
+RATE_LIMIT_MIN_RATE_FRACTION = 0.05
+DURATION_HISTORY_KEY = "nominatim/durations"
+DURATION_DEFAULT_S = 0.1
+DURATION_SMOOTHING = 0.5
+DURATION_GROUP_SLACK = 0.5
+GOLDEN_CHUNK_SIZE = 1000
+GOLDEN_TOLERANCE_KM = 1.0
+GOLDEN_ESTIMATE_BYTES = 65536
+GOLDEN_CONCURRENCY = 10
+ROUTER_EWMA_ALPHA = 0.2
+ROUTER_EXPLORE_RATE = 0.02
+ROUTER_ERROR_COST = 1.0
+ROUTER_HEDGE_MIN_SAMPLES = 20
+ROUTER_HEDGE_PERCENTILE = 95
+LOOKUP_MAX_IDS = 50
+GEOCODE_CONCURRENCY = 8
+GEOCODE_WINDOW_FACTOR = 4
+GEOCODE_CHECKPOINT_EVERY = 1000
+GEOCODE_PROGRESS_EVERY = 2.0
+PUBLIC_RATE_LIMIT = 1.0
+PROFILE_DIR = "profiles"
+PROFILE_TOP = 20
+DAEMON_WORKERS = 2
+DAEMON_WATCH_INTERVAL = 1.0
+DAEMON_STOP_TIMEOUT = 5.0
+ADDRESS_INDEX_SIMILARITY = 0.75
+ADDRESS_INDEX_TOKEN_SIMILARITY = 0.8
+ADDRESS_INDEX_CANDIDATES = 8
@@ -0,0 +1,210 @@
+import statistics
+import time
+
+import pytest
+from xdist.scheduler import LoadScheduling
+
+import constants
+
+SCHEDULER_KEY = pytest.StashKey[object]()
+
+
+def pytest_addoption(parser):
+    """
+    Параметры планировщика xdist, учитывающего длительность тестов: --duration-schedule включает его (нужен -n),
+    длительности тестов копятся в кэше pytest (.pytest_cache) при каждом прогоне, даже без этого флага
+    """
+    parser.addoption(
+        "--duration-schedule", action="store_true", default=False,
+        help="раздавать тесты воркерам xdist по длительности из прошлых прогонов: сначала самые долгие, "
+        "тесты одного эндпоинта - на один воркер"
+    )
+    parser.addoption(
+        "--duration-default", type=float, default=None,
+        help="ожидаемая длительность теста без истории, в секундах (по умолчанию - медиана известных)"
+    )
+
+
+def endpoint_group(nodeid):
+    """
+    Группа теста - модуль и класс (TestSimpleSearch, TestReverse и т.д.), то есть по сути эндпоинт api
+    """
+    return "::".join(nodeid.split("::")[:2])
+
+
+def plan_schedule(nodeids, durations, workers_count):
+    """
+    Жадное LPT-расписание: тесты по убыванию ожидаемой длительности отдаются наименее загруженному воркеру.
+    Если несколько воркеров загружены почти одинаково (разница меньше половины длительности теста), тест уходит
+    тому из них, у кого уже есть тесты той же группы - так пул соединений и кэши воркера остаются тёплыми.
+    Возвращает очереди индексов тестов на каждого воркера и предсказанный makespan
+    """
+    order = sorted(range(len(nodeids)), key=lambda index: durations[index], reverse=True)
+    queues = [[] for _ in range(workers_count)]
+    loads = [0.0] * workers_count
+    groups = [set() for _ in range(workers_count)]
+    for index in order:
+        group = endpoint_group(nodeids[index])
+        least_loaded = min(loads)
+        candidates = [
+            worker for worker in range(workers_count)
+            if loads[worker] - least_loaded <= durations[index] * constants.DURATION_GROUP_SLACK
+        ]
+        worker = min(candidates, key=lambda candidate: (group not in groups[candidate], loads[candidate]))
+        queues[worker].append(index)
+        loads[worker] += durations[index]
+        groups[worker].add(group)
+    return queues, max(loads, default=0.0)
+
+
+class DurationScheduling(LoadScheduling):
+    """
+    Планировщик xdist по длительности тестов. После сбора тестов строит LPT-расписание по истории длительностей
+    и раздаёт каждому воркеру его очередь по два теста за раз. Если воркер разобрал свою очередь раньше остальных
+    (история соврала), он забирает самые короткие тесты из хвоста самой загруженной очереди
+    """
+
+    def __init__(self, config, log=None):
+        super().__init__(config, log)
+        self.node2queue = {}
+        self.durations = []
+        self.predicted_makespan = None
+        self.started = None
+
+    def schedule(self):
+        assert self.collection_is_completed
+        if self.collection is not None:
+            for node in self.nodes:
+                self.check_schedule(node)
+            return
+        if not self._check_nodes_have_same_collection():
+            self.log("**Different tests collected, aborting run**")
+            return
+
+        self.collection = list(self.node2collection.values())[0]
+        self.pending[:] = range(len(self.collection))
+        if not self.collection:
+            return
+        self.durations = expected_durations(self.config, self.collection)
+        queues, self.predicted_makespan = plan_schedule(self.collection, self.durations, len(self.nodes))
+        self.node2queue = dict(zip(self.nodes, queues))
+        self.started = time.perf_counter()
+        for node in self.nodes:
+            self.check_schedule(node)
+
+    def check_schedule(self, node, duration=0):
+        if node.shutting_down:
+            return
+        if not self.pending:
+            node.shutdown()
+            return
+        node_pending = self.node2pending[node]
+        if len(node_pending) < 2:
+            self._send_tests(node, 2 - len(node_pending))
+
+    def remove_node(self, node):
+        self.node2queue.pop(node, None)
+        return super().remove_node(node)
+
+    def _send_tests(self, node, num):
+        items = self._next_items(node, num)
+        if items:
+            unsent = set(items)
+            self.pending[:] = [index for index in self.pending if index not in unsent]
+            self.node2pending[node].extend(items)
+            node.send_runtest_some(items)
+
+    def _next_items(self, node, count):
+        unsent = set(self.pending)
+        queue = self.node2queue.setdefault(node, [])
+        queue[:] = [index for index in queue if index in unsent]
+        while len(queue) < count and unsent.difference(queue):
+            planned = {index for planned_queue in self.node2queue.values() for index in planned_queue}
+            orphans = [index for index in self.pending if index not in planned]
+            if orphans:
+                queue.extend(sorted(orphans, key=lambda index: self.durations[index], reverse=True))
+                continue
+            victim = max(
+                (other for other in self.node2queue.values() if other is not queue and other),
+                key=lambda other: sum(self.durations[index] for index in other if index in unsent),
+                default=None
+            )
+            if victim is None:
+                break
+            queue.append(victim.pop())
+        items = queue[:count]
+        del queue[:count]
+        return items
+
+
+def expected_durations(config, nodeids):
+    """
+    Ожидаемая длительность каждого теста по истории. Тестам без истории достаётся --duration-default
+    или медиана известных длительностей. Без кэша pytest (-p no:cacheprovider) истории нет
+    """
+    cache = getattr(config, "cache", None)
+    history = cache.get(constants.DURATION_HISTORY_KEY, {}) if cache is not None else {}
+    known = [history[nodeid] for nodeid in nodeids if nodeid in history]
+    default = config.getoption("--duration-default")
+    if default is None:
+        default = statistics.median(known) if known else constants.DURATION_DEFAULT_S
+    return [history.get(nodeid, default) for nodeid in nodeids]
+
+
+@pytest.hookimpl(optionalhook=True)
+def pytest_xdist_make_scheduler(config, log):
+    if not config.getoption("--duration-schedule"):
+        return None
+    scheduler = DurationScheduling(config, log)
+    config.stash[SCHEDULER_KEY] = scheduler
+    return scheduler
+
+
+def pytest_configure(config):
+    if not hasattr(config, "workerinput"):
+        config.pluginmanager.register(DurationRecorder(config), "duration_recorder")
+
+
+class DurationRecorder:
+    def __init__(self, config):
+        """
+        Работает на мастере (или в прогоне без xdist): копит длительность каждого теста (setup + call + teardown)
+        и занятость каждого воркера, а в конце сессии сохраняет длительности в историю
+        """
+        self.config = config
+        self.durations = {}
+        self.worker_busy = {}
+
+    def pytest_runtest_logreport(self, report):
+        self.durations[report.nodeid] = self.durations.get(report.nodeid, 0.0) + report.duration
+        node = getattr(report, "node", None)
+        worker = node.gateway.id if node is not None else "main"
+        self.worker_busy[worker] = self.worker_busy.get(worker, 0.0) + report.duration
+
+    def pytest_sessionfinish(self):
+        """
+        Новая длительность сглаживается с прошлой, чтобы один медленный прогон не ломал расписание
+        """
+        if getattr(self.config, "cache", None) is None or not self.durations:
+            return
+        history = self.config.cache.get(constants.DURATION_HISTORY_KEY, {})
+        for nodeid, duration in self.durations.items():
+            previous = history.get(nodeid)
+            if previous is None:
+                history[nodeid] = duration
+            else:
+                history[nodeid] = previous + constants.DURATION_SMOOTHING * (duration - previous)
+        self.config.cache.set(constants.DURATION_HISTORY_KEY, history)
+
+    def pytest_terminal_summary(self, terminalreporter):
+        scheduler = self.config.stash.get(SCHEDULER_KEY, None)
+        if scheduler is None or scheduler.predicted_makespan is None:
+            return
+        terminalreporter.write_sep("-", "duration schedule")
+        line = f"predicted makespan: {scheduler.predicted_makespan:.2f}s"
+        if self.worker_busy:
+            busiest = max(self.worker_busy, key=self.worker_busy.get)
+            line += f", actual makespan: {self.worker_busy[busiest]:.2f}s (busiest worker {busiest})"
+        if scheduler.started is not None:
+            line += f", wall time since scheduling: {time.perf_counter() - scheduler.started:.2f}s"
+        terminalreporter.write_line(line)
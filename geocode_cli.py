@@ -0,0 +1,333 @@
+"""
+Пакетный геокодинг из командной строки на тех же search_address_or_name/reverse_lat_and_lon, что и тесты.
+Читает адреса или координаты потоком из stdin, CSV или JSONL, держит в полёте не больше --concurrency запросов,
+пишет результаты в JSONL в порядке входа и периодически сохраняет прогресс, так что убитый прогон продолжается
+с места остановки. Скорость и оставшееся время печатаются в stderr.
+
+Примеры:
+    python geocode_cli.py --url local --input addresses.csv --output geocoded.jsonl
+    cat points.txt | python geocode_cli.py --url local --mode reverse --output points.jsonl --concurrency 16
+"""
+import argparse
+import csv
+import json
+import os
+import re
+import sys
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+import constants
+from apiclient import ApiClient
+from base_case import ApiBase
+from benchmark import is_public_url, start_local_server
+from builder import Builder
+from geo import haversine_km
+from ratelimit import SharedTokenBucket, default_state_path
+
+LAT_LON_RE = re.compile(r"\s*(-?\d+(?:\.\d+)?)\s*[,; ]\s*(-?\d+(?:\.\d+)?)\s*")
+ADDRESS_FIELDS = ("address", "name", "q")
+
+
+def detect_format(path, input_format):
+    if input_format != "auto":
+        return input_format
+    if path and path.endswith(".csv"):
+        return "csv"
+    if path and path.endswith((".jsonl", ".json")):
+        return "jsonl"
+    return "lines"
+
+
+def parse_row(line, input_format, header):
+    """
+    Строка входа в словарь: из CSV - по заголовку, из JSONL - как есть, простая строка - это адрес
+    или пара "lat,lon". Если строка не разбирается, бросается ValueError
+    """
+    text = line.decode("utf-8-sig").rstrip("\r\n")
+    if input_format == "jsonl":
+        row = json.loads(text)
+        if not isinstance(row, dict):
+            raise ValueError(f"expected a JSON object, got {type(row).__name__}")
+        return row
+    if input_format == "csv":
+        return dict(zip(header, next(csv.reader([text]))))
+    match = LAT_LON_RE.fullmatch(text)
+    if match:
+        return {"lat": match.group(1), "lon": match.group(2)}
+    return {"address": text.strip()}
+
+
+def read_rows(stream, input_format, header=None, start_index=0, skip_rows=0):
+    """
+    Потоковое чтение входа: тройки (номер записи, запись, смещение в потоке после неё). Пустые строки пропускаются.
+    Для CSV первая строка - заголовок, если он не передан в header. Первые skip_rows записей пропускаются
+    без разбора - так продолжается прогон из stdin, который нельзя перемотать. Вместо записи, которая
+    не разобралась, отдаётся её ошибка - она попадает в результат этой записи, а чтение продолжается
+    """
+    offset = stream.tell() if stream.seekable() else 0
+    index = start_index
+    for line in stream:
+        offset += len(line)
+        if not line.strip():
+            continue
+        if input_format == "csv" and header is None:
+            header = next(csv.reader([line.decode("utf-8-sig")]))
+            continue
+        if index >= start_index + skip_rows:
+            try:
+                row = parse_row(line, input_format, header)
+            except (ValueError, csv.Error) as error:
+                row = ValueError(f"cannot parse row {line.decode('utf-8', 'replace').strip()!r}: {error}")
+            yield index, row, offset
+        index += 1
+
+
+class Geocoder(ApiBase):
+    def __init__(self, api_client, mode="auto", tolerance_km=constants.GOLDEN_TOLERANCE_KM):
+        """
+        ApiBase вне pytest: api_client и builder задаются напрямую, а не фикстурой.
+        mode - search, reverse или auto (записи с lat/lon без адреса идут в обратный геокодинг)
+        """
+        self.api_client = api_client
+        self.builder = Builder()
+        self.mode = mode
+        self.tolerance_km = tolerance_km
+
+    def geocode(self, index, row):
+        """
+        Builder -> запрос -> json -> проверка для одной записи. Любые ошибки записи (в том числе её разбора)
+        не прерывают прогон, а попадают в её результат
+        """
+        if isinstance(row, Exception):
+            return {"row": index, "input": None, "status": "error", "error": str(row)}
+        try:
+            return self._geocode(index, row)
+        except Exception as error:
+            return {"row": index, "input": row, "status": "error", "error": str(error) or type(error).__name__}
+
+    def _geocode(self, index, row):
+        record = {"row": index, "input": row}
+        if self._is_reverse(row):
+            if row.get("lat") in (None, "") or row.get("lon") in (None, ""):
+                raise ValueError("no lat/lon in row for reverse geocoding")
+            params = self.builder.reverse(lat=row["lat"], lon=row["lon"]).params_for_api
+            place = self.reverse_lat_and_lon(params=params)
+            place = None if "error" in place else place
+        else:
+            address = next((row[field] for field in ADDRESS_FIELDS if row.get(field)), None)
+            if address is None:
+                raise ValueError(f"no address in row, expected one of {ADDRESS_FIELDS}")
+            places = self.search_address_or_name(params=self.builder.search(address=address).params_for_api)
+            place = places[0] if places else None
+        if place is None:
+            record["status"] = "not_found"
+            return record
+        record.update(status="ok", result={
+            field: place.get(field) for field in ("place_id", "osm_type", "osm_id", "display_name", "lat", "lon")
+        })
+        if not self._is_reverse(row) and row.get("lat") not in (None, "") and row.get("lon") not in (None, ""):
+            distance = haversine_km(float(row["lat"]), float(row["lon"]), float(place["lat"]), float(place["lon"]))
+            record["distance_km"] = round(distance, 3)
+            if distance > float(row.get("tolerance_km") or self.tolerance_km):
+                record["status"] = "mismatch"
+        return record
+
+    def _is_reverse(self, row):
+        if self.mode != "auto":
+            return self.mode == "reverse"
+        return "lat" in row and "lon" in row and not any(row.get(field) for field in ADDRESS_FIELDS)
+
+
+def geocode_ordered(rows, geocode, concurrency, first_index=0):
+    """
+    Параллельный геокодинг с выдачей результатов в порядке входа. В полёте и в буфере ожидания вместе держится
+    не больше concurrency * constants.GEOCODE_WINDOW_FACTOR записей, так что память не растёт с размером входа.
+    Отдаёт пары (результат, смещение во входе после записи)
+    """
+    window = concurrency * constants.GEOCODE_WINDOW_FACTOR
+    in_flight = {}
+    ready = {}
+    next_index = first_index
+    exhausted = False
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        while True:
+            while not exhausted and len(in_flight) + len(ready) < window:
+                try:
+                    index, row, offset = next(rows)
+                except StopIteration:
+                    exhausted = True
+                    break
+                in_flight[executor.submit(geocode, index, row)] = (index, offset)
+            if not in_flight:
+                return
+            done, _ = wait(in_flight, return_when=FIRST_COMPLETED)
+            for future in done:
+                index, offset = in_flight.pop(future)
+                ready[index] = (future.result(), offset)
+            while next_index in ready:
+                yield ready.pop(next_index)
+                next_index += 1
+
+
+class Checkpoint:
+    def __init__(self, path, input_path):
+        """
+        Прогресс прогона в JSON: сколько записей записано, до какого байта дописан выход и дочитан вход
+        """
+        self.path = path
+        self.input_path = input_path
+
+    def load(self):
+        if not os.path.exists(self.path):
+            return None
+        with open(self.path, encoding="utf-8") as checkpoint_file:
+            state = json.load(checkpoint_file)
+        if state.get("input") != self.input_path:
+            raise SystemExit(f"Checkpoint {self.path} belongs to input {state.get('input')!r}, not {self.input_path!r}")
+        return state
+
+    def save(self, rows, output_bytes, input_bytes):
+        temporary_path = f"{self.path}.tmp"
+        with open(temporary_path, "w", encoding="utf-8") as checkpoint_file:
+            json.dump(
+                {"input": self.input_path, "rows": rows, "output_bytes": output_bytes, "input_bytes": input_bytes},
+                checkpoint_file
+            )
+        os.replace(temporary_path, self.path)
+
+    def remove(self):
+        if os.path.exists(self.path):
+            os.remove(self.path)
+
+
+class Progress:
+    def __init__(self, every, total_bytes=None, start_rows=0, start_bytes=0):
+        """
+        Печать скорости (записей в секунду) и оставшегося времени в stderr раз в every секунд. Оставшееся время
+        считается по прочитанным байтам входа, поэтому известно только для файла
+        """
+        self.every = every
+        self.total_bytes = total_bytes
+        self.start_rows = start_rows
+        self.start_bytes = start_bytes
+        self.started = time.monotonic()
+        self.printed = self.started
+
+    def update(self, rows, input_bytes, force=False):
+        now = time.monotonic()
+        if not force and now - self.printed < self.every:
+            return
+        self.printed = now
+        elapsed = max(now - self.started, 1e-9)
+        line = f"rows: {rows}, {(rows - self.start_rows) / elapsed:.1f} rows/s"
+        if self.total_bytes:
+            speed = (input_bytes - self.start_bytes) / elapsed
+            if speed > 0:
+                eta = int((self.total_bytes - input_bytes) / speed)
+                line += f", {100 * input_bytes / self.total_bytes:.1f}%"
+                line += f", ETA {eta // 3600}:{eta // 60 % 60:02d}:{eta % 60:02d}"
+        print(line, file=sys.stderr, flush=True)
+
+
+def run(args, client):
+    input_format = detect_format(args.input, args.format)
+    checkpoint = Checkpoint(args.checkpoint or f"{args.output}.checkpoint", os.path.abspath(args.input or "-"))
+    state = checkpoint.load() or {"rows": 0, "output_bytes": 0, "input_bytes": 0}
+
+    if args.input:
+        stream = open(args.input, "rb")
+        total_bytes = os.path.getsize(args.input)
+    else:
+        stream = sys.stdin.buffer
+        total_bytes = None
+    if args.input and state["input_bytes"]:
+        header = None
+        if input_format == "csv":
+            header = next(csv.reader([stream.readline().decode("utf-8-sig")]))
+        stream.seek(state["input_bytes"])
+        rows = read_rows(stream, input_format, header=header, start_index=state["rows"])
+    else:
+        rows = read_rows(stream, input_format, skip_rows=state["rows"])
+
+    geocoder = Geocoder(client, mode=args.mode)
+    progress = Progress(args.progress_every, total_bytes, start_rows=state["rows"], start_bytes=state["input_bytes"])
+    written, input_bytes = state["rows"], state["input_bytes"]
+    statuses = {}
+    with open(args.output, "r+b" if state["output_bytes"] else "wb") as output:
+        output.truncate(state["output_bytes"])
+        output.seek(state["output_bytes"])
+        try:
+            results = geocode_ordered(rows, geocoder.geocode, args.concurrency, first_index=state["rows"])
+            for record, input_bytes in results:
+                output.write(json.dumps(record, ensure_ascii=False).encode("utf-8") + b"\n")
+                written += 1
+                statuses[record["status"]] = statuses.get(record["status"], 0) + 1
+                if written % args.checkpoint_every == 0:
+                    output.flush()
+                    os.fsync(output.fileno())
+                    checkpoint.save(written, output.tell(), input_bytes)
+                progress.update(written, input_bytes)
+        except KeyboardInterrupt:
+            print(f"interrupted, progress saved to {checkpoint.path}", file=sys.stderr)
+            raise SystemExit(130)
+        finally:
+            # прогресс сохраняется при любом выходе из цикла, а не только по Ctrl+C, чтобы повтор не начинал с начала
+            output.flush()
+            checkpoint.save(written, output.tell(), input_bytes)
+            if stream is not sys.stdin.buffer:
+                stream.close()
+    checkpoint.remove()
+    progress.update(written, input_bytes, force=True)
+    print(f"done: {json.dumps(statuses)}", file=sys.stderr)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Пакетный геокодинг адресов и координат в JSONL")
+    parser.add_argument(
+        "--url", required=True,
+        help="адрес api или local; на публичном сервере Nominatim запросы идут по одному и не чаще раза в секунду"
+    )
+    parser.add_argument("--input", help="CSV, JSONL или текстовый файл, по умолчанию - stdin")
+    parser.add_argument("--format", choices=("auto", "lines", "csv", "jsonl"), default="auto")
+    parser.add_argument("--mode", choices=("auto", "search", "reverse"), default="auto")
+    parser.add_argument("--output", required=True, help="JSONL-файл с результатами")
+    parser.add_argument("--checkpoint", help="файл прогресса, по умолчанию - <output>.checkpoint")
+    parser.add_argument("--checkpoint-every", type=int, default=constants.GEOCODE_CHECKPOINT_EVERY)
+    parser.add_argument("--concurrency", type=int, default=constants.GEOCODE_CONCURRENCY)
+    parser.add_argument(
+        "--rate-limit", type=float, default=0.0, help="максимум запросов в секунду (0 - без ограничения)"
+    )
+    parser.add_argument("--progress-every", type=float, default=constants.GEOCODE_PROGRESS_EVERY)
+    args = parser.parse_args()
+    if is_public_url(args.url):
+        # правила использования публичного Nominatim: не больше запроса в секунду и без параллельных запросов
+        args.concurrency = 1
+        args.rate_limit = min(args.rate_limit or constants.PUBLIC_RATE_LIMIT, constants.PUBLIC_RATE_LIMIT)
+        print(
+            f"public server: concurrency 1, at most {args.rate_limit:g} request/s", file=sys.stderr, flush=True
+        )
+
+    server_process = None
+    url = args.url
+    if url == constants.LOCAL_SERVER_URL:
+        server_process, url = start_local_server()
+    rate_limiter = None
+    if args.rate_limit > 0:
+        rate_limiter = SharedTokenBucket(state_path=default_state_path(url), rate=args.rate_limit)
+    client = ApiClient(
+        base_url=url,
+        pool_maxsize=max(args.concurrency, constants.DEFAULT_POOL_MAXSIZE),
+        rate_limiter=rate_limiter
+    )
+    try:
+        run(args, client)
+    finally:
+        client.close()
+        if server_process is not None:
+            server_process.terminate()
+            server_process.wait()
+
+
+if __name__ == "__main__":
+    main()
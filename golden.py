@@ -0,0 +1,173 @@
+import csv
+import json
+import os
+import random
+
+import pytest
+
+import constants
+import validation
+
+GOLDEN_FIXTURES = {
+    "golden_search_chunk": "--golden-search",
+    "golden_reverse_chunk": "--golden-reverse"
+}
+
+
+class GoldenChunk:
+    def __init__(self, path, chunk_id, start=None, end=None, offsets=None):
+        """
+        Кусок эталонного файла, который проверяется одним тестом. Строки не хранятся, а читаются с диска во время
+        теста: либо все строки, начинающиеся в диапазоне байт [start, end), либо строки по списку смещений offsets
+        (для выборки --sample). Одна строка файла - одна запись, в CSV первая строка - заголовок
+        """
+        self.path = path
+        self.chunk_id = chunk_id
+        self.start = start
+        self.end = end
+        self.offsets = offsets
+
+    def __repr__(self):
+        return self.chunk_id
+
+    def rows(self):
+        """
+        Пары (смещение строки в файле, запись-словарь)
+        """
+        is_csv = self.path.endswith(".csv")
+        with open(self.path, "rb") as golden_file:
+            header = _csv_header(golden_file) if is_csv else None
+            for offset, line in self._lines(golden_file):
+                if not line.strip() or (is_csv and offset == 0):
+                    continue
+                yield offset, _parse_line(line, header)
+
+    def _lines(self, golden_file):
+        if self.offsets is not None:
+            for offset in self.offsets:
+                golden_file.seek(offset)
+                yield offset, golden_file.readline()
+            return
+        if self.start > 0:
+            golden_file.seek(self.start - 1)
+            golden_file.readline()
+        else:
+            golden_file.seek(0)
+        offset = golden_file.tell()
+        while offset < self.end:
+            line = golden_file.readline()
+            if not line:
+                return
+            yield offset, line
+            offset += len(line)
+
+    def relabel(self, report, offsets):
+        """
+        Отчёт проверки, где у каждой упавшей строки вместо номера в куске указано её смещение в файле
+        """
+        failures = [
+            validation.ValidationFailure(failure.index, f"@byte {offsets[failure.index]}: {failure.message}")
+            for failure in report.failures
+        ]
+        return validation.ValidationReport(f"{report.name} in {self.chunk_id}", report.total, failures)
+
+
+def _csv_header(golden_file):
+    position = golden_file.tell()
+    golden_file.seek(0)
+    header = next(csv.reader([golden_file.readline().decode("utf-8-sig")]))
+    golden_file.seek(position)
+    return header
+
+
+def _parse_line(line, header):
+    text = line.decode("utf-8-sig").rstrip("\r\n")
+    if header is None:
+        return json.loads(text)
+    return dict(zip(header, next(csv.reader([text]))))
+
+
+def _row_offsets(path):
+    """
+    Потоковый проход по файлу: смещения всех строк с данными, без чтения самих записей в память
+    """
+    skip_header = path.endswith(".csv")
+    with open(path, "rb") as golden_file:
+        offset = 0
+        for line in golden_file:
+            if line.strip() and not (skip_header and offset == 0):
+                yield offset
+            offset += len(line)
+
+
+def sample_offsets(path, size, seed):
+    """
+    Случайная выборка size строк файла за один потоковый проход (reservoir sampling). С одним seed выборка
+    одинакова на всех воркерах xdist, поэтому они собирают одинаковые тесты
+    """
+    rng = random.Random(seed)
+    reservoir = []
+    for seen, offset in enumerate(_row_offsets(path)):
+        if seen < size:
+            reservoir.append(offset)
+        else:
+            replace = rng.randrange(seen + 1)
+            if replace < size:
+                reservoir[replace] = offset
+    return sorted(reservoir)
+
+
+def _estimate_row_bytes(path):
+    with open(path, "rb") as golden_file:
+        head = golden_file.read(constants.GOLDEN_ESTIMATE_BYTES)
+    lines = head.count(b"\n")
+    return max(len(head) // lines, 1) if lines else max(len(head), 1)
+
+
+def golden_chunks(path, chunk_size, sample=None, seed=0, shard_index=0, shard_count=1):
+    """
+    Разбиение эталонного файла на куски примерно по chunk_size строк. Без выборки файл режется по байтам (границы
+    выравниваются по строкам уже при чтении), так что сбор тестов не читает файл целиком даже на миллионе строк.
+    С sample берётся случайная выборка строк с seed. При шардировании остаются куски с номером shard_index по модулю
+    shard_count
+    """
+    name = os.path.basename(path)
+    if sample:
+        offsets = sample_offsets(path, sample, seed)
+        chunks = [
+            GoldenChunk(path, f"{name}:sample{seed}[{number}]", offsets=offsets[start:start + chunk_size])
+            for number, start in enumerate(range(0, len(offsets), chunk_size))
+        ]
+    else:
+        file_size = os.path.getsize(path)
+        chunk_bytes = chunk_size * _estimate_row_bytes(path)
+        chunks = []
+        for start in range(0, file_size, chunk_bytes):
+            end = min(start + chunk_bytes, file_size)
+            chunks.append(GoldenChunk(path, f"{name}[{start}:{end}]", start=start, end=end))
+    return [chunk for number, chunk in enumerate(chunks) if number % shard_count == shard_index]
+
+
+def parametrize_golden(metafunc):
+    """
+    Параметризация тестов, которые просят фикстуру golden_*_chunk, кусками эталонного файла из соответствующего
+    параметра. Без файла тест пропускается
+    """
+    config = metafunc.config
+    for fixture_name, option in GOLDEN_FIXTURES.items():
+        if fixture_name not in metafunc.fixturenames:
+            continue
+        path = config.getoption(option)
+        if not path:
+            skip = pytest.mark.skip(reason=f"no {option} file given")
+            metafunc.parametrize(fixture_name, [pytest.param(None, id="no-file", marks=skip)])
+            continue
+        chunks = golden_chunks(
+            path,
+            chunk_size=config.getoption("--golden-chunk-size"),
+            sample=config.getoption("--sample"),
+            seed=config.getoption("--sample-seed"),
+            shard_index=config.getoption("--shard-index"),
+            shard_count=config.getoption("--shard-count")
+        )
+        metafunc.parametrize(fixture_name, chunks, ids=[chunk.chunk_id for chunk in chunks])
@@ -0,0 +1,64 @@
+import math
+
+import constants
+
+PERCENTILES = (50, 90, 99, 99.9)
+
+
+class LatencyHistogram:
+    def __init__(self, significant_bits=constants.HISTOGRAM_SIGNIFICANT_BITS):
+        """
+        Гистограмма задержек в духе HdrHistogram: значения в микросекундах раскладываются по корзинам, ширина
+        которых растёт вместе со значением, так что относительная погрешность не больше 1 / 2 ** significant_bits
+        при фиксированной памяти, сколько бы значений ни было записано
+        """
+        self.significant_bits = significant_bits
+        self.counts = {}
+        self.count = 0
+        self.total = 0
+        self.min = None
+        self.max = None
+
+    def _bucket(self, value):
+        shift = max(value.bit_length() - self.significant_bits, 0)
+        return shift, value >> shift
+
+    def record(self, seconds):
+        value = max(int(seconds * 1_000_000), 0)
+        bucket = self._bucket(value)
+        self.counts[bucket] = self.counts.get(bucket, 0) + 1
+        self.count += 1
+        self.total += value
+        self.min = value if self.min is None else min(self.min, value)
+        self.max = value if self.max is None else max(self.max, value)
+
+    def merge(self, other):
+        for bucket, count in other.counts.items():
+            self.counts[bucket] = self.counts.get(bucket, 0) + count
+        self.count += other.count
+        self.total += other.total
+        for value in (other.min, other.max):
+            if value is not None:
+                self.min = value if self.min is None else min(self.min, value)
+                self.max = value if self.max is None else max(self.max, value)
+
+    def percentile(self, percent):
+        """
+        Значение перцентиля в микросекундах (верхняя граница корзины, в которую он попал)
+        """
+        if not self.count:
+            return 0
+        rank = max(math.ceil(self.count * percent / 100), 1)
+        seen = 0
+        for shift, sub_bucket in sorted(self.counts, key=lambda bucket: bucket[1] << bucket[0]):
+            seen += self.counts[(shift, sub_bucket)]
+            if seen >= rank:
+                return min(((sub_bucket + 1) << shift) - 1, self.max)
+        return self.max
+
+    def summary_ms(self):
+        summary = {f"p{percent:g}": self.percentile(percent) / 1000 for percent in PERCENTILES}
+        summary["min"] = (self.min or 0) / 1000
+        summary["max"] = (self.max or 0) / 1000
+        summary["mean"] = self.total / self.count / 1000 if self.count else 0
+        return summary
@@ -0,0 +1,231 @@
+import contextlib
+import cProfile
+import io
+import json
+import os
+import pstats
+import sys
+import threading
+import tracemalloc
+
+import pytest
+
+import constants
+
+# с 3.12 cProfile работает через sys.monitoring: профиль один на процесс и видит все потоки, а второй
+# включённый профиль бросает ValueError
+SHARED_PROFILE = sys.version_info >= (3, 12)
+
+
+def pytest_addoption(parser):
+    """
+    Профилирование клиентской стороны тестов: --profile - CPU через cProfile, --profile-mem - выделения памяти через
+    tracemalloc, --profile-scope - границы профилирования. Без первых двух флагов плагин не регистрируется
+    и ничего не стоит
+    """
+    parser.addoption(
+        "--profile", action="store_true", default=False,
+        help="профилировать CPU через cProfile в границах --profile-scope"
+    )
+    parser.addoption(
+        "--profile-mem", action="store_true", default=False,
+        help="считать выделения памяти через tracemalloc в границах --profile-scope"
+    )
+    parser.addoption(
+        "--profile-scope", default="test", choices=("test", "request"),
+        help="что профилировать: каждый тест целиком (test, по умолчанию) или только вызовы request_custom (request)"
+    )
+    parser.addoption(
+        "--profile-dir", default=constants.PROFILE_DIR,
+        help="куда писать профили: по .prof на воркер, общий combined.prof и memory.json"
+    )
+    parser.addoption(
+        "--profile-top", type=int, default=constants.PROFILE_TOP,
+        help="сколько функций и мест выделения памяти показать в отчёте"
+    )
+
+
+def pytest_configure(config):
+    cpu = config.getoption("--profile")
+    memory = config.getoption("--profile-mem")
+    if not cpu and not memory:
+        return
+    profiler = Profiler(
+        directory=config.getoption("--profile-dir"),
+        cpu=cpu,
+        memory=memory,
+        scope=config.getoption("--profile-scope"),
+        top=config.getoption("--profile-top")
+    )
+    config.pluginmanager.register(profiler, "profiler")
+
+
+class Profiler:
+    def __init__(self, directory, cpu=True, memory=False, scope="test", top=constants.PROFILE_TOP):
+        """
+        До Python 3.12 cProfile работает только в своём потоке, поэтому у каждого потока (главного и потоков
+        AsyncApiClient) свой профиль, а в конце они сливаются через pstats. С 3.12 профиль один на процесс:
+        он включается входом в первый профилируемый участок и выключается выходом из последнего. Если в процессе
+        уже работает другой профилировщик, CPU не профилируется, а причина печатается в отчёте.
+        Вложенные вызовы (request_custom внутри профилируемого теста) не включают профиль повторно. Память
+        считается разницей снимков tracemalloc от входа в первый профилируемый участок до выхода из последнего,
+        поэтому одновременные запросы не считаются дважды
+        """
+        self.directory = directory
+        self.cpu = cpu
+        self.memory = memory
+        self.scope = scope
+        self.top = top
+        self.profiles = []
+        self.allocations = {}
+        self.worker_paths = []
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self._active = 0
+        self._snapshot = None
+        self._cpu_active = 0
+        self._shared_profile = None
+        self.cpu_error = None
+
+    @contextlib.contextmanager
+    def profiling(self):
+        depth = getattr(self._local, "depth", 0)
+        self._local.depth = depth + 1
+        if depth == 0:
+            self._start()
+        try:
+            yield
+        finally:
+            self._local.depth = depth
+            if depth == 0:
+                self._stop()
+
+    def _start(self):
+        if self.memory:
+            with self._lock:
+                self._active += 1
+                if self._active == 1:
+                    if not tracemalloc.is_tracing():
+                        tracemalloc.start()
+                    self._snapshot = self._take_snapshot()
+        if self.cpu and SHARED_PROFILE:
+            self._enable_shared()
+        elif self.cpu:
+            profile = getattr(self._local, "profile", None)
+            if profile is None:
+                profile = self._local.profile = cProfile.Profile()
+                with self._lock:
+                    self.profiles.append(profile)
+            profile.enable()
+
+    def _enable_shared(self):
+        with self._lock:
+            self._cpu_active += 1
+            if self._cpu_active > 1 or self.cpu_error is not None:
+                return
+            if self._shared_profile is None:
+                self._shared_profile = cProfile.Profile()
+                self.profiles.append(self._shared_profile)
+            try:
+                self._shared_profile.enable()
+            except ValueError as error:
+                self.cpu_error = str(error)
+
+    def _stop(self):
+        if self.cpu and SHARED_PROFILE:
+            with self._lock:
+                self._cpu_active -= 1
+                if self._cpu_active == 0 and self.cpu_error is None:
+                    self._shared_profile.disable()
+        elif self.cpu:
+            self._local.profile.disable()
+        if self.memory:
+            with self._lock:
+                self._active -= 1
+                if self._active == 0:
+                    self._add_allocations(self._take_snapshot().compare_to(self._snapshot, "lineno"))
+                    self._snapshot = None
+
+    @staticmethod
+    def _take_snapshot():
+        return tracemalloc.take_snapshot().filter_traces([tracemalloc.Filter(False, tracemalloc.__file__)])
+
+    def _add_allocations(self, differences):
+        for difference in differences:
+            if difference.size_diff <= 0:
+                continue
+            frame = difference.traceback[0]
+            site = f"{frame.filename}:{frame.lineno}"
+            size, count = self.allocations.get(site, (0, 0))
+            self.allocations[site] = (size + difference.size_diff, count + max(difference.count_diff, 0))
+
+    @pytest.hookimpl(hookwrapper=True)
+    def pytest_runtest_call(self, item):
+        if self.scope != "test":
+            yield
+            return
+        with self.profiling():
+            yield
+
+    def pytest_sessionfinish(self, session):
+        config = session.config
+        if self.memory and tracemalloc.is_tracing():
+            tracemalloc.stop()
+        path = self._dump(config.workerinput["workerid"] if hasattr(config, "workerinput") else "main")
+        workeroutput = getattr(config, "workeroutput", None)
+        if workeroutput is not None:
+            workeroutput["profile_path"] = path
+            workeroutput["profile_allocations"] = self.allocations
+            workeroutput["profile_cpu_error"] = self.cpu_error
+        elif path is not None:
+            self.worker_paths.append(path)
+
+    def _dump(self, name):
+        profiles = [profile for profile in self.profiles if profile.getstats()]
+        if not profiles:
+            return None
+        os.makedirs(self.directory, exist_ok=True)
+        path = os.path.join(self.directory, f"{name}.prof")
+        stats = pstats.Stats(profiles[0])
+        for profile in profiles[1:]:
+            stats.add(profile)
+        stats.dump_stats(path)
+        return path
+
+    @pytest.hookimpl(optionalhook=True)
+    def pytest_testnodedown(self, node):
+        workeroutput = getattr(node, "workeroutput", {})
+        if workeroutput.get("profile_path"):
+            self.worker_paths.append(workeroutput["profile_path"])
+        self.cpu_error = self.cpu_error or workeroutput.get("profile_cpu_error")
+        for site, (size, count) in workeroutput.get("profile_allocations", {}).items():
+            total_size, total_count = self.allocations.get(site, (0, 0))
+            self.allocations[site] = (total_size + size, total_count + count)
+
+    def pytest_terminal_summary(self, terminalreporter):
+        if self.cpu_error is not None:
+            terminalreporter.write_line(f"cpu profile skipped: {self.cpu_error}")
+        if self.cpu and self.worker_paths:
+            stats = pstats.Stats(*self.worker_paths, stream=io.StringIO())
+            combined_path = os.path.join(self.directory, "combined.prof")
+            stats.dump_stats(combined_path)
+            terminalreporter.write_sep("-", f"cpu profile ({self.scope}), top {self.top} by cumulative time")
+            stats.stream = io.StringIO()
+            stats.sort_stats("cumulative").print_stats(self.top)
+            for line in stats.stream.getvalue().strip("\n").splitlines():
+                terminalreporter.write_line(line)
+            terminalreporter.write_line(f"merged profile: {combined_path} (snakeviz, gprof2dot, pstats)")
+        if self.memory and self.allocations:
+            os.makedirs(self.directory, exist_ok=True)
+            memory_path = os.path.join(self.directory, "memory.json")
+            sites = sorted(self.allocations.items(), key=lambda item: item[1][0], reverse=True)
+            with open(memory_path, "w", encoding="utf-8") as memory_file:
+                json.dump(
+                    [{"site": site, "bytes": size, "blocks": count} for site, (size, count) in sites],
+                    memory_file, indent=2
+                )
+            terminalreporter.write_sep("-", f"memory allocations ({self.scope}), top {self.top} sites")
+            terminalreporter.write_line(f"{'KiB':>10} {'blocks':>8}  site")
+            for site, (size, count) in sites[:self.top]:
+                terminalreporter.write_line(f"{size / 1024:>10.1f} {count:>8}  {site}")
+            terminalreporter.write_line(f"all sites: {memory_path}")
@@ -0,0 +1,123 @@
+import email.utils
+import hashlib
+import json
+import os
+import tempfile
+import threading
+import time
+from urllib.parse import urlsplit
+
+import constants
+from locks import file_lock
+
+
+def default_state_path(base_url):
+    """
+    Файл состояния общего ведра токенов для хоста base_url - один на все воркеры xdist на машине
+    """
+    host = urlsplit(base_url).netloc or base_url
+    digest = hashlib.sha1(host.encode("utf-8")).hexdigest()[:12]
+    return os.path.join(tempfile.gettempdir(), f"nominatim-ratelimit-{digest}.json")
+
+
+def parse_retry_after(value):
+    """
+    Значение заголовка Retry-After в секундах: он бывает числом секунд или HTTP-датой
+    """
+    if not value:
+        return None
+    try:
+        return max(float(value), 0.0)
+    except ValueError:
+        pass
+    try:
+        retry_at = email.utils.parsedate_to_datetime(value)
+    except (TypeError, ValueError):
+        return None
+    return max(retry_at.timestamp() - time.time(), 0.0)
+
+
+class SharedTokenBucket:
+    def __init__(self, state_path, rate, burst=1):
+        """
+        Ведро токенов, общее для всех процессов на машине: его состояние лежит в файле state_path и меняется только
+        под межпроцессной блокировкой. Каждый запрос забирает токен, и если токенов нет - ждёт своей очереди.
+        Скорость адаптивная: при 429/503 она падает в constants.RATE_LIMIT_DECREASE_FACTOR раз (а Retry-After
+        останавливает выдачу токенов всем воркерам), после успешных запросов плавно растёт обратно до rate
+        """
+        self.state_path = state_path
+        self.lock_path = f"{state_path}.lock"
+        self.max_rate = rate
+        self.min_rate = rate * constants.RATE_LIMIT_MIN_RATE_FRACTION
+        self.burst = burst
+        self.waited = 0.0
+        self.throttled = 0
+        self._lock = threading.Lock()
+
+    def _read_state(self, now):
+        try:
+            with open(self.state_path, encoding="utf-8") as state_file:
+                state = json.load(state_file)
+        except (OSError, ValueError):
+            state = {"tokens": self.burst, "updated": now, "rate": self.max_rate, "blocked_until": 0.0}
+        state["rate"] = min(state["rate"], self.max_rate)
+        elapsed = max(now - state["updated"], 0.0)
+        state["tokens"] = min(self.burst, state["tokens"] + elapsed * state["rate"])
+        state["updated"] = now
+        return state
+
+    def _write_state(self, state):
+        temporary_path = f"{self.state_path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        with open(temporary_path, "w", encoding="utf-8") as state_file:
+            json.dump(state, state_file)
+        os.replace(temporary_path, self.state_path)
+
+    def _update(self, change):
+        with self._lock, file_lock(self.lock_path):
+            now = time.time()
+            state = self._read_state(now)
+            result = change(state, now)
+            self._write_state(state)
+            return result
+
+    def acquire(self):
+        """
+        Забирает токен и ждёт, пока до него дойдёт очередь. Возвращает время ожидания в секундах
+        """
+        def take(state, now):
+            state["tokens"] -= 1
+            wait = max(-state["tokens"] / state["rate"], 0.0)
+            return max(wait, state["blocked_until"] - now)
+
+        wait = self._update(take)
+        if wait > 0:
+            time.sleep(wait)
+            self.waited += wait
+        return wait
+
+    def on_throttled(self, retry_after=None):
+        """
+        Сервер ответил 429/503: скорость снижается для всех воркеров, а при Retry-After выдача токенов
+        приостанавливается на указанное время
+        """
+        def slow_down(state, now):
+            state["rate"] = max(state["rate"] * constants.RATE_LIMIT_DECREASE_FACTOR, self.min_rate)
+            state["tokens"] = min(state["tokens"], 0.0)
+            if retry_after:
+                state["blocked_until"] = max(state["blocked_until"], now + retry_after)
+
+        self.throttled += 1
+        self._update(slow_down)
+
+    def on_success(self):
+        """
+        Успешный ответ: скорость аддитивно растёт обратно к максимальной
+        """
+        def speed_up(state, now):
+            increased = state["rate"] + self.max_rate * constants.RATE_LIMIT_INCREASE_FRACTION
+            state["rate"] = min(increased, self.max_rate)
+
+        self._update(speed_up)
+
+    def stats(self):
+        return {"throttled": self.throttled, "waited_s": round(self.waited, 3)}
@@ -0,0 +1,90 @@
+import json
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+
+def json_loads(data):
+    """
+    Разбор json через orjson, если он установлен, иначе через стандартный json.
+    Ошибка разбора в обоих случаях - ValueError
+    """
+    if orjson is not None:
+        return orjson.loads(data)
+    return json.loads(data)
+
+
+class Place:
+    """
+    Компактная запись о месте из ответа api. Хранит только основные поля, а остальное (licence, boundingbox и т.д.)
+    отбрасывает. Широта и долгота хранятся строками как в ответе и переводятся в float только при первом обращении
+    к lat/lon. Для совместимости с проверками в тестах по place["lat"] отдаются исходные строки
+    """
+
+    __slots__ = ("place_id", "osm_type", "osm_id", "display_name", "_lat_raw", "_lon_raw", "_lat", "_lon")
+    FIELDS = ("place_id", "osm_type", "osm_id", "display_name", "lat", "lon")
+
+    def __init__(self, place_id=None, osm_type=None, osm_id=None, display_name=None, lat=None, lon=None):
+        self.place_id = place_id
+        self.osm_type = osm_type
+        self.osm_id = osm_id
+        self.display_name = display_name
+        self._lat_raw = lat
+        self._lon_raw = lon
+        self._lat = None
+        self._lon = None
+
+    @classmethod
+    def from_dict(cls, data):
+        return cls(
+            data.get("place_id"),
+            data.get("osm_type"),
+            data.get("osm_id"),
+            data.get("display_name"),
+            data.get("lat"),
+            data.get("lon")
+        )
+
+    @property
+    def lat(self):
+        if self._lat is None and self._lat_raw is not None:
+            self._lat = float(self._lat_raw)
+        return self._lat
+
+    @property
+    def lon(self):
+        if self._lon is None and self._lon_raw is not None:
+            self._lon = float(self._lon_raw)
+        return self._lon
+
+    def __getitem__(self, key):
+        if key == "lat":
+            return self._lat_raw
+        if key == "lon":
+            return self._lon_raw
+        if key in self.FIELDS:
+            return getattr(self, key)
+        raise KeyError(key)
+
+    def __contains__(self, key):
+        return key in self.FIELDS and self[key] is not None
+
+    def to_dict(self):
+        return {field: self[field] for field in self.FIELDS}
+
+    def __repr__(self):
+        return f"Place(place_id={self.place_id!r}, display_name={self.display_name!r})"
+
+
+def to_places(json_response):
+    """
+    Перевод разобранного ответа api в записи Place: список мест - в список Place, одно место - в Place.
+    Ответы с ошибкой ({"error": ...}) возвращаются как есть
+    """
+    if isinstance(json_response, list):
+        return [Place.from_dict(item) for item in json_response]
+    if isinstance(json_response, dict) and "error" not in json_response:
+        return Place.from_dict(json_response)
+    return json_response
@@ -0,0 +1,115 @@
+import random
+import threading
+from urllib.parse import urlsplit, urlunsplit
+
+import constants
+from histogram import LatencyHistogram
+
+
+class DeadlineExceeded(Exception):
+    pass
+
+
+class Endpoint:
+    def __init__(self, base_url):
+        """
+        Один сервер Nominatim из списка: скользящие (EWMA) задержка и доля ошибок и гистограмма задержек для p95
+        """
+        self.base_url = base_url
+        parts = urlsplit(base_url)
+        self.scheme = parts.scheme
+        self.netloc = parts.netloc
+        self.latency = None
+        self.error_rate = 0.0
+        self.histogram = LatencyHistogram()
+        self.requests = 0
+        self.errors = 0
+
+    def __repr__(self):
+        return f"Endpoint({self.base_url!r})"
+
+    def url_for(self, url):
+        """
+        Тот же url запроса, но на этом сервере
+        """
+        parts = urlsplit(url)
+        return urlunsplit((self.scheme, self.netloc, parts.path, parts.query, parts.fragment))
+
+
+class Router:
+    def __init__(self, base_urls, alpha=constants.ROUTER_EWMA_ALPHA, explore=constants.ROUTER_EXPLORE_RATE):
+        """
+        Выбор сервера для запроса по скользящей задержке и доле ошибок. Ошибка считается как запрос длиной
+        constants.ROUTER_ERROR_COST секунд, так что быстро отказывающий сервер не выглядит лучшим. Серверы без замеров
+        пробуются первыми, а с вероятностью explore запрос уходит на случайный сервер, чтобы замеры отставших
+        серверов не устаревали навсегда
+        """
+        self.endpoints = [Endpoint(base_url) for base_url in base_urls]
+        self.alpha = alpha
+        self.explore = explore
+        self.hedges = 0
+        self.hedge_wins = 0
+        self._lock = threading.Lock()
+        self._random = random.Random()
+
+    def __len__(self):
+        return len(self.endpoints)
+
+    def endpoint_for(self, url):
+        """
+        Сервер, на который указывает url, или None, если url не на одном из серверов
+        """
+        parts = urlsplit(url)
+        for endpoint in self.endpoints:
+            if (endpoint.scheme, endpoint.netloc) == (parts.scheme, parts.netloc):
+                return endpoint
+        return None
+
+    def _score(self, endpoint):
+        if not endpoint.requests:
+            return -1.0
+        latency = endpoint.latency if endpoint.latency is not None else constants.ROUTER_ERROR_COST
+        return (1 - endpoint.error_rate) * latency + endpoint.error_rate * constants.ROUTER_ERROR_COST
+
+    def choose(self, exclude=()):
+        candidates = [endpoint for endpoint in self.endpoints if endpoint not in exclude] or self.endpoints
+        with self._lock:
+            if len(candidates) > 1 and self._random.random() < self.explore:
+                return self._random.choice(candidates)
+            return min(candidates, key=self._score)
+
+    def record(self, endpoint, seconds, error=False):
+        with self._lock:
+            endpoint.requests += 1
+            endpoint.errors += error
+            endpoint.error_rate += self.alpha * (float(error) - endpoint.error_rate)
+            if not error:
+                endpoint.histogram.record(seconds)
+                if endpoint.latency is None:
+                    endpoint.latency = seconds
+                else:
+                    endpoint.latency += self.alpha * (seconds - endpoint.latency)
+
+    def hedge_delay(self, endpoint):
+        """
+        Через сколько секунд без ответа отправлять дублирующий запрос на другой сервер - p95 задержки этого сервера.
+        None, пока замеров мало
+        """
+        with self._lock:
+            if endpoint.histogram.count < constants.ROUTER_HEDGE_MIN_SAMPLES:
+                return None
+            return endpoint.histogram.percentile(constants.ROUTER_HEDGE_PERCENTILE) / 1_000_000
+
+    def count_hedge(self, won=False):
+        with self._lock:
+            if won:
+                self.hedge_wins += 1
+            else:
+                self.hedges += 1
+
+    def stats(self):
+        stats = {"hedges": self.hedges, "hedge_wins": self.hedge_wins}
+        for index, endpoint in enumerate(self.endpoints):
+            stats[f"requests[{index}]"] = endpoint.requests
+            stats[f"errors[{index}]"] = endpoint.errors
+        return stats
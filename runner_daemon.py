@@ -0,0 +1,370 @@
+"""
+Тёплый запуск тестов: демон держит готовые процессы-воркеры с уже импортированными pytest, requests и модулями
+тестов, а ApiClient (с пулом соединений и кэшами) и локальные заглушки живут в воркере между прогонами.
+Тонкий клиент отправляет демону выборку тестов и получает вывод pytest потоком, так что повторный прогон
+не платит за старт интерпретатора, импорты и холодные соединения. При изменении .py файлов проекта воркеры
+перезапускаются сами.
+
+Примеры:
+    python runner_daemon.py serve --url local
+    python runner_daemon.py run -m API
+    python runner_daemon.py run tests_api/test_search.py::TestSimpleSearch -x
+    python runner_daemon.py stop
+"""
+import argparse
+import hashlib
+import io
+import json
+import multiprocessing
+import os
+import queue
+import socket
+import socketserver
+import struct
+import sys
+import tempfile
+import threading
+
+import constants
+
+FRAME_HEADER = struct.Struct("!cI")
+OUTPUT_FRAME = b"o"
+EXIT_FRAME = b"x"
+ROOT = os.path.dirname(os.path.abspath(__file__))
+
+
+def default_socket_path(root=ROOT):
+    """
+    Unix-сокет демона во временной директории, свой на каждую копию проекта
+    """
+    digest = hashlib.sha1(root.encode("utf-8")).hexdigest()[:12]
+    return os.path.join(tempfile.gettempdir(), f"nominatim-runner-{digest}.sock")
+
+
+def source_mtimes(root=ROOT):
+    """
+    Время изменения всех .py файлов проекта (conftest, модули, тесты), кроме скрытых директорий и __pycache__
+    """
+    mtimes = {}
+    for directory, directories, files in os.walk(root):
+        directories[:] = [name for name in directories if not name.startswith(".") and name != "__pycache__"]
+        for name in files:
+            if name.endswith(".py"):
+                path = os.path.join(directory, name)
+                mtimes[path] = os.stat(path).st_mtime_ns
+    return mtimes
+
+
+def send_frame(connection, kind, payload):
+    connection.sendall(FRAME_HEADER.pack(kind, len(payload)) + payload)
+
+
+def _receive_exactly(connection, size):
+    chunks = []
+    while size:
+        chunk = connection.recv(size)
+        if not chunk:
+            raise ConnectionError("runner daemon closed the connection")
+        chunks.append(chunk)
+        size -= len(chunk)
+    return b"".join(chunks)
+
+
+def receive_frame(connection):
+    kind, size = FRAME_HEADER.unpack(_receive_exactly(connection, FRAME_HEADER.size))
+    return kind, _receive_exactly(connection, size)
+
+
+class WarmSession:
+    def __init__(self):
+        """
+        Плагин pytest, который воркер демона передаёт в каждый pytest.main. Фикстуры conftest берут через него
+        объекты, которые должны пережить прогон (ApiClient, локальные заглушки), по ключу из своих параметров.
+        Плагины из pytest.main регистрируются под своим __name__, по нему conftest и находит этот
+        """
+        self.__name__ = "warm_session"
+        self.objects = {}
+
+    def get(self, key, factory, close=None):
+        if key not in self.objects:
+            self.objects[key] = (factory(), close)
+        return self.objects[key][0]
+
+    def close(self):
+        for value, close in self.objects.values():
+            if close is not None:
+                close(value)
+        self.objects.clear()
+
+
+class _PipeWriter:
+    encoding = "utf-8"
+    errors = "replace"
+
+    def __init__(self, connection):
+        """
+        Файл для sys.stdout/sys.stderr воркера: всё записанное сразу уходит демону, а от него - клиенту
+        """
+        self.connection = connection
+
+    def write(self, text):
+        if text:
+            self.connection.send((OUTPUT_FRAME, text.encode(self.encoding, self.errors)))
+        return len(text)
+
+    def flush(self):
+        pass
+
+    def isatty(self):
+        return False
+
+    def fileno(self):
+        raise io.UnsupportedOperation("runner daemon output has no file descriptor")
+
+
+def _run_pytest(args, warm_session, stream):
+    import pytest
+
+    stdout, stderr = sys.stdout, sys.stderr
+    sys.stdout = sys.stderr = stream
+    try:
+        return int(pytest.main(args, plugins=[warm_session]))
+    except Exception as error:
+        stream.write(f"runner daemon: pytest failed: {error!r}\n")
+        return int(pytest.ExitCode.INTERNAL_ERROR)
+    finally:
+        sys.stdout, sys.stderr = stdout, stderr
+
+
+class _NullWriter(_PipeWriter):
+    def write(self, text):
+        return len(text)
+
+
+def _worker_main(connection, pytest_args):
+    """
+    Процесс-воркер: прогревается сбором тестов (импорт conftest, модулей тестов), затем выполняет прогоны по одному
+    """
+    warm_session = WarmSession()
+    _run_pytest(["--collect-only", "-q", "-p", "no:cacheprovider", *pytest_args], warm_session, _NullWriter(None))
+    try:
+        while True:
+            try:
+                job = connection.recv()
+            except EOFError:
+                break
+            if job is None:
+                break
+            cwd, args = job
+            os.chdir(cwd)
+            exit_code = _run_pytest([*pytest_args, *args], warm_session, _PipeWriter(connection))
+            connection.send((EXIT_FRAME, exit_code))
+    finally:
+        warm_session.close()
+
+
+class Worker:
+    def __init__(self, context, pytest_args, generation):
+        self.generation = generation
+        self.connection, child_connection = context.Pipe()
+        self.process = context.Process(target=_worker_main, args=(child_connection, pytest_args), daemon=True)
+        self.process.start()
+        child_connection.close()
+
+    def run(self, cwd, args, write):
+        """
+        Прогон в воркере из директории cwd; write получает вывод pytest кусками. Возвращает код выхода pytest.
+        Если клиент отключился, вывод дочитывается до конца прогона впустую, чтобы не достался следующему
+        """
+        self.connection.send((cwd, args))
+        while True:
+            try:
+                kind, payload = self.connection.recv()
+            except EOFError:
+                write(b"runner daemon: worker process died\n")
+                return 3
+            if kind == EXIT_FRAME:
+                return payload
+            try:
+                write(payload)
+            except OSError:
+                write = _discard
+
+    def stop(self):
+        """
+        Воркер останавливается явным сообщением, а не закрытием канала: так он успевает закрыть объекты
+        warm_session (локальные заглушки, соединения)
+        """
+        try:
+            self.connection.send(None)
+        except OSError:
+            pass
+        self.connection.close()
+        self.process.join(constants.DAEMON_STOP_TIMEOUT)
+        if self.process.is_alive():
+            self.process.kill()
+            self.process.join()
+
+
+def _discard(data):
+    pass
+
+
+class WorkerPool:
+    def __init__(self, size, pytest_args, root=ROOT):
+        """
+        size воркеров, форкнутых с уже импортированными pytest и requests. Форкает их не демон (у него потоки
+        сервера, и fork из потока копирует чужие захваченные блокировки), а однопоточный forkserver, который
+        импортирует pytest и requests один раз при старте. Модули проекта в нём не импортируются, поэтому
+        новое поколение воркеров видит изменённый код. Одновременные прогоны идут в разные воркеры. Если .py файлы
+        проекта изменились, поколение воркеров сменяется: простаивающие перезапускаются сразу, занятые -
+        по окончании прогона
+        """
+        self.context = multiprocessing.get_context("forkserver")
+        self.context.set_forkserver_preload(["pytest", "requests"])
+        self.pytest_args = pytest_args
+        self.root = root
+        self.generation = 0
+        self.mtimes = source_mtimes(root)
+        self.idle = queue.Queue()
+        self.workers = []
+        self._lock = threading.Lock()
+        for _ in range(size):
+            self.idle.put(self._spawn())
+
+    def _spawn(self):
+        worker = Worker(self.context, self.pytest_args, self.generation)
+        self.workers.append(worker)
+        return worker
+
+    def _replace(self, worker):
+        self.workers.remove(worker)
+        worker.stop()
+        return self._spawn()
+
+    def check_sources(self):
+        """
+        Смена поколения воркеров, если .py файлы проекта изменились с прошлой проверки
+        """
+        mtimes = source_mtimes(self.root)
+        with self._lock:
+            if mtimes == self.mtimes:
+                return False
+            self.mtimes = mtimes
+            self.generation += 1
+        for _ in range(self.idle.qsize()):
+            try:
+                worker = self.idle.get_nowait()
+            except queue.Empty:
+                break
+            self.release(worker)
+        return True
+
+    def acquire(self):
+        worker = self.idle.get()
+        with self._lock:
+            if worker.generation != self.generation or not worker.process.is_alive():
+                worker = self._replace(worker)
+        return worker
+
+    def release(self, worker):
+        with self._lock:
+            if worker.generation != self.generation or not worker.process.is_alive():
+                worker = self._replace(worker)
+        self.idle.put(worker)
+
+    def close(self):
+        for worker in list(self.workers):
+            worker.stop()
+
+
+def serve(socket_path, workers_count, pytest_args):
+    if os.path.exists(socket_path):
+        with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as probe:
+            if probe.connect_ex(socket_path) == 0:
+                raise SystemExit(f"runner daemon is already running on {socket_path}")
+        os.remove(socket_path)
+    pool = WorkerPool(workers_count, pytest_args)
+    stopped = threading.Event()
+
+    class Handler(socketserver.StreamRequestHandler):
+        def send_output(self, data):
+            send_frame(self.connection, OUTPUT_FRAME, data)
+
+        def handle(self):
+            line = self.rfile.readline()
+            if not line:
+                return
+            message = json.loads(line)
+            if message.get("command") == "stop":
+                send_frame(self.connection, EXIT_FRAME, b"0")
+                stopped.set()
+                return
+            pool.check_sources()
+            worker = pool.acquire()
+            try:
+                exit_code = worker.run(message["cwd"], message["args"], self.send_output)
+            finally:
+                pool.release(worker)
+            try:
+                send_frame(self.connection, EXIT_FRAME, str(exit_code).encode())
+            except OSError:
+                pass
+
+    class Server(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+        daemon_threads = True
+
+    server = Server(socket_path, Handler)
+    socket_inode = os.stat(socket_path).st_ino
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    print(f"runner daemon: {workers_count} workers, listening on {socket_path}", file=sys.stderr, flush=True)
+    try:
+        while not stopped.wait(constants.DAEMON_WATCH_INTERVAL):
+            if pool.check_sources():
+                print("runner daemon: sources changed, workers restarted", file=sys.stderr, flush=True)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.shutdown()
+        server.server_close()
+        pool.close()
+        if os.path.exists(socket_path) and os.stat(socket_path).st_ino == socket_inode:
+            os.remove(socket_path)
+
+
+def submit(socket_path, message):
+    """
+    Отправка запроса демону, вывод прогона - в stdout по мере поступления. Возвращает код выхода pytest
+    """
+    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as connection:
+        try:
+            connection.connect(socket_path)
+        except (FileNotFoundError, ConnectionRefusedError):
+            raise SystemExit(f"runner daemon is not running on {socket_path}, start it with runner_daemon.py serve")
+        connection.sendall(json.dumps(message).encode("utf-8") + b"\n")
+        while True:
+            kind, payload = receive_frame(connection)
+            if kind == EXIT_FRAME:
+                return int(payload)
+            sys.stdout.buffer.write(payload)
+            sys.stdout.buffer.flush()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Тёплый демон для прогонов pytest")
+    parser.add_argument("command", choices=("serve", "run", "stop"))
+    parser.add_argument("--socket", default=default_socket_path(), help="путь к unix-сокету демона")
+    parser.add_argument(
+        "--workers", type=int, default=constants.DAEMON_WORKERS, help="сколько тёплых воркеров держит демон (serve)"
+    )
+    args, pytest_args = parser.parse_known_args()
+    if args.command == "serve":
+        serve(args.socket, args.workers, pytest_args)
+    elif args.command == "stop":
+        submit(args.socket, {"command": "stop"})
+    else:
+        raise SystemExit(submit(args.socket, {"cwd": os.getcwd(), "args": pytest_args}))
+
+
+if __name__ == "__main__":
+    main()
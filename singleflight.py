@@ -0,0 +1,86 @@
+import os
+import threading
+import zlib
+
+from locks import file_lock
+
+
+class _Call:
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+
+
+class SingleFlight:
+    def __init__(self, lock_dir=None, lock_stripes=256):
+        """
+        Склейка одинаковых запросов в полёте: пока по ключу выполняется вызов, остальные потоки с тем же ключом
+        не делают свой, а ждут его результата (или его исключения).
+        С lock_dir склейка работает и между процессами (воркерами xdist): ведущий вызов идёт под файловой блокировкой,
+        а процесс, дождавшийся блокировки, сначала ищет готовый результат через shared (например, в общем кэше
+        на диске). Чтобы не плодить файлы на каждый ключ, ключи раскладываются по lock_stripes файлам блокировок
+        """
+        self.lock_dir = lock_dir
+        self.lock_stripes = lock_stripes
+        self.upstream = 0
+        self.coalesced = 0
+        self.shared = 0
+        self._calls = {}
+        self._lock = threading.Lock()
+        if lock_dir:
+            os.makedirs(lock_dir, exist_ok=True)
+
+    def do(self, key, function, shared=None):
+        """
+        Выполняет function() один раз на все одновременные вызовы с ключом key и возвращает её результат каждому
+        """
+        with self._lock:
+            call = self._calls.get(key)
+            leader = call is None
+            if leader:
+                call = self._calls[key] = _Call()
+            else:
+                self.coalesced += 1
+        if not leader:
+            call.done.wait()
+            if call.error is not None:
+                raise call.error
+            return call.result
+
+        try:
+            call.result = self._run(key, function, shared)
+            return call.result
+        except BaseException as error:
+            call.error = error
+            raise
+        finally:
+            with self._lock:
+                del self._calls[key]
+            call.done.set()
+
+    def _run(self, key, function, shared):
+        if not self.lock_dir:
+            return self._call_upstream(function)
+        stripe = zlib.crc32(key.encode("utf-8")) % self.lock_stripes
+        with file_lock(os.path.join(self.lock_dir, f"{stripe:04d}.lock")):
+            if shared is not None:
+                result = shared()
+                if result is not None:
+                    with self._lock:
+                        self.shared += 1
+                    return result
+            return self._call_upstream(function)
+
+    def _call_upstream(self, function):
+        with self._lock:
+            self.upstream += 1
+        return function()
+
+    def stats(self):
+        return {
+            "upstream": self.upstream,
+            "coalesced": self.coalesced,
+            "shared": self.shared,
+            "saved": self.coalesced + self.shared
+        }
@@ -0,0 +1,165 @@
+import json
+import math
+import os
+import threading
+
+import numpy as np
+
+import constants
+from geo import EARTH_RADIUS_KM, haversine_km, haversine_km_array, unit_vectors
+from locks import file_lock
+
+KM_PER_DEGREE = math.pi * EARTH_RADIUS_KM / 180
+
+
+class ReverseIndex:
+    def __init__(self, radius_km):
+        """
+        Пространственный индекс уже выполненных запросов обратного геокодинга. Точки запросов раскладываются по сетке
+        из ячеек не меньше radius_km, поэтому для поиска соседа в радиусе достаточно посмотреть ячейку точки и соседние.
+        Если новая точка лежит в пределах radius_km от уже разрешённой, ответ на неё берётся из индекса без запроса к api
+        и только на запрос с тем же variant - остальными параметрами (format, zoom, accept-language и т.д.) одной
+        строкой, с которыми был получен ответ
+        """
+        self.radius_km = radius_km
+        self.cell_deg = max(radius_km / KM_PER_DEGREE, constants.REVERSE_INDEX_MIN_CELL_DEG)
+        self.columns_count = math.ceil(360 / self.cell_deg)
+        self.lats = []
+        self.lons = []
+        self.variants = []
+        self.results = []
+        self.cells = {}
+        self.hits = 0
+        self.misses = 0
+        self._vectors = None
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self.results)
+
+    def _cell(self, lat, lon):
+        return math.floor((lat + 90) / self.cell_deg), math.floor((lon + 180) / self.cell_deg) % self.columns_count
+
+    def _candidate_cells(self, lat, lon, radius_km):
+        row, column = self._cell(lat, lon)
+        rows_span = math.ceil(radius_km / KM_PER_DEGREE / self.cell_deg)
+        cos_lat = math.cos(math.radians(min(abs(lat) + rows_span * self.cell_deg, 90)))
+        if cos_lat * self.columns_count <= 2 * rows_span + 1:
+            columns = range(self.columns_count)
+        else:
+            columns_span = math.ceil(radius_km / (KM_PER_DEGREE * cos_lat) / self.cell_deg)
+            columns = range(column - columns_span, column + columns_span + 1)
+        for cell_row in range(row - rows_span, row + rows_span + 1):
+            for cell_column in columns:
+                yield cell_row, cell_column % self.columns_count
+
+    def _nearest(self, lat, lon, radius_km, variant):
+        nearest, nearest_distance = None, None
+        for cell in set(self._candidate_cells(lat, lon, radius_km)):
+            for index in self.cells.get((variant,) + cell, ()):
+                distance = haversine_km(lat, lon, self.lats[index], self.lons[index])
+                if distance <= radius_km and (nearest_distance is None or distance < nearest_distance):
+                    nearest, nearest_distance = index, distance
+        return nearest, nearest_distance
+
+    def add(self, lat, lon, result, variant=""):
+        """
+        Запоминает ответ api для точки. Точки, почти совпадающие с уже известными с тем же variant, не добавляются
+        """
+        with self._lock:
+            duplicate, _ = self._nearest(
+                lat, lon, self.radius_km * constants.REVERSE_INDEX_DUPLICATE_FRACTION, variant
+            )
+            if duplicate is not None:
+                return
+            index = len(self.results)
+            self.lats.append(lat)
+            self.lons.append(lon)
+            self.variants.append(variant)
+            self.results.append(result)
+            self.cells.setdefault((variant,) + self._cell(lat, lon), []).append(index)
+            self._vectors = None
+
+    def lookup(self, lat, lon, variant=""):
+        """
+        Ответ ближайшей известной точки с тем же variant в радиусе radius_km или None
+        """
+        with self._lock:
+            index, _ = self._nearest(lat, lon, self.radius_km, variant)
+            if index is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+            return self.results[index]
+
+    def nearest_many(self, lats, lons, variant="", chunk_size=constants.REVERSE_INDEX_CHUNK_SIZE):
+        """
+        Пакетный поиск ближайших известных точек с тем же variant для массивов координат. Точки переводятся
+        в единичные векторы, и ближайшая ищется максимальным скалярным произведением кусками по chunk_size запросов.
+        Возвращает массивы индексов (-1, если в радиусе никого нет) и расстояний в км
+        """
+        lats = np.asarray(lats, dtype=np.float64)
+        lons = np.asarray(lons, dtype=np.float64)
+        indices = np.full(lats.shape, -1, dtype=np.int64)
+        distances = np.full(lats.shape, np.inf)
+        if not self.results or not lats.size:
+            return indices, distances
+        with self._lock:
+            if self._vectors is None:
+                self._vectors = unit_vectors(self.lats, self.lons)
+            candidates = np.flatnonzero(np.asarray(self.variants, dtype=object) == variant)
+            vectors = self._vectors[candidates]
+            known_lats = np.asarray(self.lats)
+            known_lons = np.asarray(self.lons)
+        if not len(candidates):
+            return indices, distances
+
+        queries = unit_vectors(lats, lons)
+        for start in range(0, len(queries), chunk_size):
+            chunk = slice(start, start + chunk_size)
+            best = candidates[np.argmax(queries[chunk] @ vectors.T, axis=1)]
+            indices[chunk] = best
+            distances[chunk] = haversine_km_array(lats[chunk], lons[chunk], known_lats[best], known_lons[best])
+        indices[distances > self.radius_km] = -1
+        return indices, distances
+
+    def lookup_many(self, lats, lons, variant=""):
+        """
+        Пакетный вариант lookup: список ответов (None для точек без известного соседа в радиусе)
+        """
+        indices, _ = self.nearest_many(lats, lons, variant)
+        found = int(np.count_nonzero(indices >= 0))
+        with self._lock:
+            self.hits += found
+            self.misses += len(indices) - found
+        return [self.results[index] if index >= 0 else None for index in indices.tolist()]
+
+    def stats(self):
+        return {"points": len(self), "hits": self.hits, "misses": self.misses}
+
+    def load(self, path):
+        """
+        Добавляет в индекс точки, сохранённые в файле прошлыми прогонами. У точек из старых файлов без variant
+        параметры запроса неизвестны, поэтому они не загружаются
+        """
+        if not os.path.exists(path):
+            return self
+        with open(path, encoding="utf-8") as index_file:
+            for point in json.load(index_file)["points"]:
+                if len(point) == 4:
+                    self.add(*point)
+        return self
+
+    def save(self, path):
+        """
+        Сохранение индекса в файл. Под межпроцессной блокировкой точки из файла сначала подмешиваются в индекс,
+        так что воркеры xdist, сохраняющие индекс в один файл, не затирают точки друг друга
+        """
+        with file_lock(f"{path}.lock"):
+            self.load(path)
+            with self._lock:
+                points = [list(point) for point in zip(self.lats, self.lons, self.results, self.variants)]
+            temporary_path = f"{path}.{os.getpid()}.tmp"
+            with open(temporary_path, "w", encoding="utf-8") as index_file:
+                json.dump({"radius_km": self.radius_km, "points": points}, index_file, ensure_ascii=False)
+            os.replace(temporary_path, path)
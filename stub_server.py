@@ -0,0 +1,262 @@
+"""
+Локальная замена Nominatim для нагрузочных тестов и CI: отдаёт /search.php и /reverse.php в формате jsonv2
+по набору мест из файла с данными. Запуск отдельно: python stub_server.py --port 8080
+"""
+import argparse
+import json
+import os
+import random
+import re
+import sys
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlsplit
+
+import apis
+import constants
+from geo import haversine_km
+
+DEFAULT_DATA_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), constants.STUB_DATA_PATH)
+TOKEN_SPLIT_RE = re.compile(r"[\W_]+")
+SERVICE_FIELDS = ("keywords", "address", "radius_km")
+STRUCTURED_FIELDS = {
+    "street": ("road", "house_number"),
+    "city": ("city", "town", "village"),
+    "country": ("country",),
+    "postalcode": ("postcode",)
+}
+
+
+def tokenize(text):
+    return {token for token in TOKEN_SPLIT_RE.split(text.casefold()) if token}
+
+
+class StubNominatimHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    server_version = "nominatim-stub"
+    disable_nagle_algorithm = True
+
+    def log_message(self, format, *args):
+        pass
+
+    def do_GET(self):
+        server = self.server
+        delay = server.latency
+        if server.latency_jitter:
+            delay += server.random.expovariate(1 / server.latency_jitter)
+        if delay:
+            time.sleep(delay)
+        if len(self.path) > server.max_uri_length:
+            self._send_body(414, b"<html><body><h1>414 Request-URI Too Large</h1></body></html>", "text/html")
+            return
+        if server.error_rate and server.random.random() < server.error_rate:
+            self._send_body(503, b"<html><body><h1>503 Service Unavailable</h1></body></html>", "text/html")
+            return
+
+        url = urlsplit(self.path)
+        params = {key: values[-1] for key, values in parse_qs(url.query, keep_blank_values=True).items()}
+        route = server.routes.get(url.path.removesuffix(".php"))
+        if route is None:
+            self._send_json(404, {"error": {"code": 404, "message": "Unknown endpoint"}})
+            return
+        status, body = route(params)
+        self._send_json(status, body)
+
+    def _send_json(self, status, body):
+        self._send_body(status, json.dumps(body, ensure_ascii=False).encode("utf-8"), "application/json; charset=utf-8")
+
+    def _send_body(self, status, body, content_type):
+        self.send_response(status)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+
+class StubNominatimServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(
+        self,
+        host="127.0.0.1",
+        port=0,
+        data_path=DEFAULT_DATA_PATH,
+        latency=0.0,
+        error_rate=0.0,
+        latency_jitter=0.0,
+        max_uri_length=constants.STUB_MAX_URI_LENGTH,
+        seed=None
+    ):
+        """
+        Сервер-заглушка Nominatim. latency - искусственная задержка каждого ответа в секундах, latency_jitter - средняя
+        случайная (экспоненциальная) добавка к ней, чтобы у задержек был хвост,
+        error_rate - доля запросов, на которые отвечается 503, max_uri_length - длина URI, после которой отдаётся 414.
+        port=0 - взять любой свободный порт
+        """
+        super().__init__((host, port), StubNominatimHandler)
+        self.latency = latency
+        self.latency_jitter = latency_jitter
+        self.error_rate = error_rate
+        self.max_uri_length = max_uri_length
+        self.random = random.Random(seed)
+        self.routes = {
+            apis.SEARCH_API_LOCATION.removesuffix(".php"): self.search,
+            apis.REVERSE_API_LOCATION.removesuffix(".php"): self.reverse,
+            apis.LOOKUP_API_LOCATION.removesuffix(".php"): self.lookup
+        }
+        self._thread = None
+        self.load_places(data_path)
+
+    @property
+    def url(self):
+        host, port = self.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def load_places(self, data_path):
+        """
+        Загрузка набора мест и построение по нему индексов: токен -> места для простого поиска,
+        токены полей адреса каждого места для структурированного и OSM id -> место для lookup
+        """
+        with open(data_path, encoding="utf-8") as data_file:
+            self.places = json.load(data_file)
+        self.token_index = {}
+        self.address_tokens = []
+        self.osm_index = {}
+        for index, place in enumerate(self.places):
+            self.osm_index[f"{place['osm_type'][0].upper()}{place['osm_id']}"] = index
+            for token in tokenize(" ".join([place["display_name"], *place.get("keywords", [])])):
+                self.token_index.setdefault(token, set()).add(index)
+            address = place["address"]
+            self.address_tokens.append({
+                field: tokenize(" ".join(address.get(part, "") for part in parts))
+                for field, parts in STRUCTURED_FIELDS.items()
+            })
+
+    def handle_error(self, request, client_address):
+        """
+        Клиент, не дождавшийся ответа (таймаут, проигравший дублирующий запрос), закрывает соединение - это не ошибка
+        """
+        if isinstance(sys.exc_info()[1], ConnectionError):
+            return
+        super().handle_error(request, client_address)
+
+    def start(self):
+        self._thread = threading.Thread(
+            target=self.serve_forever, kwargs={"poll_interval": constants.STUB_POLL_INTERVAL}, daemon=True
+        )
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self.shutdown()
+        self.server_close()
+        if self._thread is not None:
+            self._thread.join()
+
+    @staticmethod
+    def _public_fields(place, with_address=False):
+        result = {key: value for key, value in place.items() if key not in SERVICE_FIELDS}
+        if with_address:
+            result["address"] = place["address"]
+        return result
+
+    def search(self, params):
+        limit = params.get("limit", "")
+        limit = min(max(int(limit), 1), 50) if limit.isdigit() else 10
+        country_codes = {code.strip().lower() for code in params.get("countrycodes", "").split(",") if code.strip()}
+
+        if "q" in params:
+            candidates = self._match_simple(params["q"])
+        else:
+            candidates = self._match_structured(params)
+
+        results = [
+            self.places[index] for index in candidates
+            if not country_codes or self.places[index]["address"].get("country_code") in country_codes
+        ]
+        results.sort(key=lambda place: place.get("importance", 0), reverse=True)
+        return 200, [self._public_fields(place) for place in results[:limit]]
+
+    def _match_simple(self, query):
+        tokens = tokenize(query)
+        if not tokens:
+            return set()
+        matched = None
+        for token in tokens:
+            places = self.token_index.get(token, set())
+            matched = places if matched is None else matched & places
+            if not matched:
+                return set()
+        return matched
+
+    def _match_structured(self, params):
+        fields = {field: tokenize(params[field]) for field in STRUCTURED_FIELDS if params.get(field, "").strip()}
+        if not fields:
+            return set()
+        return {
+            index for index, address_tokens in enumerate(self.address_tokens)
+            if all(tokens <= address_tokens[field] for field, tokens in fields.items())
+        }
+
+    def lookup(self, params):
+        """
+        Места по списку OSM id в порядке запроса. Неизвестные и кривые id просто пропускаются, как в Nominatim
+        """
+        osm_ids = [osm_id.strip().upper() for osm_id in params.get("osm_ids", "").split(",") if osm_id.strip()]
+        if len(osm_ids) > constants.LOOKUP_MAX_IDS:
+            return 400, {"error": {"code": 400, "message": f"Too many ids, at most {constants.LOOKUP_MAX_IDS} allowed"}}
+        return 200, [
+            self._public_fields(self.places[self.osm_index[osm_id]], with_address=True)
+            for osm_id in osm_ids if osm_id in self.osm_index
+        ]
+
+    def reverse(self, params):
+        try:
+            lat = float(params.get("lat", ""))
+            lon = float(params.get("lon", ""))
+        except ValueError:
+            return 400, {"error": {"code": 400, "message": "Floating-point number expected for parameter 'lat'/'lon'"}}
+        if not (-90 <= lat <= 90 and -180 <= lon <= 180):
+            return 400, {"error": {"code": 400, "message": "Coordinates out of range"}}
+
+        nearest, nearest_distance = None, None
+        for place in self.places:
+            distance = haversine_km(lat, lon, float(place["lat"]), float(place["lon"]))
+            if distance <= place.get("radius_km", constants.STUB_DEFAULT_RADIUS_KM) and (
+                nearest_distance is None or distance < nearest_distance
+            ):
+                nearest, nearest_distance = place, distance
+        if nearest is None:
+            return 200, {"error": constants.UNABLE_TO_GEOCODE_ERROR_MESSAGE}
+        return 200, self._public_fields(nearest, with_address=True)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Локальная заглушка Nominatim")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8080)
+    parser.add_argument("--data", default=DEFAULT_DATA_PATH)
+    parser.add_argument("--latency-ms", type=float, default=0.0)
+    parser.add_argument("--latency-jitter-ms", type=float, default=0.0)
+    parser.add_argument("--error-rate", type=float, default=0.0)
+    args = parser.parse_args()
+    server = StubNominatimServer(
+        host=args.host,
+        port=args.port,
+        data_path=args.data,
+        latency=args.latency_ms / 1000,
+        latency_jitter=args.latency_jitter_ms / 1000,
+        error_rate=args.error_rate
+    )
+    print(f"Serving Nominatim stub on {server.url}", flush=True)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+
+
+if __name__ == "__main__":
+    main()
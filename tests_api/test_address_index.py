@@ -0,0 +1,94 @@
+import pytest
+
+import apis
+from address_index import AddressIndex, rebuild, simple_query
+from apiclient import ApiClient
+
+
+class TestAddressIndex:
+    """
+    Тесты локального индекса прямого геокодинга (--address-index)
+    """
+
+    response = [{"display_name": "Louvre, Rue de Rivoli, Paris, France", "lat": "48.8611", "lon": "2.3358"}]
+
+    @pytest.fixture
+    def index_path(self, tmp_path):
+        path = str(tmp_path / "addresses.idx")
+        AddressIndex(path).ingest("Louvre, Paris", self.response, "jsonv2")
+        rebuild(path)
+        return path
+
+    def test_simple_query(self):
+        assert simple_query({"q": "Louvre", "format": "jsonv2"}) == ("Louvre", "jsonv2")
+        assert simple_query({"q": "Louvre"}) == ("Louvre", "")
+        assert simple_query({"q": "Louvre", "limit": 1}) is None
+
+    def test_similar_query_in_same_format(self, index_path):
+        assert AddressIndex(index_path).lookup("louvre paris", "jsonv2") == self.response
+
+    def test_other_format_not_served(self, index_path):
+        """
+        Ответ в jsonv2 не отдаётся на запрос в json или без format: поля ответов различаются
+        """
+        index = AddressIndex(index_path)
+        assert index.lookup("Louvre, Paris", "json") is None
+        assert index.lookup("Louvre, Paris") is None
+        assert index.stats()["misses"] == 2
+
+    def test_dropped_word_not_served(self, tmp_path):
+        """
+        "Tower London" похож на "Tower Bridge, London" по триграммам, но без слова Bridge это другой запрос
+        """
+        path = str(tmp_path / "addresses.idx")
+        AddressIndex(path).ingest("Tower Bridge, London", [{"display_name": "Tower Bridge, London"}], "jsonv2")
+        rebuild(path)
+        index = AddressIndex(path)
+        assert index.lookup("Tower London", "jsonv2") is None
+        assert index.lookup("London Bridge", "jsonv2") is None
+        assert index.lookup("Tower Bridge London", "jsonv2") == [{"display_name": "Tower Bridge, London"}]
+
+    def test_typo_served(self, index_path):
+        AddressIndex(index_path).ingest("Tour Eiffel, Paris", [{"display_name": "Tour Eiffel"}], "jsonv2")
+        rebuild(index_path)
+        response, similarity = AddressIndex(index_path).search("Tour Eifel, Paris", "jsonv2")
+        assert response == [{"display_name": "Tour Eiffel"}]
+        assert similarity >= AddressIndex(index_path).similarity
+
+    def test_refresh_after_rebuild(self, index_path):
+        """
+        Открытый индекс видит пересобранный файл только после refresh, и только если файл сменился
+        """
+        index = AddressIndex(index_path)
+        assert not index.refresh()
+        AddressIndex(index_path).ingest("Tour Eiffel, Paris", [{"display_name": "Tour Eiffel, Paris"}], "jsonv2")
+        rebuild(index_path)
+        assert index.lookup("Tour Eiffel, Paris", "jsonv2") is None
+        assert index.refresh()
+        assert index.lookup("Tour Eiffel, Paris", "jsonv2") == [{"display_name": "Tour Eiffel, Paris"}]
+        assert len(index) == 3
+
+
+@pytest.mark.API
+class TestAddressIndexClient:
+    def search(self, client, params):
+        return client.request_custom(method="GET", location=apis.SEARCH_API_LOCATION, params=params)
+
+    def test_format_is_part_of_match(self, config, api_cassette, tmp_path):
+        path = str(tmp_path / "addresses.idx")
+        client = ApiClient(base_url=config["url"])
+        client.cassette = api_cassette
+        sources = []
+        client.timing_hooks.append(
+            lambda record: sources.append("network" if record.source == "cassette" else record.source)
+        )
+        try:
+            client.address_index = AddressIndex(path)
+            self.search(client, {"q": "Louvre", "format": "json"})
+            rebuild(path)
+            client.address_index = AddressIndex(path)
+            for params in ({"q": "Louvre", "format": "jsonv2"}, {"q": "Louvre"}, {"q": "Louvre", "format": "json"}):
+                self.search(client, params)
+        finally:
+            client.close()
+        assert sources == ["network", "network", "network", "address_index"], f"Got sources {sources}"
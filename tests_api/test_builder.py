@@ -0,0 +1,86 @@
+import multiprocessing
+import pickle
+
+import pytest
+
+from builder import Builder, ReverseQuery, SearchQuery
+
+
+def echo_queries(queries, results):
+    """
+    Воркер в другом процессе получает запросы, сравнивает со своими и отсылает обратно
+    """
+    for query in iter(queries.get, None):
+        results.put((query, query is SearchQuery.from_params(query.params_for_api)))
+
+
+class TestQuery:
+    """
+    Тесты неизменяемых запросов: интернирование, отбрасывание None, pickle и векторное создание many()
+    """
+
+    def test_interned(self):
+        query = SearchQuery(address="Louvre", limit=3)
+        same = SearchQuery.from_params({"limit": 3, "q": "Louvre", "format": "jsonv2"})
+        assert query is same
+        assert query == same and hash(query) == hash(same)
+        assert query is Builder.search(address="Louvre", limit=3)
+        assert len({query, same, SearchQuery(address="Louvre")}) == 2
+
+    def test_different_types_not_equal(self):
+        """
+        У поиска и обратного геокодинга с одинаковыми params разные ключи
+        """
+        params = {"lat": "48.8611", "lon": "2.3358", "format": "jsonv2"}
+        assert SearchQuery.from_params(params) != ReverseQuery.from_params(params)
+        assert SearchQuery.from_params(params) is not ReverseQuery.from_params(params)
+
+    def test_none_dropped(self):
+        query = SearchQuery(address="Louvre", limit=None, countrycodes=None)
+        assert query.params == (("format", "jsonv2"), ("q", "Louvre"))
+        assert SearchQuery.from_params({"q": "Louvre", "format": "jsonv2", "limit": None}) is query
+        assert Builder.search(structured=True, city="Paris").params_for_api == {"city": "Paris", "format": "jsonv2"}
+
+    def test_immutable(self):
+        query = SearchQuery(address="Louvre")
+        with pytest.raises(AttributeError):
+            query.params = ()
+        with pytest.raises(TypeError):
+            SearchQuery.many(street=["Rue de Rivoli"])
+
+    def test_pickle(self):
+        query = ReverseQuery(lat="48.8611", lon="2.3358")
+        assert pickle.loads(pickle.dumps(query)) is query
+
+    def test_pickle_between_processes(self):
+        """
+        Как между воркерами xdist: запрос из другого процесса равен местному и интернируется в нём заново
+        """
+        queries = [SearchQuery(address="Louvre"), SearchQuery(address="Big Ben", limit=1)]
+        context = multiprocessing.get_context("spawn")
+        to_worker, from_worker = context.Queue(), context.Queue()
+        worker = context.Process(target=echo_queries, args=(to_worker, from_worker))
+        worker.start()
+        try:
+            for query in queries:
+                to_worker.put(query)
+            to_worker.put(None)
+            echoed = [from_worker.get(timeout=30) for _ in queries]
+        finally:
+            worker.join(30)
+        assert [interned_in_worker for query, interned_in_worker in echoed] == [True, True]
+        assert all(query is original for (query, interned), original in zip(echoed, queries))
+
+    def test_many_broadcasts_scalars(self):
+        queries = SearchQuery.many(address=["Louvre", "Big Ben", None], limit=2, countrycodes=("fr", "gb", "de"))
+        assert queries == [
+            SearchQuery(address="Louvre", limit=2, countrycodes="fr"),
+            SearchQuery(address="Big Ben", limit=2, countrycodes="gb"),
+            SearchQuery(limit=2, countrycodes="de"),
+        ]
+        assert queries[0] is SearchQuery(address="Louvre", limit=2, countrycodes="fr")
+        assert ReverseQuery.many(lat="48.8611", lon="2.3358") == [ReverseQuery(lat="48.8611", lon="2.3358")]
+
+    def test_many_different_lengths(self):
+        with pytest.raises(ValueError):
+            ReverseQuery.many(lat=["48.8611", "51.5007"], lon=["2.3358"])
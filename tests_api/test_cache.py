@@ -0,0 +1,117 @@
+import multiprocessing
+import threading
+
+import pytest
+
+import cache
+from cache import LRUCache, ResponseCache, cache_key, canonical_params
+
+
+def store_response(cache_dir, key):
+    response_cache = ResponseCache(cache_dir=cache_dir)
+    response_cache.set(key, 200, [{"display_name": f"written by {multiprocessing.current_process().name}"}])
+    response_cache.close()
+
+
+class TestCanonicalParams:
+    """
+    Тесты на ключи кэша: одинаковые по смыслу запросы дают один ключ
+    """
+
+    def test_order_none_and_spaces(self):
+        assert canonical_params({"q": "  Big   Ben ", "format": "json", "limit": None}) == (
+            ("format", "json"), ("q", "Big Ben")
+        )
+        assert canonical_params([("limit", 3), ("q", "Louvre")]) == (("limit", "3"), ("q", "Louvre"))
+        assert canonical_params(None) == ()
+
+    @pytest.mark.parametrize("params", [{"q": "Big Ben"}, [("q", "Big Ben")], (("q", "Big Ben"),)])
+    def test_params_container_does_not_matter(self, params):
+        assert canonical_params(params) == (("q", "Big Ben"),)
+
+    def test_cache_key(self):
+        url = "http://127.0.0.1:8080/search.php"
+        key = cache_key("get", url, {"q": "Big  Ben", "format": "json", "limit": None})
+        assert key == cache_key("GET", url, {"format": "json", "q": "Big Ben"})
+        assert key != cache_key("GET", url, {"format": "jsonv2", "q": "Big Ben"})
+        assert key != cache_key("GET", "http://127.0.0.1:8081/search.php", {"format": "json", "q": "Big Ben"})
+
+
+class TestLRUCache:
+    def test_least_recently_used_is_evicted(self):
+        lru = LRUCache(maxsize=2, ttl=60)
+        lru.set("a", 1)
+        lru.set("b", 2)
+        assert lru.get("a") == 1
+        lru.set("c", 3)
+        assert (lru.get("a"), lru.get("b"), lru.get("c")) == (1, None, 3)
+        assert (len(lru), lru.evictions) == (2, 1)
+
+    def test_ttl_expiry(self, monkeypatch):
+        now = [1000.0]
+        monkeypatch.setattr(cache.time, "time", lambda: now[0])
+        lru = LRUCache(maxsize=2, ttl=60)
+        lru.set("a", 1)
+        now[0] += 59
+        assert lru.get("a") == 1
+        now[0] += 2
+        assert lru.get("a") is None
+        assert (len(lru), lru.expired) == (0, 1)
+
+
+class TestResponseCache:
+    """
+    Тесты двухуровневого кэша: устаревание на диске, общий для процессов диск и счётчики из потоков
+    """
+
+    def test_disk_tier_expiry(self, tmp_path, monkeypatch):
+        now = [1000.0]
+        monkeypatch.setattr(cache.time, "time", lambda: now[0])
+        response_cache = ResponseCache(cache_dir=str(tmp_path), ttl=60)
+        response_cache.set("key", 200, {"display_name": "Louvre"})
+        response_cache.memory = LRUCache(maxsize=10, ttl=60)
+        assert response_cache.get("key") == (200, {"display_name": "Louvre"})
+        now[0] += 61
+        assert response_cache.get("key") is None
+        stats = response_cache.stats()
+        assert (stats["disk_hits"], stats["misses"], stats["expired"]) == (1, 1, 2)
+        response_cache.close()
+
+    def test_disk_tier_shared_between_processes(self, tmp_path):
+        """
+        Ответы, записанные другими процессами (как воркерами xdist), читаются с диска
+        """
+        keys = [f"key-{number}" for number in range(4)]
+        context = multiprocessing.get_context("fork")
+        workers = [context.Process(target=store_response, args=(str(tmp_path), key)) for key in keys]
+        for worker in workers:
+            worker.start()
+        for worker in workers:
+            worker.join(30)
+            assert worker.exitcode == 0
+        response_cache = ResponseCache(cache_dir=str(tmp_path))
+        for key in keys:
+            status_code, body = response_cache.get(key)
+            assert status_code == 200 and body[0]["display_name"].startswith("written by")
+        assert response_cache.stats()["disk_hits"] == len(keys)
+        assert response_cache.get(keys[0]) is not None
+        assert response_cache.stats()["memory_hits"] == 1
+        response_cache.close()
+
+    def test_counters_from_many_threads(self):
+        response_cache = ResponseCache(maxsize=10)
+        response_cache.set("hit", 200, {})
+        calls = 2000
+
+        def read():
+            for number in range(calls):
+                response_cache.get("hit" if number % 2 else "miss")
+
+        threads = [threading.Thread(target=read) for _ in range(8)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        stats = response_cache.stats()
+        assert (stats["memory_hits"], stats["misses"]) == (8 * calls // 2, 8 * calls // 2)
+
@@ -0,0 +1,79 @@
+import argparse
+import json
+
+import pytest
+
+import geocode_cli
+from apiclient import ApiClient
+
+
+@pytest.mark.API
+class TestGeocodeCli:
+    """
+    Тесты пакетного геокодинга: плохая запись даёт запись с ошибкой в выходе, а не останавливает прогон,
+    и прерванный прогон продолжается с сохранённого места
+    """
+
+    lines = [
+        '{"address": "Louvre"}',
+        '{"address": "Tour Eiffel"',
+        '[48.8584, 2.2945]',
+        '{"address": "Big Ben", "lat": "north", "lon": "-0.1246"}',
+        '{"address": "Московский Кремль"}',
+    ]
+
+    @pytest.fixture
+    def client(self, config, api_cassette):
+        """
+        Свой клиент с кассетой теста; запросы идут по одному, чтобы их порядок совпадал с --replay-strict
+        """
+        client = ApiClient(base_url=config["url"])
+        client.cassette = api_cassette
+        yield client
+        client.close()
+
+    @pytest.fixture
+    def args(self, tmp_path):
+        input_path = tmp_path / "input.jsonl"
+        input_path.write_text("\n".join(self.lines) + "\n", encoding="utf-8")
+        return argparse.Namespace(
+            input=str(input_path), format="auto", mode="auto", output=str(tmp_path / "output.jsonl"),
+            checkpoint=None, checkpoint_every=100, concurrency=1, progress_every=60.0
+        )
+
+    def read_output(self, args):
+        with open(args.output, encoding="utf-8") as output:
+            return [json.loads(line) for line in output]
+
+    def test_bad_rows_do_not_stop_run(self, args, client):
+        geocode_cli.run(args, client)
+        records = self.read_output(args)
+        assert [record["row"] for record in records] == list(range(len(self.lines)))
+        assert [record["status"] for record in records] == ["ok", "error", "error", "error", "ok"]
+        assert records[1]["error"].startswith("cannot parse row")
+        assert "expected a JSON object" in records[2]["error"]
+
+    def test_reverse_mode_without_coordinates(self, client):
+        record = geocode_cli.Geocoder(client, mode="reverse").geocode(0, {"address": "Louvre"})
+        assert record["status"] == "error", f"Expected an error record, got {record}"
+
+    def test_resume_after_crash(self, args, client, monkeypatch):
+        """
+        Прогон падает после записи предпоследней строки (уже после плохих). Прогресс сохраняется и без Ctrl+C,
+        а повторный запуск дописывает оставшиеся записи без повторов
+        """
+        def crash_before_last_row(progress, rows, input_bytes, force=False):
+            if rows == len(self.lines) - 1:
+                raise RuntimeError("crashed")
+
+        with monkeypatch.context() as patch:
+            patch.setattr(geocode_cli.Progress, "update", crash_before_last_row)
+            with pytest.raises(RuntimeError):
+                geocode_cli.run(args, client)
+        with open(f"{args.output}.checkpoint", encoding="utf-8") as checkpoint_file:
+            assert json.load(checkpoint_file)["rows"] == len(self.lines) - 1
+
+        geocode_cli.run(args, client)
+        records = self.read_output(args)
+        assert [record["row"] for record in records] == list(range(len(self.lines)))
+        assert [record["status"] for record in records] == ["ok", "error", "error", "error", "ok"]
@@ -0,0 +1,65 @@
+import pytest
+
+import constants
+from base_case import ApiBase
+from builder import LookupQuery
+
+
+@pytest.mark.API
+class TestLookup(ApiBase):
+    """
+    Тесты для получения деталей мест по OSM id (lookup)
+    """
+
+    parametrize_lookup_data = [
+        {"osm_id": "R2555133", "name": "Московский Кремль"},
+        {"osm_id": "W5013364", "name": "Tour Eiffel"},
+        {"osm_id": "W123557148", "name": "Big Ben"},
+        {"osm_id": "R7515426", "name": "Louvre"},
+    ]
+
+    @pytest.mark.parametrize("valid_lookup_data", parametrize_lookup_data)
+    def test_lookup_parametrized(self, valid_lookup_data):
+        """
+        Параметризированный тест на получение места по OSM id. Как и в обратном геокодинге, в качестве тестовых
+        данных взяты известные места, id и названия которых вряд ли поменяются
+        """
+        place_data = self.lookup_osm_ids([valid_lookup_data["osm_id"]])[0]
+        assert place_data is not None, f"Place {valid_lookup_data['osm_id']} not found"
+        assert (
+            valid_lookup_data["name"] in place_data["display_name"]
+        ), f"Expected {valid_lookup_data['name']} in display_name, got {place_data['display_name']}"
+
+    def test_lookup_keeps_order(self):
+        """
+        Тест на то, что места возвращаются в порядке запрошенных id (в том числе повторяющихся),
+        а на месте несуществующего id стоит None
+        """
+        osm_ids = [data["osm_id"] for data in reversed(self.parametrize_lookup_data)]
+        osm_ids += ["N0", osm_ids[0].lower()]
+        places = self.lookup_osm_ids(osm_ids, places=True)
+        assert len(places) == len(osm_ids), f"Expected {len(osm_ids)} results, got {len(places)}"
+        for osm_id, place in zip(osm_ids[:-2], places):
+            assert (
+                place is not None and f"{place['osm_type'][0].upper()}{place['osm_id']}" == osm_id
+            ), f"Expected place {osm_id}, got {place}"
+        assert places[-2] is None, f"Expected None for non-existent id, got {places[-2]}"
+        assert places[-1] is places[0], "Expected the same place for repeated id"
+
+    def test_lookup_batches(self):
+        """
+        Тест на раскладку id по запросам: не больше constants.LOOKUP_MAX_IDS id в запросе, повторы отправляются один раз
+        """
+        osm_ids = [f"N{number}" for number in range(1, constants.LOOKUP_MAX_IDS * 2 + 2)]
+        batches = LookupQuery.batches(osm_ids + osm_ids[:10])
+        assert [len(batch_ids) for batch_ids, _ in batches] == [constants.LOOKUP_MAX_IDS, constants.LOOKUP_MAX_IDS, 1]
+        assert [osm_id for batch_ids, _ in batches for osm_id in batch_ids] == osm_ids
+        places = self.lookup_osm_ids(osm_ids[:constants.LOOKUP_MAX_IDS + 1])
+        assert len(places) == constants.LOOKUP_MAX_IDS + 1, f"Expected one result per id, got {len(places)}"
+
+    def test_wrong_osm_id(self):
+        """
+        Тест на id без типа объекта - ошибка ещё до запроса
+        """
+        with pytest.raises(ValueError):
+            self.lookup_osm_ids(["5013364"])
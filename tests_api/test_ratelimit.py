@@ -0,0 +1,122 @@
+import multiprocessing
+import time
+
+import pytest
+import requests
+
+import apiclient
+import constants
+from apiclient import ApiClient
+from ratelimit import SharedTokenBucket
+
+
+def acquire_tokens(state_path, rate, count, times):
+    bucket = SharedTokenBucket(state_path, rate=rate)
+    for _ in range(count):
+        bucket.acquire()
+        times.put(time.time())
+
+
+class TestSharedTokenBucket:
+    """
+    Тесты на ведро токенов, общее для процессов через файл состояния
+    """
+
+    rate = 20.0
+
+    def run_processes(self, state_path, processes=3, count=4):
+        context = multiprocessing.get_context("fork")
+        times = context.Queue()
+        workers = [
+            context.Process(target=acquire_tokens, args=(state_path, self.rate, count, times))
+            for _ in range(processes)
+        ]
+        for worker in workers:
+            worker.start()
+        grants = sorted(times.get(timeout=30) for _ in range(processes * count))
+        for worker in workers:
+            worker.join(30)
+            assert worker.exitcode == 0, f"Worker failed with exit code {worker.exitcode}"
+        return grants
+
+    def test_rate_is_shared_between_processes(self, tmp_path):
+        """
+        Три процесса вместе получают токены не быстрее rate: первый токен сразу (burst=1), остальные - по одному
+        в 1/rate секунд на все процессы, а не на каждый
+        """
+        grants = self.run_processes(str(tmp_path / "bucket.json"))
+        span = grants[-1] - grants[0]
+        expected = (len(grants) - 1) / self.rate
+        assert span >= expected * 0.9, f"{len(grants)} tokens granted in {span:.3f}s, expected at least {expected:.3f}s"
+        assert span < expected + 2.0, f"{len(grants)} tokens granted in {span:.3f}s, expected about {expected:.3f}s"
+
+    def test_retry_after_blocks_other_processes(self, tmp_path):
+        """
+        Retry-After, полученный одним процессом, останавливает выдачу токенов и в других
+        """
+        state_path = str(tmp_path / "bucket.json")
+        SharedTokenBucket(state_path, rate=self.rate).on_throttled(retry_after=0.5)
+        started = time.time()
+        grants = self.run_processes(state_path, processes=2, count=1)
+        assert grants[0] - started >= 0.45, f"Token granted {grants[0] - started:.3f}s after Retry-After of 0.5s"
+
+    def test_throttling_slows_down_and_recovers(self, tmp_path):
+        bucket = SharedTokenBucket(str(tmp_path / "bucket.json"), rate=self.rate)
+        bucket.on_throttled()
+        slowed = bucket._update(lambda state, now: state["rate"])
+        assert slowed < self.rate
+        for _ in range(100):
+            bucket.on_success()
+        assert bucket._update(lambda state, now: state["rate"]) == pytest.approx(self.rate)
+        assert bucket.stats()["throttled"] == 1
+
+
+class TestRetryAfter:
+    """
+    Тесты на паузы по Retry-After в ApiClient: сервер без ответов отдаёт 429 с заданным Retry-After
+    """
+
+    @pytest.fixture
+    def throttled_client(self, tmp_path, monkeypatch):
+        """
+        Клиент, которому сервер всегда отвечает 429 с Retry-After из client.retry_after, и список его пауз
+        (повторы и ожидание токена, которое ведро продлевает на Retry-After)
+        """
+        client = ApiClient(
+            base_url="http://127.0.0.1:9", rate_limiter=SharedTokenBucket(str(tmp_path / "bucket.json"), rate=1000.0)
+        )
+        client.retry_after = "1"
+        pauses = []
+
+        def send(method, url, data, params, deadline):
+            response = requests.Response()
+            response.status_code = 429
+            response.headers["Retry-After"] = client.retry_after
+            return response
+
+        monkeypatch.setattr(client, "_send_routed", send)
+        monkeypatch.setattr(apiclient.time, "sleep", pauses.append)
+        yield client, pauses
+        client.close()
+
+    def test_short_retry_after_is_waited(self, throttled_client):
+        client, pauses = throttled_client
+        response = client._send_network("GET", f"{client.base_url}/search", None, {})
+        assert response.status_code == 429
+        assert client.retries == client.max_retries
+        assert pauses and min(pauses) >= 0.99, f"Expected pauses of at least Retry-After, got {pauses}"
+        assert max(pauses) <= constants.RETRY_BACKOFF_MAX
+
+    def test_long_retry_after_gives_up(self, throttled_client):
+        """
+        Retry-After в час не усыпляет воркер: ответ возвращается сразу, а остальных воркеров ведро держит
+        не дольше constants.RETRY_BACKOFF_MAX
+        """
+        client, pauses = throttled_client
+        client.retry_after = "3600"
+        started = time.time()
+        response = client._send_network("GET", f"{client.base_url}/search", None, {})
+        assert response.status_code == 429
+        assert pauses == []
+        blocked_until = client.rate_limiter._update(lambda state, now: state["blocked_until"])
+        assert blocked_until <= started + constants.RETRY_BACKOFF_MAX + 1
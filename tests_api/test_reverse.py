@@ -2,6 +2,7 @@ import pytest
 
 import apis
 import constants
+import validation
 from base_case import ApiBase
 
 
@@ -93,3 +94,20 @@ class TestReverse(ApiBase):
             lat=lat,
             lon=lon,
         )
+
+    def test_reverse_golden(self, golden_reverse_chunk):
+        """
+        Проверка обратного геокодинга по куску эталонного файла (--golden-reverse). Точки куска отправляются пакетом,
+        а в display_name каждого ответа должно встречаться эталонное name. В отчёте перечисляются все упавшие строки
+        """
+        rows = list(golden_reverse_chunk.rows())
+        if not rows:
+            pytest.skip(f"no rows in {golden_reverse_chunk}")
+        params_list = [self.builder.reverse(lat=row["lat"], lon=row["lon"]).params_for_api for _, row in rows]
+        responses = self.reverse_many(params_list)
+        report = validation.validate_display_names(
+            [response.get("display_name") if isinstance(response, dict) else None for response in responses],
+            [row["name"] for _, row in rows]
+        )
+        report = validation.with_request_errors(report, responses)
+        golden_reverse_chunk.relabel(report, [offset for offset, _ in rows]).assert_ok()
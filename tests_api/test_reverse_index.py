@@ -0,0 +1,87 @@
+import pytest
+
+import apis
+from apiclient import ApiClient
+from geo import haversine_km
+from spatial_index import ReverseIndex
+
+
+@pytest.mark.API
+class TestReverseIndex:
+    """
+    Тесты индекса обратного геокодинга (--reverse-radius-m): из индекса отдаются только ответы на запросы
+    с теми же параметрами, кроме координат
+    """
+
+    @pytest.fixture
+    def indexed_client(self, config, api_cassette):
+        """
+        Клиент со своим индексом и список источников ответов (network, reverse_index) его запросов по порядку.
+        Клиенту подключается кассета теста, как api_client, а ответ из кассеты считается ответом api
+        """
+        client = ApiClient(base_url=config["url"], reverse_index=ReverseIndex(radius_km=0.1))
+        client.cassette = api_cassette
+        sources = []
+        client.timing_hooks.append(
+            lambda record: sources.append("network" if record.source == "cassette" else record.source)
+        )
+        yield client, sources
+        client.close()
+
+    def reverse(self, client, **params):
+        return client.request_custom(
+            method="GET", location=apis.REVERSE_API_LOCATION, params={"lat": "51.5007", "lon": "-0.1246", **params}
+        )
+
+    def test_same_params_served_from_index(self, indexed_client):
+        """
+        Повтор того же запроса отдаётся из индекса тем же ответом
+        """
+        client, sources = indexed_client
+        first = self.reverse(client, format="jsonv2")
+        second = self.reverse(client, format="jsonv2")
+        assert sources == ["network", "reverse_index"], f"Expected second request from index, got {sources}"
+        assert second == first
+
+    def test_other_params_not_served_from_index(self, indexed_client):
+        """
+        Тот же пункт с другими format, zoom или языком - это другой ответ api, индекс его отдавать не должен
+        """
+        client, sources = indexed_client
+        self.reverse(client, format="jsonv2")
+        self.reverse(client, format="json", zoom="3")
+        self.reverse(client, **{"format": "jsonv2", "accept-language": "en"})
+        assert sources == ["network"] * 3, f"Expected every request to go to api, got {sources}"
+
+
+class TestReverseIndexGrid:
+    """
+    Тесты поиска соседей по сетке индекса там, где сетка рвётся: у полюсов и на линии перемены дат
+    """
+
+    @pytest.mark.parametrize("known, query, radius_km", [
+        ((10.0, 179.9995), (10.0, -179.9995), 0.5),
+        ((-45.0, -179.999), (-45.0, 179.999), 0.5),
+        ((89.99, 0.0), (89.99, 179.0), 5.0),
+        ((-89.995, 90.0), (-89.995, -90.0), 2.0),
+        ((90.0, 0.0), (89.999, -120.0), 0.5),
+    ])
+    def test_neighbour_across_grid_seam(self, known, query, radius_km):
+        """
+        Точки рядом по расстоянию, но в далёких ячейках сетки: ответ должен найтись и поштучно, и пакетно
+        """
+        assert haversine_km(*known, *query) <= radius_km
+        index = ReverseIndex(radius_km=radius_km)
+        index.add(*known, {"display_name": "known"})
+        assert index.lookup(*query) == {"display_name": "known"}
+        assert index.lookup_many([query[0]], [query[1]]) == [{"display_name": "known"}]
+
+    @pytest.mark.parametrize("known, query", [
+        ((10.0, 179.99), (10.0, -179.0)),
+        ((89.0, 0.0), (89.0, 180.0)),
+    ])
+    def test_far_point_not_found(self, known, query):
+        index = ReverseIndex(radius_km=1.0)
+        index.add(*known, {"display_name": "known"})
+        assert index.lookup(*query) is None
+        assert index.lookup_many([query[0]], [query[1]]) == [None]
@@ -0,0 +1,148 @@
+import socket
+import time
+
+import pytest
+
+import apis
+import cassette
+import constants
+from apiclient import ApiClient
+from router import Router
+from stub_server import StubNominatimServer
+
+
+def closed_port_url():
+    """
+    Адрес, на котором никто не слушает: порт занимается и сразу освобождается
+    """
+    with socket.socket() as probe:
+        probe.bind(("127.0.0.1", 0))
+        port = probe.getsockname()[1]
+    return f"http://127.0.0.1:{port}"
+
+
+class TestRouter:
+    """
+    Тесты на порядок выбора серверов роутером. explore=0, чтобы случайные пробы не мешали порядку
+    """
+
+    urls = ["http://first:8080", "http://second:8080", "http://third:8080"]
+
+    def test_untried_endpoints_first(self):
+        router = Router(self.urls, explore=0)
+        chosen = []
+        for _ in self.urls:
+            endpoint = router.choose()
+            chosen.append(endpoint.base_url)
+            router.record(endpoint, 0.1)
+        assert chosen == self.urls
+
+    def test_fastest_endpoint_wins(self):
+        router = Router(self.urls, explore=0)
+        for endpoint, seconds in zip(router.endpoints, (0.3, 0.05, 0.2)):
+            router.record(endpoint, seconds)
+        assert router.choose() is router.endpoints[1]
+
+    def test_failing_endpoint_loses_to_slow_one(self):
+        """
+        Ошибка стоит constants.ROUTER_ERROR_COST секунд, поэтому быстрый, но отказывающий сервер уступает
+        медленному рабочему, а после успехов постепенно возвращается
+        """
+        router = Router(self.urls[:2], explore=0)
+        fast, slow = router.endpoints
+        router.record(fast, 0.01)
+        router.record(slow, 0.5)
+        for _ in range(5):
+            router.record(fast, 0.01, error=True)
+        assert router.choose() is slow
+        for _ in range(20):
+            router.record(fast, 0.01)
+        assert router.choose() is fast
+
+    def test_exclude(self):
+        router = Router(self.urls, explore=0)
+        first = router.choose()
+        second = router.choose(exclude=(first,))
+        assert second is not first
+        assert router.choose(exclude=router.endpoints) in router.endpoints, "All excluded falls back to all endpoints"
+
+
+@pytest.mark.API
+class TestFailover:
+    """
+    Тест на повтор запроса на другом сервере при ошибке соединения
+    """
+
+    def test_connection_error_fails_over(self, config, api_cassette):
+        if api_cassette is not None and api_cassette.mode in (cassette.REPLAY, cassette.REPLAY_STRICT):
+            pytest.skip("failover between servers needs the network, not a cassette")
+        client = ApiClient(base_url=[closed_port_url(), config["url"]], max_retries=2)
+        client.router.explore = 0
+        try:
+            response = client.request_custom(
+                method="GET", location=apis.REVERSE_API_LOCATION, params={"lat": "51.5007", "lon": "-0.1246"}
+            )
+            stats = client.router.stats()
+        finally:
+            client.close()
+        assert "display_name" in response
+        assert (stats["requests[0]"], stats["errors[0]"]) == (1, 1), f"Expected one failed attempt, got {stats}"
+        assert (stats["requests[1]"], stats["errors[1]"]) == (1, 0), f"Expected one good attempt, got {stats}"
+        assert client.retries == 1
+
+
+class TestHedging:
+    """
+    Тесты на подстраховку (hedge=True) на двух своих локальных заглушках: медленной и быстрой. Замеры роутера
+    задаются заранее, чтобы первым выбирался нужный сервер, а задержка подстраховки (p95) была известна
+    """
+
+    @pytest.fixture
+    def servers(self):
+        slow = StubNominatimServer(latency=0.5).start()
+        fast = StubNominatimServer().start()
+        yield slow, fast
+        slow.stop()
+        fast.stop()
+
+    @pytest.fixture
+    def hedged_client(self, servers):
+        client = ApiClient(base_url=[server.url for server in servers], hedge=True)
+        client.router.explore = 0
+        yield client
+        client.close()
+
+    def train(self, router, seconds_by_endpoint):
+        for endpoint, seconds in zip(router.endpoints, seconds_by_endpoint):
+            for _ in range(constants.ROUTER_HEDGE_MIN_SAMPLES):
+                router.record(endpoint, seconds)
+
+    def reverse(self, client):
+        return client.request_custom(
+            method="GET", location=apis.REVERSE_API_LOCATION, params={"lat": "51.5007", "lon": "-0.1246"}
+        )
+
+    def test_slow_primary_is_hedged(self, hedged_client):
+        """
+        Медленный сервер по замерам лучший (p95 20 мс), но отвечает за 500 мс: через 20 мс запрос дублируется
+        на быстрый, и берётся его ответ
+        """
+        router = hedged_client.router
+        self.train(router, (0.02, 0.05))
+        slow, fast = router.endpoints
+        assert router.choose() is slow
+        assert router.hedge_delay(slow) == pytest.approx(0.02, rel=0.1)
+        started = time.perf_counter()
+        response = self.reverse(hedged_client)
+        elapsed = time.perf_counter() - started
+        assert "display_name" in response
+        assert (router.hedges, router.hedge_wins) == (1, 1), f"Got {router.stats()}"
+        assert elapsed < 0.4, f"Hedged request took {elapsed:.3f}s, the slow server answers in 0.5s"
+
+    def test_fast_primary_is_not_hedged(self, hedged_client):
+        router = hedged_client.router
+        self.train(router, (1.0, 0.2))
+        assert router.choose() is router.endpoints[1]
+        for _ in range(3):
+            assert "display_name" in self.reverse(hedged_client)
+        assert (router.hedges, router.hedge_wins) == (0, 0), f"Got {router.stats()}"
@@ -2,6 +2,7 @@ import pytest
 
 import apis
 import constants
+import validation
 from base_case import ApiBase
 
 
@@ -167,6 +168,28 @@ class TestSimpleSearch(ApiBase):
             jsonify=False
         )
 
+    def test_search_golden(self, golden_search_chunk):
+        """
+        Проверка прямого геокодинга по куску эталонного файла (--golden-search). Адреса куска отправляются пакетом,
+        а координаты первого места в каждом ответе сверяются с эталонными по расстоянию с допуском tolerance_km
+        из строки (или constants.GOLDEN_TOLERANCE_KM). В отчёте перечисляются все упавшие строки
+        """
+        rows = list(golden_search_chunk.rows())
+        if not rows:
+            pytest.skip(f"no rows in {golden_search_chunk}")
+        params_list = [self.builder.search(address=row["name"]).params_for_api for _, row in rows]
+        responses = self.search_many(params_list)
+        first_places = [response[0] if isinstance(response, list) and response else {} for response in responses]
+        report = validation.validate_coordinates(
+            [row["lat"] for _, row in rows],
+            [row["lon"] for _, row in rows],
+            [place.get("lat") for place in first_places],
+            [place.get("lon") for place in first_places],
+            [row.get("tolerance_km") or constants.GOLDEN_TOLERANCE_KM for _, row in rows]
+        )
+        report = validation.with_request_errors(report, responses)
+        golden_search_chunk.relabel(report, [offset for offset, _ in rows]).assert_ok()
+
 
 @pytest.mark.API
 class TestStructuredSearch(ApiBase):
@@ -0,0 +1,87 @@
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+
+from singleflight import SingleFlight
+
+
+class TestSingleFlight:
+    """
+    Тесты на склейку одинаковых запросов в полёте
+    """
+
+    followers = 4
+
+    def run_concurrently(self, single_flight, key, function):
+        """
+        Ведущий вызов держится, пока все ведомые не встанут в ожидание. Возвращает результаты (или исключения)
+        ведущего и ведомых
+        """
+        started = threading.Event()
+        release = threading.Event()
+
+        def leader_function():
+            started.set()
+            release.wait(10)
+            return function()
+
+        def call(function):
+            try:
+                return single_flight.do(key, function)
+            except Exception as error:
+                return error
+
+        with ThreadPoolExecutor(max_workers=self.followers + 1) as executor:
+            leader = executor.submit(call, leader_function)
+            assert started.wait(10), "Leader call did not start"
+            followers = [executor.submit(call, lambda: pytest.fail("Follower called upstream"))
+                         for _ in range(self.followers)]
+            while single_flight.coalesced < self.followers:
+                time.sleep(0.01)
+            release.set()
+            return leader.result(), [follower.result() for follower in followers]
+
+    def test_followers_share_leader_result(self):
+        single_flight = SingleFlight()
+        result = {"place_id": 1}
+        leader, followers = self.run_concurrently(single_flight, "search?q=Louvre", lambda: result)
+        assert leader is result
+        assert all(follower is result for follower in followers)
+        assert single_flight.stats() == {
+            "upstream": 1, "coalesced": self.followers, "shared": 0, "saved": self.followers
+        }
+
+    def test_followers_get_leader_error(self):
+        single_flight = SingleFlight()
+        error = ValueError("upstream failed")
+
+        def fail():
+            raise error
+
+        leader, followers = self.run_concurrently(single_flight, "search?q=Louvre", fail)
+        assert leader is error
+        assert all(follower is error for follower in followers)
+        assert single_flight.upstream == 1
+
+    def test_key_is_released_after_call(self):
+        """
+        После завершения вызова (успешного или с ошибкой) следующий вызов с тем же ключом снова идёт в api
+        """
+        single_flight = SingleFlight()
+        with pytest.raises(ValueError):
+            single_flight.do("key", lambda: int("not a number"))
+        assert single_flight.do("key", lambda: 1) == 1
+        assert single_flight.do("key", lambda: 2) == 2
+        assert single_flight.upstream == 3
+        assert single_flight.coalesced == 0
+
+    def test_shared_result_skips_upstream(self, tmp_path):
+        """
+        С lock_dir процесс, дождавшийся блокировки, сначала берёт готовый результат через shared
+        """
+        single_flight = SingleFlight(lock_dir=str(tmp_path))
+        assert single_flight.do("key", lambda: pytest.fail("Called upstream"), shared=lambda: "cached") == "cached"
+        assert single_flight.do("other", lambda: "fresh", shared=lambda: None) == "fresh"
+        assert (single_flight.upstream, single_flight.shared) == (1, 1)
@@ -0,0 +1,81 @@
+import pytest
+
+import validation
+from base_case import ApiBase
+
+
+class TestDisplayNamesBatch:
+    """
+    Пакетная проверка display_name (validation.validate_display_names) должна падать ровно на тех строках,
+    на которых падает поштучная ApiBase.assert_display_name_from_response
+    """
+
+    display_names = [
+        "Big Ben, Westminster, London, England",
+        "Московский Кремль, Москва, Россия",
+        "Tour Eiffel, Paris, France",
+        "Louvre, Paris",
+        "",
+        "Zürich, Schweiz",
+        "big ben, london",
+    ]
+    expected_words = [
+        ["Big Ben", "London"],
+        ["Кремль"],
+        ["Eiffel", "Berlin"],
+        [],
+        ["Paris"],
+        ["Zürich", "Schweiz"],
+        ["Big Ben"],
+    ]
+
+    def per_item_failures(self, display_names, expected_words):
+        api_base = ApiBase()
+        failed = []
+        for index, (display_name, words) in enumerate(zip(display_names, expected_words)):
+            try:
+                api_base.assert_display_name_from_response({"display_name": display_name}, words)
+            except AssertionError:
+                failed.append(index)
+        return failed
+
+    def test_batch_matches_per_item(self):
+        report = validation.validate_display_names(self.display_names, self.expected_words)
+        assert report.failed_indices == self.per_item_failures(self.display_names, self.expected_words)
+        assert report.failed_indices == [2, 4, 6]
+        assert report.total == len(self.display_names)
+
+    def test_failure_message_lists_missing_tokens(self):
+        report = validation.validate_display_names(self.display_names, self.expected_words)
+        assert report.failures[0].message == (
+            "expected ['Berlin'] in display_name, got 'Tour Eiffel, Paris, France'"
+        )
+        with pytest.raises(AssertionError, match="display names: 3 of 7 rows failed"):
+            report.assert_ok()
+
+    def test_string_is_one_token(self):
+        """
+        Строка вместо списка - один токен целиком, а не набор символов
+        """
+        report = validation.validate_display_names(["Big Ben", "Ben Big"], ["Big Ben", "Big Ben"])
+        assert report.failed_indices == [1]
+
+    def test_none_display_name_fails(self):
+        report = validation.validate_display_names([None, "Louvre"], [["Louvre"], ["Louvre"]])
+        assert report.failed_indices == [0]
+
+    def test_request_errors_replace_check_failures(self):
+        """
+        Строка с упавшим запросом отмечается исключением запроса, а не пустым display_name
+        """
+        responses = [{"display_name": "Louvre, Paris"}, ValueError("Expected status code 200, got 502"), None]
+        report = validation.with_request_errors(
+            validation.validate_display_names(
+                [response.get("display_name") if isinstance(response, dict) else None for response in responses],
+                [["Louvre"], ["Louvre"], ["Louvre"]]
+            ),
+            responses
+        )
+        assert report.failed_indices == [1, 2]
+        assert report.failures[0].message == "request failed: ValueError('Expected status code 200, got 502')"
+        assert report.failures[1].message.startswith("expected ['Louvre'] in display_name")
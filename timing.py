@@ -0,0 +1,112 @@
+import threading
+from dataclasses import asdict, dataclass, field
+
+from histogram import LatencyHistogram
+
+_local = threading.local()
+
+
+@dataclass
+class RequestTiming:
+    """
+    Замеры одного запроса через ApiClient.request_custom. Все времена - в секундах.
+    connect - установка TCP соединения, tls - TLS рукопожатие (оба 0, если соединение взято из пула),
+    ttfb - от отправки запроса до получения заголовков ответа за вычетом connect и tls,
+    download - чтение тела ответа, json_decode - разбор json, total - весь вызов request_custom.
+    source - откуда пришёл ответ: network, cassette, cache, reverse_index, address_index или coalesced
+    (ответ склеенного запроса).
+    retries - сколько раз запрос повторялся после 429/503, throttle_wait - сколько он ждал ограничителя скорости,
+    hedged - отправлялся ли дублирующий запрос на другой сервер, url - сервер, чей ответ был взят
+    """
+
+    method: str
+    endpoint: str
+    url: str
+    tags: dict = field(default_factory=dict)
+    source: str = "network"
+    status: int = None
+    connect: float = 0.0
+    tls: float = 0.0
+    ttfb: float = 0.0
+    download: float = 0.0
+    json_decode: float = 0.0
+    total: float = 0.0
+    request_bytes: int = 0
+    response_bytes: int = 0
+    retries: int = 0
+    throttle_wait: float = 0.0
+    hedged: bool = False
+
+    def to_dict(self):
+        return asdict(self)
+
+
+def activate(record):
+    """
+    Делает record текущим замером потока, чтобы в него могли писать слои ниже (например, установка соединения)
+    """
+    previous = getattr(_local, "record", None)
+    _local.record = record
+    return previous
+
+
+def deactivate(previous):
+    _local.record = previous
+
+
+def current():
+    return getattr(_local, "record", None)
+
+
+def record_connect(tcp_seconds, tls_seconds):
+    record = current()
+    if record is not None:
+        record.connect += tcp_seconds
+        record.tls += tls_seconds
+
+
+def request_size(prepared_request):
+    """
+    Примерный размер запроса на проводе: стартовая строка, заголовки и тело
+    """
+    size = len(f"{prepared_request.method} {prepared_request.path_url} HTTP/1.1\r\n")
+    size += sum(len(name) + len(value) + 4 for name, value in prepared_request.headers.items()) + 2
+    body = prepared_request.body
+    if body:
+        size += len(body)
+    return size
+
+
+class TimingReport:
+    def __init__(self):
+        """
+        Сборщик замеров запросов за прогон: самые медленные вызовы и перцентили по эндпоинтам
+        """
+        self.records = []
+
+    def add(self, record):
+        self.records.append(record.to_dict() if isinstance(record, RequestTiming) else record)
+
+    def extend(self, records):
+        for record in records:
+            self.add(record)
+
+    def slowest(self, count):
+        return sorted(self.records, key=lambda record: record["total"], reverse=True)[:count]
+
+    def endpoint_summary(self):
+        """
+        Для каждого эндпоинта и каждой фазы запроса - перцентили в миллисекундах
+        """
+        histograms = {}
+        for record in self.records:
+            phases = histograms.setdefault(record["endpoint"], {})
+            for phase in ("throttle_wait", "connect", "tls", "ttfb", "download", "json_decode", "total"):
+                phases.setdefault(phase, LatencyHistogram()).record(record[phase])
+        return {
+            endpoint: {phase: histogram.summary_ms() for phase, histogram in phases.items()}
+            for endpoint, phases in histograms.items()
+        }
+
+    def to_dict(self):
+        return {"summary": self.endpoint_summary(), "requests": self.records}
@@ -0,0 +1,123 @@
+from dataclasses import dataclass
+
+import numpy as np
+
+import constants
+from geo import haversine_km_array
+
+_strings = getattr(np, "strings", np.char)
+
+
+@dataclass
+class ValidationFailure:
+    index: int
+    message: str
+
+
+class ValidationReport:
+    def __init__(self, name, total, failures):
+        """
+        Результат пакетной проверки: сколько строк проверено и все упавшие строки с индексами
+        """
+        self.name = name
+        self.total = total
+        self.failures = failures
+
+    @property
+    def ok(self):
+        return not self.failures
+
+    @property
+    def failed_indices(self):
+        return [failure.index for failure in self.failures]
+
+    def summary(self, limit=constants.VALIDATION_REPORT_LIMIT):
+        lines = [f"{self.name}: {len(self.failures)} of {self.total} rows failed"]
+        lines += [f"  [{failure.index}] {failure.message}" for failure in self.failures[:limit]]
+        if len(self.failures) > limit:
+            lines.append(f"  ... and {len(self.failures) - limit} more")
+        return "\n".join(lines)
+
+    def assert_ok(self):
+        assert self.ok, self.summary()
+
+
+def _to_float_array(values):
+    """
+    Перевод колонки координат (строки из ответа api, числа) в float64; то, что не парсится, становится NaN
+    """
+    try:
+        return np.asarray(values, dtype=np.float64)
+    except (TypeError, ValueError):
+        converted = []
+        for value in values:
+            try:
+                converted.append(float(value))
+            except (TypeError, ValueError):
+                converted.append(np.nan)
+        return np.asarray(converted, dtype=np.float64)
+
+
+def validate_coordinates(expected_lats, expected_lons, actual_lats, actual_lons, tolerance_km):
+    """
+    Пакетная проверка координат: расстояние по haversine между ожидаемыми и полученными точками считается одним
+    векторным проходом и сравнивается с допуском tolerance_km (одно число или свой допуск на каждую строку).
+    Непарсящиеся координаты считаются ошибкой
+    """
+    expected_lats = _to_float_array(expected_lats)
+    expected_lons = _to_float_array(expected_lons)
+    actual_lats = _to_float_array(actual_lats)
+    actual_lons = _to_float_array(actual_lons)
+    tolerance_km = np.broadcast_to(np.asarray(tolerance_km, dtype=np.float64), expected_lats.shape)
+
+    distances = haversine_km_array(expected_lats, expected_lons, actual_lats, actual_lons)
+    failed = np.flatnonzero(~(distances <= tolerance_km))
+    failures = [
+        ValidationFailure(
+            int(index),
+            f"expected ({expected_lats[index]}, {expected_lons[index]}), got ({actual_lats[index]}, "
+            f"{actual_lons[index]}): {distances[index]:.3f} km > tolerance {tolerance_km[index]} km"
+        )
+        for index in failed
+    ]
+    return ValidationReport("coordinates", len(expected_lats), failures)
+
+
+def validate_display_names(display_names, expected_tokens):
+    """
+    Пакетная проверка display_name: в каждой строке должны встречаться все её ожидаемые токены (как подстроки,
+    с учётом регистра - так же, как в ApiBase.assert_display_name_from_response). expected_tokens - список токенов
+    на каждую строку, строка вместо списка считается одним токеном. Все пары (строка, токен) разворачиваются
+    в плоские массивы и проверяются одним векторным поиском подстрок
+    """
+    expected_tokens = [[tokens] if isinstance(tokens, str) else list(tokens) for tokens in expected_tokens]
+    names = np.asarray(["" if name is None else str(name) for name in display_names], dtype=str)
+    counts = np.fromiter((len(tokens) for tokens in expected_tokens), dtype=np.int64, count=len(expected_tokens))
+    rows = np.repeat(np.arange(len(expected_tokens)), counts)
+    flat_tokens = np.asarray([token for tokens in expected_tokens for token in tokens], dtype=str)
+
+    if flat_tokens.size:
+        missing = _strings.find(names[rows], flat_tokens) < 0
+    else:
+        missing = np.zeros(0, dtype=bool)
+    missing_by_row = {}
+    for row, token in zip(rows[missing].tolist(), flat_tokens[missing].tolist()):
+        missing_by_row.setdefault(row, []).append(token)
+
+    failures = [
+        ValidationFailure(row, f"expected {tokens} in display_name, got {str(names[row])!r}")
+        for row, tokens in missing_by_row.items()
+    ]
+    return ValidationReport("display names", len(expected_tokens), failures)
+
+
+def with_request_errors(report, responses):
+    """
+    Отчёт, в котором строки с упавшим запросом (исключение вместо ответа, как из ApiBase.search_many) отмечены
+    самим исключением, а не ошибкой проверки пустого ответа
+    """
+    errors = {index: response for index, response in enumerate(responses) if isinstance(response, Exception)}
+    failures = [
+        ValidationFailure(index, f"request failed: {error!r}") for index, error in errors.items()
+    ] + [failure for failure in report.failures if failure.index not in errors]
+    return ValidationReport(report.name, report.total, sorted(failures, key=lambda failure: failure.index))